@@ -0,0 +1,86 @@
+"""
+Latency of a single /add_student submission.
+
+Times the original path (one statement per table, up to six round-trips)
+against the single chained-CTE statement the route now runs, for a minimal
+form (names and location) and a full one (every optional field). Each
+submission is its own transaction and is rolled back. Use --delay-ms to add
+a simulated network round-trip per statement when the database is local:
+
+    DATABASE_URL=postgresql://localhost/proj1part2 python bench/add_student.py -n 200 --delay-ms 1
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+import server
+from import_students import ROW_STATEMENTS
+from loadtest import percentile
+
+
+def form(conn, full):
+	params = {
+		'first_name': 'Latency', 'last_name': 'Bench', 'email': None,
+		'location_id': conn.execute(text("SELECT MIN(loc_id) FROM jc6292.location")).scalar(),
+		'industry_id': None, 'club_id': None, 'graduation_year': None, 'degree': None,
+	}
+	if full:
+		params.update(
+			email='latency@example.com',
+			industry_id=conn.execute(text("SELECT MIN(industry_id) FROM jc6292.industry")).scalar(),
+			club_id=conn.execute(text("SELECT MIN(club_id) FROM jc6292.club")).scalar(),
+			graduation_year=2024, degree='BS',
+		)
+	return params
+
+
+def sequential(conn, params, delay):
+	params = dict(params)
+	statements = 0
+	for statement, needs in ROW_STATEMENTS:
+		if needs and not params[needs]:
+			continue
+		time.sleep(delay)
+		result = conn.execute(text(statement), params)
+		statements += 1
+		if statement.endswith('RETURNING student_id'):
+			params['student_id'] = result.scalar()
+	return statements
+
+
+def single(conn, params, delay):
+	time.sleep(delay)
+	conn.execute(text(server.ADD_STUDENT_QUERY), params).scalar()
+	return 1
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('-n', '--submissions', type=int, default=200)
+	parser.add_argument('--delay-ms', type=float, default=0.0)
+	args = parser.parse_args()
+	delay = args.delay_ms / 1000.0
+
+	with server.engine.connect() as conn:
+		print("%-8s %-12s %11s %9s %9s" % ('form', 'path', 'statements', 'p50 ms', 'p99 ms'))
+		for label, full in [('minimal', False), ('full', True)]:
+			params = form(conn, full)
+			conn.rollback()
+			for name, method in [('sequential', sequential), ('cte', single)]:
+				timings = []
+				for _ in range(args.submissions):
+					started = time.perf_counter()
+					statements = method(conn, params, delay)
+					timings.append((time.perf_counter() - started) * 1000)
+					conn.rollback()
+				print("%-8s %-12s %11d %9.2f %9.2f" % (
+					label, name, statements, percentile(timings, 50), percentile(timings, 99)))
+
+
+if __name__ == '__main__':
+	main()
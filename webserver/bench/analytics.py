@@ -0,0 +1,98 @@
+"""
+Compare the analytics rollups with computing the same aggregates on the fly.
+
+Adds synthetic alumni (bench/synthetic.py) inside a transaction, in steps up to
+each size given. At every step it compacts the queued deltas, times each
+/analytics section read from the rollup tables and from the base tables
+(load_analytics(live=True)) and checks the two agree; at the end it times
+add_student with and without the analytics triggers. Everything is rolled back.
+Needs the analytics migration (`python server.py migrate`); point DATABASE_URL
+at a local database, not the shared course server:
+
+    DATABASE_URL=postgresql://localhost/proj1part2 python bench/analytics.py -n 1000 10000 50000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+import server
+from synthetic import generate_alumni
+from loadtest import percentile
+
+
+def time_section(conn, section, live, repeat):
+	timings = []
+	for _ in range(repeat):
+		started = time.perf_counter()
+		server.load_analytics(conn, sections=[section], live=live)
+		timings.append((time.perf_counter() - started) * 1000)
+	return percentile(timings, 50)
+
+
+def time_add_student(conn, repeat):
+	"""
+	p50 ms of ADD_STUDENT_QUERY with a job and a graduation year, so the pair triggers do work.
+	The synthetic data is skewed toward low ids, so the highest ids keep the location
+	summary refresh, which every add_student pays, small.
+	"""
+	params = conn.execute(text("""
+		SELECT 'Bench', 'Analytics', NULL, MAX(l.loc_id), MAX(i.industry_id), MAX(c.club_id), 2020, 'BA'
+		FROM jc6292.location l, jc6292.industry i, jc6292.club c
+	""")).fetchone()
+	keys = ['first_name', 'last_name', 'email', 'location_id', 'industry_id', 'club_id', 'graduation_year', 'degree']
+	timings = []
+	for i in range(repeat + 3):
+		started = time.perf_counter()
+		conn.execute(text(server.ADD_STUDENT_QUERY), dict(zip(keys, params)))
+		if i >= 3:                  # warm-up: trigger plans
+			timings.append((time.perf_counter() - started) * 1000)
+	return percentile(timings, 50)
+
+
+def set_analytics_triggers(conn, enabled):
+	triggers = conn.execute(text(
+		"SELECT tgrelid::regclass::text, tgname FROM pg_trigger WHERE tgname LIKE '%\\_analytics\\_%'"
+	)).fetchall()
+	for table, trigger in triggers:
+		conn.execute(text("ALTER TABLE %s %s TRIGGER %s" % (table, 'ENABLE' if enabled else 'DISABLE', trigger)))
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('-n', '--students', type=int, nargs='+', default=[1000, 10000])
+	parser.add_argument('-r', '--repeat', type=int, default=5)
+	args = parser.parse_args()
+
+	with server.engine.connect() as conn:
+		if 9 in server.pending_migrations(conn):
+			raise SystemExit("the analytics rollups are missing: run `python server.py migrate` first")
+		total = conn.execute(text("SELECT COUNT(*) FROM jc6292.student")).scalar()
+		print("%9s %-11s %10s %10s %8s" % ('students', 'section', 'rollup ms', 'live ms', 'speedup'))
+		for size in sorted({max(size, total) for size in args.students}):
+			if size > total:
+				generate_alumni(conn, size - total)
+				total = size
+			server.compact_analytics(conn)     # as the server's compaction thread would
+			conn.execute(text("ANALYZE"))
+			drifted = server.check_analytics(conn)
+			for section in server.ANALYTICS_QUERIES:
+				rollup = time_section(conn, section, False, args.repeat)
+				live = time_section(conn, section, True, args.repeat)
+				print("%9d %-11s %10.2f %10.2f %7.0fx%s" % (
+					total, section, rollup, live, live / rollup, '  DIFFERS' if section in drifted else ''))
+
+		with_triggers = time_add_student(conn, args.repeat * 4)
+		set_analytics_triggers(conn, False)
+		without_triggers = time_add_student(conn, args.repeat * 4)
+		print("add_student p50: %.2f ms with the analytics triggers, %.2f ms without" % (
+			with_triggers, without_triggers))
+		conn.rollback()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,80 @@
+"""
+Memory and speed of the streaming graduates export.
+
+Adds synthetic alumni (bench/synthetic.py) inside a transaction, in steps up to
+each size given, and at every step exports all graduates in each format the
+way /api/graduates/export does: rows from a server-side cursor, written out
+chunk by chunk. For comparison 'buffered' reads the whole result first and
+builds one JSON document from it. Reports rows/s, output size and the peak
+Python memory allocated while exporting (tracemalloc, a separate pass).
+Everything is rolled back; point DATABASE_URL at a local database:
+
+    DATABASE_URL=postgresql://localhost/proj1part2 python bench/export.py -n 10000 50000 200000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+import server
+from synthetic import generate_alumni
+
+
+def buffered(conn):
+	"""The whole result in memory, as building one JSON response would"""
+	query, params = server.graduates_query('', '', mode='aggregated')
+	graduates = [server.graduate_from_row(row) for row in conn.execute(text(query), params).fetchall()]
+	return [json.dumps({'graduates': graduates})]
+
+
+def streamed(fmt):
+	def export(conn):
+		return server.EXPORT_FORMATS[fmt][1](server.export_graduates(conn, '', ''))
+	return export
+
+
+def run(export, conn):
+	"""Bytes written by one export"""
+	size = 0
+	for data in export(conn):
+		size += len(data.encode('utf-8') if isinstance(data, str) else data)
+	return size
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('-n', '--students', type=int, nargs='+', default=[10000, 50000])
+	args = parser.parse_args()
+
+	exports = [(fmt, streamed(fmt)) for fmt in server.EXPORT_FORMATS
+	           if fmt != 'parquet' or server.pyarrow is not None]
+	exports.append(('buffered', buffered))
+	with server.engine.connect() as conn:
+		total = conn.execute(text("SELECT COUNT(*) FROM jc6292.student")).scalar()
+		print("%9s %-9s %10s %10s %12s" % ('students', 'format', 'rows/s', 'MB out', 'peak MB'))
+		for size in sorted({max(size, total) for size in args.students}):
+			if size > total:
+				generate_alumni(conn, size - total)
+				total = size
+			conn.execute(text("ANALYZE"))
+			rows = conn.execute(text("SELECT COUNT(*) FROM (%s) q" % server.graduates_query('', '', mode='aggregated')[0])).scalar()
+			for name, export in exports:
+				started = time.perf_counter()
+				written = run(export, conn)
+				elapsed = time.perf_counter() - started
+				tracemalloc.start()
+				run(export, conn)
+				peak = tracemalloc.get_traced_memory()[1]
+				tracemalloc.stop()
+				print("%9d %-9s %10.0f %10.1f %12.1f" % (total, name, rows / elapsed, written / 1e6, peak / 1e6))
+		conn.rollback()
+
+
+if __name__ == '__main__':
+	main()
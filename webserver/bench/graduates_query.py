@@ -0,0 +1,61 @@
+"""
+Compare the joined and aggregated graduates queries.
+
+Adds synthetic alumni (bench/synthetic.py) inside a transaction, runs both
+GRADUATES_QUERY_MODEs with each map filter, reports rows returned, distinct
+students and latency, and rolls everything back. Point DATABASE_URL at a local
+database, not the shared course server:
+
+    DATABASE_URL=postgresql://localhost/proj1part2 python bench/graduates_query.py -n 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+import server
+from synthetic import generate_alumni
+from loadtest import percentile
+
+
+def run_query(conn, mode, club_filter, year_filter, repeat):
+	query, params = server.graduates_query(club_filter, year_filter, mode=mode)
+	timings = []
+	for _ in range(repeat):
+		started = time.perf_counter()
+		rows = conn.execute(text(query), params).fetchall()
+		timings.append((time.perf_counter() - started) * 1000)
+	return len(rows), len({row[0] for row in rows}), timings
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('-n', '--students', type=int, default=5000)
+	parser.add_argument('-r', '--repeat', type=int, default=5)
+	args = parser.parse_args()
+
+	with server.engine.connect() as conn:
+		generate_alumni(conn, args.students)
+		conn.execute(text("ANALYZE"))
+		popular_club = conn.execute(text(
+			"SELECT club_id FROM jc6292.member_of GROUP BY club_id ORDER BY COUNT(*) DESC LIMIT 1"
+		)).scalar()
+		year = conn.execute(text("SELECT MAX(year) FROM jc6292.graduated_in")).scalar()
+
+		print("%-12s %-14s %8s %9s %9s %9s" % ('mode', 'filter', 'rows', 'students', 'p50 ms', 'max ms'))
+		for label, club_filter, year_filter in [('none', '', ''),
+		                                        ('club=%s' % popular_club, popular_club, ''),
+		                                        ('year=%s' % year, '', year)]:
+			for mode in ('joined', 'aggregated'):
+				rows, students, timings = run_query(conn, mode, club_filter, year_filter, args.repeat)
+				print("%-12s %-14s %8d %9d %9.1f %9.1f" % (
+					mode, label, rows, students, percentile(timings, 50), max(timings)))
+		conn.rollback()
+
+
+if __name__ == '__main__':
+	main()
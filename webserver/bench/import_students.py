@@ -0,0 +1,99 @@
+"""
+Bulk import throughput.
+
+Generates N alumni rows as CSV in memory (ids drawn from the existing
+locations, clubs and industries) and times
+server.import_students() - COPY into staging plus one INSERT per table -
+against the row-at-a-time statements /add_student runs for each student.
+Everything is rolled back. Point DATABASE_URL at a local database:
+
+    DATABASE_URL=postgresql://localhost/proj1part2 python bench/import_students.py --sizes 1000 10000 50000
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+import server
+from synthetic import FIRST_YEAR, LAST_YEAR
+
+ROW_STATEMENTS = [
+	('INSERT INTO jc6292.student (first_name, last_name, email) VALUES (:first_name, :last_name, :email) RETURNING student_id', None),
+	('INSERT INTO jc6292.lives_in (student_id, loc_id, since_date) VALUES (:student_id, :location_id, CURRENT_DATE)', None),
+	('INSERT INTO jc6292.works_in (student_id, industry_id, start_year) VALUES (:student_id, :industry_id, 2025)', 'industry_id'),
+	('INSERT INTO jc6292.member_of (student_id, club_id, join_date) VALUES (:student_id, :club_id, CURRENT_DATE)', 'club_id'),
+	('INSERT INTO jc6292.year_dim (year) VALUES (:graduation_year) ON CONFLICT (year) DO NOTHING', 'graduation_year'),
+	('INSERT INTO jc6292.graduated_in (student_id, year, degree) VALUES (:student_id, :graduation_year, :degree)', 'graduation_year'),
+]
+
+
+def make_csv(conn, rows, seed=4111):
+	ids = {name: [row[0] for row in conn.execute(text(query))] for name, query in [
+		('location_id', "SELECT loc_id FROM jc6292.location"),
+		('industry_id', "SELECT industry_id FROM jc6292.industry"),
+		('club_id', "SELECT club_id FROM jc6292.club"),
+	]}
+	rng = random.Random(seed)
+	out = io.StringIO()
+	writer = csv.writer(out)
+	writer.writerow(server.IMPORT_FIELDS)
+	for i in range(rows):
+		writer.writerow([
+			'Import%d' % i, 'Bench%d' % rng.randrange(2000), 'import%d@example.com' % i,
+			rng.choice(ids['location_id']),
+			rng.choice(ids['industry_id']) if rng.random() < 0.7 else '',
+			rng.choice(ids['club_id']) if rng.random() < 0.6 else '',
+			rng.randint(FIRST_YEAR, LAST_YEAR), rng.choice(['BS', 'BA', 'MS', 'PhD']),
+		])
+	return out.getvalue()
+
+
+def bulk(conn, data):
+	report = server.import_students(conn, server.read_import_records(io.StringIO(data), 'csv'))
+	return report['imported']
+
+
+def row_by_row(conn, data):
+	count = 0
+	for record in csv.DictReader(io.StringIO(data)):
+		params = {key: value or None for key, value in record.items()}
+		for statement, needs in ROW_STATEMENTS:
+			if needs and not params[needs]:
+				continue
+			result = conn.execute(text(statement), params)
+			if statement.endswith('RETURNING student_id'):
+				params['student_id'] = result.scalar()
+		count += 1
+	return count
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+	parser.add_argument('--row-limit', type=int, default=5000,
+	                    help="skip the row-by-row baseline above this many rows")
+	args = parser.parse_args()
+
+	with server.engine.connect() as conn:
+		print("%8s %-12s %9s %10s %10s" % ('rows', 'method', 'imported', 'seconds', 'rows/s'))
+		for size in args.sizes:
+			data = make_csv(conn, size)
+			for label, method in [('copy', bulk), ('row-by-row', row_by_row)]:
+				if method is row_by_row and size > args.row_limit:
+					continue
+				started = time.perf_counter()
+				imported = method(conn, data)
+				elapsed = time.perf_counter() - started
+				conn.rollback()
+				print("%8d %-12s %9d %10.2f %10.0f" % (size, label, imported, elapsed, imported / elapsed))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,67 @@
+"""
+Password checks per second by KDF pool size.
+
+Hashes one password with PASSWORD_HASH_METHOD, then verifies it from
+--concurrency threads (standing in for request threads) with the KDF pool
+at each --workers size; 0 runs the KDF inline on the calling thread, as
+login used to. Only password hashing is timed, no queries are run:
+
+    PASSWORD_HASH_METHOD=scrypt:32768:8:1 python bench/kdf.py --workers 0 1 2 4 -c 16 -n 200
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+from loadtest import percentile
+
+
+def run(workers, concurrency, logins, password_hash):
+	server.configure_kdf_pool(workers)
+	server.verify_password(password_hash, 'secret')   # start the pool outside the timing
+	latencies = []
+	busy = [0]
+	lock = threading.Lock()
+
+	def one(_):
+		started = time.perf_counter()
+		try:
+			assert server.verify_password(password_hash, 'secret')
+		except server.KdfBusy:
+			with lock:
+				busy[0] += 1
+			return
+		with lock:
+			latencies.append((time.perf_counter() - started) * 1000)
+
+	rejected = server.kdf_stats['rejected']
+	started = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=concurrency) as pool:
+		list(pool.map(one, range(logins)))
+	wall = time.perf_counter() - started
+	return len(latencies) / wall, percentile(latencies, 50), percentile(latencies, 99), \
+		server.kdf_stats['max_pending_seen'], server.kdf_stats['rejected'] - rejected
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4])
+	parser.add_argument('-c', '--concurrency', type=int, default=16)
+	parser.add_argument('-n', '--logins', type=int, default=200)
+	args = parser.parse_args()
+
+	password_hash = server.hash_password('secret')
+	print("method %s, %d cpus, KDF_MAX_PENDING %d" % (server.PASSWORD_HASH_METHOD, os.cpu_count(), server.KDF_MAX_PENDING))
+	print("%8s %10s %9s %9s %12s %9s" % ('workers', 'logins/s', 'p50 ms', 'p99 ms', 'max pending', 'rejected'))
+	for workers in args.workers:
+		print("%8d %10.1f %9.1f %9.1f %12d %9d" % ((workers,) + run(workers, args.concurrency, args.logins, password_hash)))
+	server.configure_kdf_pool(0)
+
+
+if __name__ == '__main__':
+	main()
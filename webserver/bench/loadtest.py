@@ -0,0 +1,109 @@
+"""
+Small HTTP load generator for the graduate map server.
+
+Logs in once, then fires concurrent GET requests at a set of paths and reports
+latency percentiles, throughput and the db-checkout time the server reports in
+its Server-Timing header.
+
+Compare pool modes by starting the server twice, e.g.
+
+    DB_POOL_MODE=null  python server.py run --threaded
+    DB_POOL_MODE=queue python server.py run --threaded
+
+and running in between:
+
+    python bench/loadtest.py --username demo --password demo -c 8 -n 400 / /alumni/1
+"""
+import argparse
+import http.cookiejar
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(samples, pct):
+	if not samples:
+		return float('nan')
+	ordered = sorted(samples)
+	return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def login(base_url, username, password, email):
+	"""Return an opener carrying a logged-in session cookie (signs up if needed)"""
+	jar = http.cookiejar.CookieJar()
+	opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+	for action in ('signin', 'signup'):
+		data = urllib.parse.urlencode({
+			'username': username, 'password': password, 'email': email, 'action': action,
+		}).encode()
+		opener.open(base_url + '/login', data=data).read()
+		if any(cookie.name == 'session' for cookie in jar):
+			return opener
+	raise SystemExit("could not log in as %s" % username)
+
+
+def run_path(opener, base_url, path, requests, concurrency):
+	latencies = []
+	checkouts = []
+	errors = [0]
+	lock = threading.Lock()
+
+	def one(_):
+		started = time.perf_counter()
+		try:
+			with opener.open(base_url + path) as response:
+				response.read()
+				timing = response.headers.get('Server-Timing', '')
+		except Exception:
+			with lock:
+				errors[0] += 1
+			return
+		elapsed = (time.perf_counter() - started) * 1000
+		match = re.search(r'db-checkout;dur=([\d.]+)', timing)
+		with lock:
+			latencies.append(elapsed)
+			if match:
+				checkouts.append(float(match.group(1)))
+
+	started = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=concurrency) as pool:
+		list(pool.map(one, range(requests)))
+	wall = time.perf_counter() - started
+	return {
+		'path': path,
+		'requests': len(latencies),
+		'errors': errors[0],
+		'rps': len(latencies) / wall if wall else 0.0,
+		'p50_ms': percentile(latencies, 50),
+		'p99_ms': percentile(latencies, 99),
+		'checkout_p50_ms': percentile(checkouts, 50),
+		'checkout_p99_ms': percentile(checkouts, 99),
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('paths', nargs='*', default=['/', '/alumni/1'])
+	parser.add_argument('--base-url', default='http://localhost:8111')
+	parser.add_argument('--username', default='loadtest')
+	parser.add_argument('--password', default='loadtest')
+	parser.add_argument('--email', default='loadtest@example.com')
+	parser.add_argument('-c', '--concurrency', type=int, default=8)
+	parser.add_argument('-n', '--requests', type=int, default=200)
+	args = parser.parse_args()
+
+	opener = login(args.base_url, args.username, args.password, args.email)
+	print("%-24s %8s %6s %8s %9s %9s %12s %12s" % (
+		'path', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'checkout p50', 'checkout p99'))
+	for path in args.paths:
+		r = run_path(opener, args.base_url, path, args.requests, args.concurrency)
+		print("%-24s %8d %6d %8.1f %9.1f %9.1f %12.2f %12.2f" % (
+			r['path'], r['requests'], r['errors'], r['rps'], r['p50_ms'], r['p99_ms'],
+			r['checkout_p50_ms'], r['checkout_p99_ms']))
+
+
+if __name__ == '__main__':
+	main()
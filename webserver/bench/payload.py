@@ -0,0 +1,115 @@
+"""
+Bytes on the wire and parse time for the graduates payload.
+
+Builds N synthetic graduates shaped like /api/graduates rows (skewed cities,
+clubs and industries as in bench/synthetic.py) and compares the row JSON with
+format=columnar, uncompressed, gzip and (if installed) brotli. Parse time is
+JSON.parse plus decodeColumnar() from static/columnar.js, timed in node (the
+same V8 engine as Chrome) when node is on the PATH, else Python's json.loads:
+
+    DATABASE_URL=postgresql://localhost/proj1part2 python bench/payload.py --sizes 10000 100000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+from synthetic import CLUB_WORDS, LOCATIONS, CLUBS, INDUSTRIES, SKEW, FIRST_YEAR, LAST_YEAR
+
+COLUMNAR_JS = os.path.join(os.path.dirname(server.__file__), 'static', 'columnar.js')
+
+NODE_PARSE = """
+const {decodeColumnar} = require(process.argv[1]);
+const text = require('fs').readFileSync(process.argv[2], 'utf8');
+const columnar = process.argv[3] === 'columnar';
+let best = Infinity;
+for (let i = 0; i < 5; i++) {
+    const started = process.hrtime.bigint();
+    const data = JSON.parse(text);
+    const rows = columnar ? decodeColumnar(data.graduates) : data.graduates;
+    if (rows.length !== data.graduates.count && !Array.isArray(data.graduates)) throw new Error('bad decode');
+    best = Math.min(best, Number(process.hrtime.bigint() - started) / 1e6);
+}
+console.log(best);
+"""
+
+
+def skewed(rng, n):
+	return int(pow(rng.random(), SKEW) * n)
+
+
+def make_graduates(count, seed=4111):
+	rng = random.Random(seed)
+	cities = [('Bench City %d' % i, 'S%d' % (i % 50)) for i in range(LOCATIONS)]
+	clubs = ['%s %s Club' % (CLUB_WORDS[i % len(CLUB_WORDS)].title(), i) for i in range(CLUBS)]
+	categories = ['Academic', 'Arts', 'Sports', 'Cultural', 'Professional', 'Other']
+	industries = ['Bench Industry %d' % i for i in range(INDUSTRIES)]
+	graduates = []
+	for i in range(count):
+		city, state = cities[skewed(rng, LOCATIONS)]
+		member = sorted({skewed(rng, CLUBS) for _ in range(int(pow(rng.random(), 1.2) * 5))})
+		graduates.append({
+			'student_id': i + 1,
+			'first_name': 'First%d' % rng.randrange(400),
+			'last_name': 'Last%d' % int(pow(rng.random(), 1.5) * 2000),
+			'email': 'bench%d@example.com' % i if rng.random() < 0.7 else None,
+			'city': city,
+			'state': state,
+			'graduation_year': rng.randint(FIRST_YEAR, LAST_YEAR),
+			'degree': rng.choice(['BS', 'BA', 'MS', 'PhD']),
+			'honors': 'Cum Laude' if rng.random() < 0.1 else None,
+			'industries': sorted({industries[skewed(rng, INDUSTRIES)] for _ in range(int(pow(rng.random(), 1.5) * 4))}),
+			'clubs': [clubs[c] for c in member],
+			'club_categories': [categories[c % len(categories)] for c in member],
+			'industry_tags': [industries[skewed(rng, INDUSTRIES)]] if rng.random() < 0.6 else [],
+		})
+	return graduates
+
+
+def parse_ms(text, kind):
+	node = shutil.which('node')
+	if node is None:
+		started = time.perf_counter()
+		json.loads(text)
+		return (time.perf_counter() - started) * 1000, 'python'
+	with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+		f.write(text)
+	try:
+		out = subprocess.run([node, '-e', NODE_PARSE, COLUMNAR_JS, f.name, kind],
+		                     capture_output=True, text=True, check=True).stdout
+	finally:
+		os.unlink(f.name)
+	return float(out), 'node'
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+	args = parser.parse_args()
+
+	print("%8s %-9s %12s %12s %12s %10s" % ('rows', 'format', 'raw bytes', 'gzip bytes', 'br bytes', 'parse ms'))
+	for size in args.sizes:
+		graduates = make_graduates(size)
+		for kind in ('rows', 'columnar'):
+			payload = graduates if kind == 'rows' else server.encode_columnar(graduates, server.GRADUATE_DICTIONARIES)
+			text = json.dumps({'graduates': payload, 'next': None}, separators=(',', ':'))
+			raw = text.encode('utf-8')
+			gz = zlib.compressobj(server.COMPRESS_LEVEL, zlib.DEFLATED, 31)
+			gzip_size = len(gz.compress(raw) + gz.flush())
+			br_size = len(server.brotli.compress(raw, quality=server.BROTLI_QUALITY)) if server.brotli else None
+			parse, engine = parse_ms(text, kind)
+			print("%8d %-9s %12d %12d %12s %10.1f  (%s)" % (
+				size, kind, len(raw), gzip_size, br_size if br_size is not None else '-', parse, engine))
+
+
+if __name__ == '__main__':
+	main()
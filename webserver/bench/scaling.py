@@ -0,0 +1,75 @@
+"""
+Requests/sec as the production server gets more worker processes.
+
+For each --workers count, starts `server.py run --workers N --threads T` on a
+spare port, waits for /ready, runs the load test (bench/loadtest.py) against
+each path and stops the server again. Point DATABASE_URL at a local database:
+
+    DATABASE_URL=postgresql://localhost/proj1part2 DB_POOL_MODE=queue \
+        python bench/scaling.py --workers 1 2 4 8 --threads 4 -c 32 -n 2000
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from loadtest import login, run_path
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server.py')
+
+
+def start_server(run_args, port, env=None):
+	"""Start `server.py run <run_args> 127.0.0.1 <port>` and wait until it reports /ready"""
+	process = subprocess.Popen(
+		[sys.executable, SERVER, 'run'] + run_args + ['127.0.0.1', str(port)],
+		stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+	deadline = time.time() + 30
+	while time.time() < deadline:
+		try:
+			urllib.request.urlopen('http://127.0.0.1:%d/ready' % port, timeout=1).read()
+			return process
+		except Exception:
+			if process.poll() is not None:
+				raise SystemExit("server exited with %d (is gunicorn installed for --workers?)" % process.returncode)
+			time.sleep(0.2)
+	process.kill()
+	raise SystemExit("server did not become ready")
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('paths', nargs='*', default=['/', '/search_clubs?q=research'])
+	parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+	parser.add_argument('--threads', type=int, default=4)
+	parser.add_argument('--worker-class', default='sync')
+	parser.add_argument('--port', type=int, default=8199)
+	parser.add_argument('--username', default='loadtest')
+	parser.add_argument('--password', default='loadtest')
+	parser.add_argument('--email', default='loadtest@example.com')
+	parser.add_argument('-c', '--concurrency', type=int, default=16)
+	parser.add_argument('-n', '--requests', type=int, default=500)
+	args = parser.parse_args()
+
+	base_url = 'http://127.0.0.1:%d' % args.port
+	print("%d cpus, %d threads per worker" % (os.cpu_count(), args.threads))
+	print("%8s %-28s %8s %6s %8s %9s %9s" % ('workers', 'path', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms'))
+	for workers in args.workers:
+		process = start_server(['--workers', str(workers), '--threads', str(args.threads),
+		                        '--worker-class', args.worker_class], args.port)
+		try:
+			opener = login(base_url, args.username, args.password, args.email)
+			for path in args.paths:
+				run_path(opener, base_url, path, min(50, args.requests), args.concurrency)   # warm up
+				r = run_path(opener, base_url, path, args.requests, args.concurrency)
+				print("%8d %-28s %8d %6d %8.1f %9.1f %9.1f" % (
+					workers, path, r['requests'], r['errors'], r['rps'], r['p50_ms'], r['p99_ms']))
+		finally:
+			process.send_signal(signal.SIGTERM)
+			process.wait()
+
+
+if __name__ == '__main__':
+	main()
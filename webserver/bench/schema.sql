@@ -0,0 +1,90 @@
+-- The jc6292 schema the app runs against, for the local benchmark database
+-- (bench/suite.py). Drops and recreates the schema: never run it against the
+-- course server. app_user, location_summary, the map coordinates and the
+-- analytics rollups are created by server.py's migrations.
+DROP SCHEMA IF EXISTS jc6292 CASCADE;
+CREATE SCHEMA jc6292;
+
+CREATE TABLE jc6292.location (
+	loc_id SERIAL PRIMARY KEY,
+	city VARCHAR(100),
+	state VARCHAR(50),
+	country VARCHAR(50) DEFAULT 'USA'
+);
+
+CREATE TABLE jc6292.student (
+	student_id SERIAL PRIMARY KEY,
+	first_name VARCHAR(50) NOT NULL,
+	last_name VARCHAR(50) NOT NULL,
+	email VARCHAR(100),
+	industry_tags VARCHAR(50)[]
+);
+
+CREATE TABLE jc6292.club (
+	club_id SERIAL PRIMARY KEY,
+	name VARCHAR(100) NOT NULL,
+	category VARCHAR(50),
+	about TEXT,
+	about_tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', coalesce(about, ''))) STORED
+);
+CREATE INDEX club_about_tsv_idx ON jc6292.club USING gin (about_tsv);
+
+CREATE TABLE jc6292.industry (
+	industry_id SERIAL PRIMARY KEY,
+	name VARCHAR(100) NOT NULL
+);
+
+CREATE TABLE jc6292.year_dim (
+	year INTEGER PRIMARY KEY
+);
+
+CREATE TABLE jc6292.graduated_in (
+	student_id INTEGER REFERENCES jc6292.student ON DELETE CASCADE,
+	year INTEGER REFERENCES jc6292.year_dim,
+	degree VARCHAR(20),
+	honors VARCHAR(50),
+	PRIMARY KEY (student_id, year)
+);
+
+CREATE TABLE jc6292.lives_in (
+	student_id INTEGER REFERENCES jc6292.student ON DELETE CASCADE,
+	loc_id INTEGER REFERENCES jc6292.location,
+	since_date DATE NOT NULL,
+	until_date DATE,
+	PRIMARY KEY (student_id, loc_id, since_date)
+);
+
+CREATE TABLE jc6292.works_in (
+	student_id INTEGER REFERENCES jc6292.student ON DELETE CASCADE,
+	industry_id INTEGER REFERENCES jc6292.industry,
+	start_year INTEGER NOT NULL,
+	end_year INTEGER,
+	PRIMARY KEY (student_id, industry_id, start_year)
+);
+
+CREATE TABLE jc6292.member_of (
+	student_id INTEGER REFERENCES jc6292.student ON DELETE CASCADE,
+	club_id INTEGER REFERENCES jc6292.club,
+	join_date DATE NOT NULL,
+	leave_date DATE,
+	PRIMARY KEY (student_id, club_id, join_date)
+);
+
+-- current_location uses the location table's row type as a composite column
+CREATE TABLE jc6292.alumni_profile (
+	student_id INTEGER PRIMARY KEY REFERENCES jc6292.student ON DELETE CASCADE,
+	current_location jc6292.location,
+	bio TEXT,
+	linkedin_url VARCHAR(200)
+);
+
+INSERT INTO jc6292.location (city, state) VALUES
+	('New York City', 'NY'), ('San Francisco', 'CA'), ('Chicago', 'IL'), ('Seattle', 'WA'),
+	('Los Angeles', 'CA'), ('Boston', 'MA'), ('Austin', 'TX'), ('Denver', 'CO');
+INSERT INTO jc6292.industry (name) VALUES
+	('Technology'), ('Finance'), ('Healthcare'), ('Education'), ('Consulting'), ('Media');
+INSERT INTO jc6292.club (name, category, about) VALUES
+	('Robotics Club', 'Academic', 'Robotics research projects and national competitions'),
+	('Columbia Daily Spectator', 'Arts', 'Student journal with weekly publication and investigative research'),
+	('Philolexian Society', 'Cultural', 'Debate, literary performance and poetry readings'),
+	('Columbia University Orchestra', 'Arts', 'Symphonic music performance every semester');
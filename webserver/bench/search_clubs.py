@@ -0,0 +1,81 @@
+"""
+Club search latency as the club table grows.
+
+Adds synthetic clubs in steps inside a transaction and times, at each size,
+the original OR-of-words to_tsquery search (every match, unpaged) against the
+paged prefix search with headlines that /search_clubs now runs. Everything is
+rolled back at the end. Point DATABASE_URL at a local database:
+
+    DATABASE_URL=postgresql://localhost/proj1part2 python bench/search_clubs.py --sizes 1000 2000 4000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+import server
+from synthetic import CLUB_WORDS
+from loadtest import percentile
+
+ORIGINAL_QUERY = """
+	SELECT club_id, name, category, about, ts_rank(about_tsv, query) AS rank
+	FROM jc6292.club, to_tsquery('english', :search_query) query
+	WHERE about_tsv @@ query
+	ORDER BY rank DESC
+"""
+
+SEARCHES = ['research', 'robot comp', 'journal publication', 'perf', 'music or theatre']
+
+
+def add_clubs(conn, count):
+	conn.execute(text("""
+		INSERT INTO jc6292.club (name, category, about)
+		SELECT 'Search Bench Club ' || i, 'Other',
+		       'Members share ' || (:words)[1 + mod(i, :word_count)] || ', '
+		           || (:words)[1 + mod(i * 3, :word_count)] || ' and '
+		           || (:words)[1 + mod(i * 7, :word_count)] || ' through weekly meetings.'
+		FROM generate_series(1, :n) i
+	"""), {'n': count, 'words': CLUB_WORDS, 'word_count': len(CLUB_WORDS)})
+
+
+def time_query(conn, query, params, repeat):
+	timings = []
+	for _ in range(repeat):
+		started = time.perf_counter()
+		rows = conn.execute(text(query), params).fetchall()
+		timings.append((time.perf_counter() - started) * 1000)
+	return len(rows), percentile(timings, 50)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 4000])
+	parser.add_argument('-r', '--repeat', type=int, default=5)
+	args = parser.parse_args()
+
+	with server.engine.connect() as conn:
+		print("%8s %-20s %9s %12s %9s %12s" % ('clubs', 'search', 'orig rows', 'orig p50 ms', 'page rows', 'page p50 ms'))
+		for size in args.sizes:
+			current = conn.execute(text("SELECT COUNT(*) FROM jc6292.club")).scalar()
+			if size > current:
+				add_clubs(conn, size - current)
+				conn.execute(text("ANALYZE jc6292.club"))
+			for search in SEARCHES:
+				original = time_query(conn, ORIGINAL_QUERY, {'search_query': ' | '.join(search.split())}, args.repeat)
+				tsquery, argument = server.search_tsquery(search)
+				paged = time_query(conn, server.SEARCH_QUERY.format(tsquery=tsquery), {
+					'search_query': argument,
+					'headline_options': server.HEADLINE_OPTIONS,
+					'limit': server.SEARCH_PAGE_SIZE,
+					'offset': 0,
+				}, args.repeat)
+				print("%8d %-20s %9d %12.2f %9d %12.2f" % ((size, search) + original + paged))
+		conn.rollback()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,159 @@
+"""
+Cold-start time of the app.
+
+Measures, each in a fresh interpreter, how long `import server` takes, and how
+long `server.py run` takes to answer its first request (GET /login, which
+needs no database) and to report ready at /ready. Each is measured against
+the configured database, through a local proxy that adds --latency-ms to every
+round-trip (like the remote course server), and against a database that
+accepts connections but never answers (libpq gives up after --connect-timeout):
+
+    DATABASE_URL=postgresql://localhost:5432/proj1part2 python bench/startup.py -r 5
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from loadtest import percentile
+
+WEBSERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def listen():
+	server = socket.socket()
+	server.bind(('127.0.0.1', 0))
+	server.listen(64)
+	return server
+
+
+def serve_forever(server, handle):
+	def accept():
+		while True:
+			client, _ = server.accept()
+			threading.Thread(target=handle, args=(client,), daemon=True).start()
+	threading.Thread(target=accept, daemon=True).start()
+	return server.getsockname()[1]
+
+
+def latency_proxy(host, port, latency):
+	"""Forward to host:port, delaying every chunk from the server by `latency` seconds; returns the port"""
+	def pipe(source, target, delay):
+		try:
+			while True:
+				data = source.recv(65536)
+				if not data:
+					break
+				time.sleep(delay)
+				target.sendall(data)
+		except OSError:
+			pass
+		finally:
+			target.close()
+
+	def handle(client):
+		upstream = socket.create_connection((host, port))
+		threading.Thread(target=pipe, args=(client, upstream, 0), daemon=True).start()
+		pipe(upstream, client, latency)
+
+	return serve_forever(listen(), handle)
+
+
+def stalled_database():
+	"""A port that accepts connections and never says anything"""
+	held = []
+	return serve_forever(listen(), held.append)
+
+
+def with_port(url, port, **query):
+	parts = urllib.parse.urlsplit(url)
+	netloc = '%s@127.0.0.1:%d' % (parts.username or 'postgres', port)
+	params = urllib.parse.parse_qsl(parts.query) + sorted(query.items())
+	return urllib.parse.urlunsplit((parts.scheme, netloc, parts.path, urllib.parse.urlencode(params), ''))
+
+
+def time_import(env):
+	"""Seconds `import server` takes in a new interpreter (interpreter startup excluded)"""
+	output = subprocess.run(
+		[sys.executable, '-c', 'import time; t = time.perf_counter(); import server; '
+		                       'print("elapsed", time.perf_counter() - t)'],
+		cwd=WEBSERVER, env=env, capture_output=True, text=True, check=True).stdout
+	return float(output.rsplit('elapsed', 1)[1])
+
+
+def wait_for(url, deadline):
+	"""Poll url until it answers 200; returns the time it did, or None"""
+	while time.perf_counter() < deadline:
+		try:
+			urllib.request.urlopen(url, timeout=1).read()
+			return time.perf_counter()
+		except urllib.error.HTTPError as e:
+			if e.code == 404:
+				return None             # no such endpoint in this version
+		except Exception:
+			pass
+		time.sleep(0.02)
+	return None
+
+
+def time_serve(env, timeout):
+	"""(seconds to the first /login response, seconds to /ready) for `server.py run --threaded`"""
+	with socket.socket() as s:
+		s.bind(('127.0.0.1', 0))
+		port = s.getsockname()[1]
+	started = time.perf_counter()
+	process = subprocess.Popen([sys.executable, 'server.py', 'run', '--threaded', '127.0.0.1', str(port)],
+	                           cwd=WEBSERVER, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	try:
+		base_url = 'http://127.0.0.1:%d' % port
+		serving = wait_for(base_url + '/login', started + timeout)
+		ready = wait_for(base_url + '/ready', started + timeout) if serving else None
+	finally:
+		process.terminate()
+		process.wait()
+	return (serving - started if serving else None), (ready - started if ready else None)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('-r', '--repeat', type=int, default=3)
+	parser.add_argument('--latency-ms', type=float, default=20, help="added round-trip time for the slow database")
+	parser.add_argument('--connect-timeout', type=int, default=2, help="libpq timeout for the stalled database")
+	parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for the server")
+	args = parser.parse_args()
+
+	url = os.environ.get('DATABASE_URL')
+	if not url:
+		raise SystemExit("set DATABASE_URL to a local database")
+	parts = urllib.parse.urlsplit(url)
+	slow = latency_proxy(parts.hostname or '127.0.0.1', parts.port or 5432, args.latency_ms / 1000.0)
+	scenarios = [
+		('database', dict(os.environ)),
+		('+%gms latency' % args.latency_ms, dict(os.environ, DATABASE_URL=with_port(url, slow))),
+		('stalled db', dict(os.environ, DATABASE_URL=with_port(url, stalled_database(),
+		                                                       connect_timeout=args.connect_timeout))),
+	]
+
+	def fmt(samples):
+		samples = [s for s in samples if s is not None]
+		return '%9.3f' % percentile(samples, 50) if samples else '%9s' % '-'
+
+	print("%-16s %12s %12s %12s" % ('scenario', 'import s', 'serving s', 'ready s'))
+	for name, env in scenarios:
+		imports, serving, ready = [], [], []
+		for _ in range(args.repeat):
+			imports.append(time_import(env))
+			first, warm = time_serve(env, args.timeout)
+			serving.append(first)
+			ready.append(warm)
+		print("%-16s    %s    %s    %s" % (name, fmt(imports), fmt(serving), fmt(ready)))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,387 @@
+"""
+Reproducible benchmark suite.
+
+    python bench/suite.py run --students 20000            # fixture, data, every route
+    python bench/suite.py run --students 20000 --http     # ... plus a real HTTP load test
+    python bench/suite.py list
+    python bench/suite.py compare HEAD~3 HEAD             # or two result files
+
+`run` starts a throwaway Postgres cluster (initdb + pg_ctl from PG_BIN or the
+PATH; initdb refuses to run as root), creates the jc6292 schema from
+bench/schema.sql, adds N synthetic alumni (bench/synthetic.py), imports the
+app against it, applies its migrations and waits for it to warm up. It then drives every route through the Flask test client, and
+with --http also starts `server.py run` and load-tests it over HTTP
+(bench/loadtest.py). Latency percentiles and throughput are written to
+bench/results/<time>-<commit>.json, and `compare` reports the change per
+route between two runs.
+
+--replica adds a streaming replica (pg_basebackup) to the fixture and points
+DATABASE_REPLICA_URLS at it, so read requests go through the read/write split.
+
+To reuse an existing local database instead of a fixture, pass
+--database-url together with --reset: the jc6292 schema in it is dropped.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from loadtest import percentile, login, run_path
+from scaling import start_server
+
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+SCHEMA_SQL = os.path.join(BENCH_DIR, 'schema.sql')
+
+# (name, method, path); {student} is replaced by a random synthetic student id per request
+ROUTES = [
+	('index', 'GET', '/'),
+	('graduates', 'GET', '/api/graduates'),
+	('graduates_columnar', 'GET', '/api/graduates?format=columnar&limit=1000'),
+	('graduates_by_year', 'GET', '/api/graduates?year=2015'),
+	('map_locations', 'GET', '/api/map/locations'),
+	('map_locations_club', 'GET', '/api/map/locations?club_id=1'),
+	('search_clubs', 'GET', '/search_clubs?q=research'),
+	('search_clubs_page', 'GET', '/search_clubs?q=music+performance&page=2'),
+	('browse_clubs', 'GET', '/search_clubs'),
+	('alumni_profile', 'GET', '/alumni/{student}'),
+	('manage_students', 'GET', '/manage_students?page=5'),
+	('autocomplete', 'GET', '/api/autocomplete?kind=students&q=Last1'),
+	('analytics', 'GET', '/analytics'),
+	('api_analytics', 'GET', '/api/analytics?limit=100'),
+	('add_student_form', 'GET', '/add_student'),
+	('add_student', 'POST', '/add_student'),
+	('health', 'GET', '/health'),
+	('ready', 'GET', '/ready'),
+]
+HTTP_PATHS = ['/', '/api/map/locations', '/search_clubs?q=research', '/alumni/1', '/manage_students']
+
+
+class LocalPostgres(object):
+	"""A temporary Postgres cluster on a free port, torn down by stop()"""
+
+	def __init__(self, pg_bin=None):
+		self.pg_bin = pg_bin or os.environ.get('PG_BIN') or self.find_bin()
+		self.dir = None
+		self.url = None
+
+	@staticmethod
+	def find_bin():
+		initdb = shutil.which('initdb')
+		if initdb:
+			return os.path.dirname(initdb)
+		candidates = sorted(glob.glob('/usr/lib/postgresql/*/bin/initdb') + glob.glob('/usr/local/pgsql/bin/initdb'))
+		if candidates:
+			return os.path.dirname(candidates[-1])
+		raise SystemExit("initdb not found: install Postgres or set PG_BIN")
+
+	def start(self):
+		self.dir = tempfile.mkdtemp(prefix='graduate-map-pg-')
+		data = os.path.join(self.dir, 'data')
+		port = free_port()
+		subprocess.run([os.path.join(self.pg_bin, 'initdb'), '-D', data, '-U', 'postgres', '-A', 'trust',
+		                '-E', 'UTF8', '--no-sync'], check=True, stdout=subprocess.DEVNULL)
+		subprocess.run([os.path.join(self.pg_bin, 'pg_ctl'), '-D', data, '-l', os.path.join(self.dir, 'postgres.log'),
+		                '-w', '-o', '-p %d -k %s -c listen_addresses=127.0.0.1' % (port, self.dir), 'start'],
+		               check=True, stdout=subprocess.DEVNULL)
+		import psycopg2
+		conn = psycopg2.connect(host='127.0.0.1', port=port, user='postgres', dbname='postgres')
+		conn.autocommit = True
+		conn.cursor().execute('CREATE DATABASE proj1part2')
+		conn.close()
+		self.url = 'postgresql://postgres@127.0.0.1:%d/proj1part2' % port
+		return self.url
+
+	def start_replica(self):
+		"""Start a streaming replica of the cluster on another port; returns its URL"""
+		primary_port = int(self.url.rsplit(':', 1)[1].split('/')[0])
+		data = os.path.join(self.dir, 'replica')
+		port = free_port()
+		subprocess.run([os.path.join(self.pg_bin, 'pg_basebackup'), '-h', '127.0.0.1', '-p', str(primary_port),
+		                '-U', 'postgres', '-D', data, '-R', '-X', 'stream'], check=True)
+		subprocess.run([os.path.join(self.pg_bin, 'pg_ctl'), '-D', data, '-l', os.path.join(self.dir, 'replica.log'),
+		                '-w', '-o', '-p %d -k %s -c listen_addresses=127.0.0.1' % (port, self.dir), 'start'],
+		               check=True, stdout=subprocess.DEVNULL)
+		return 'postgresql://postgres@127.0.0.1:%d/proj1part2' % port
+
+	def stop(self):
+		if self.dir is None:
+			return
+		for data in ('replica', 'data'):
+			if os.path.isdir(os.path.join(self.dir, data)):
+				subprocess.run([os.path.join(self.pg_bin, 'pg_ctl'), '-D', os.path.join(self.dir, data), '-m', 'fast',
+				                'stop'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		shutil.rmtree(self.dir, ignore_errors=True)
+		self.dir = None
+
+
+def free_port():
+	with socket.socket() as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+
+def prepare_database(url, students, seed):
+	"""Create the schema and the synthetic alumni, then import the app against the database"""
+	from sqlalchemy import create_engine, text
+	from sqlalchemy.pool import NullPool
+	from synthetic import generate_alumni
+
+	setup_engine = create_engine(url, poolclass=NullPool)
+	with setup_engine.connect() as conn:
+		conn.exec_driver_sql(open(SCHEMA_SQL).read())
+		first, last = generate_alumni(conn, students, seed)
+		conn.commit()
+	setup_engine.dispose()
+
+	os.environ['DATABASE_URL'] = url
+	import server
+	server.migrate(echo=lambda line: None)
+	with server.engine.connect() as conn:
+		# Spread the synthetic cities over the continental US so they show up on the map
+		conn.execute(text("""
+			UPDATE jc6292.location
+			SET latitude = 26 + mod(loc_id * 37, 22) + mod(loc_id, 7) / 7.0,
+			    longitude = -122 + mod(loc_id * 53, 50) + mod(loc_id, 11) / 11.0
+			WHERE latitude IS NULL
+		"""))
+		conn.execute(text("ANALYZE"))
+		conn.commit()
+	server.start_warm_up()
+	while server.startup['state'] == 'warming':
+		time.sleep(0.05)
+	if server.startup['state'] != 'ready':
+		raise SystemExit("warm-up failed: %s" % server.startup['error'])
+	return server, (first, last)
+
+
+def drive_routes(server, student_ids, requests, seed):
+	"""Time every route through the Flask test client; returns {name: stats}"""
+	rng = random.Random(seed)
+	client = server.app.test_client()
+	with client.session_transaction() as session:
+		session['username'] = 'bench'
+	with server.engine.connect() as conn:
+		from sqlalchemy import text
+		location_id = conn.execute(text("SELECT MIN(loc_id) FROM jc6292.location")).scalar()
+
+	results = {}
+	for name, method, path in ROUTES:
+		latencies = []
+		statuses = {}
+		started = time.perf_counter()
+		for i in range(requests + 5):
+			url = path.format(student=rng.randint(*student_ids))
+			request_started = time.perf_counter()
+			if method == 'POST':
+				response = client.post(url, data={'first_name': 'Bench', 'last_name': 'Writer%d' % i,
+				                                  'location_id': location_id, 'graduation_year': 2020})
+			else:
+				response = client.get(url)
+			response.get_data()
+			elapsed = (time.perf_counter() - request_started) * 1000
+			if i < 5:                           # warm-up: caches, prepared statements
+				started = time.perf_counter()
+				continue
+			latencies.append(elapsed)
+			statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+		wall = time.perf_counter() - started
+		results[name] = {
+			'method': method, 'path': path, 'requests': len(latencies), 'statuses': statuses,
+			'rps': len(latencies) / wall if wall else 0.0,
+			'mean_ms': sum(latencies) / len(latencies),
+			'p50_ms': percentile(latencies, 50), 'p90_ms': percentile(latencies, 90),
+			'p99_ms': percentile(latencies, 99), 'max_ms': max(latencies),
+		}
+		print("%-22s %6d %8.1f %9.2f %9.2f %9.2f  %s" % (
+			name, len(latencies), results[name]['rps'], results[name]['p50_ms'], results[name]['p90_ms'],
+			results[name]['p99_ms'], ' '.join('%s×%d' % item for item in sorted(statuses.items()))))
+	return results
+
+
+def drive_http(url, requests, concurrency, workers):
+	"""Start the real server against the database and load-test it over HTTP"""
+	port = free_port()
+	env = dict(os.environ, DATABASE_URL=url, DB_POOL_MODE=os.environ.get('DB_POOL_MODE', 'queue'), QUERY_LOG='off')
+	run_args = ['--workers', str(workers)] if workers else ['--threaded']
+	process = start_server(run_args, port, env)
+	results = {}
+	try:
+		base_url = 'http://127.0.0.1:%d' % port
+		opener = login(base_url, 'bench', 'bench-password', 'bench@example.com')
+		for path in HTTP_PATHS:
+			run_path(opener, base_url, path, min(50, requests), concurrency)
+			r = run_path(opener, base_url, path, requests, concurrency)
+			results['http ' + path] = dict(r, concurrency=concurrency, workers=workers)
+			print("%-34s %6d %6d %8.1f %9.2f %9.2f" % (
+				'http ' + path, r['requests'], r['errors'], r['rps'], r['p50_ms'], r['p99_ms']))
+	finally:
+		process.terminate()
+		process.wait()
+	return results
+
+
+def git_commit():
+	root = os.path.dirname(os.path.dirname(BENCH_DIR))
+	try:
+		commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True,
+		                        text=True, check=True).stdout.strip()
+		dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+		                            capture_output=True, text=True).stdout.strip())
+	except (OSError, subprocess.CalledProcessError):
+		return 'unknown', False
+	return commit, dirty
+
+
+def command_run(args):
+	if args.database_url and not args.reset:
+		raise SystemExit("--database-url drops and recreates the jc6292 schema there; add --reset to confirm")
+	if args.database_url and args.replica:
+		raise SystemExit("--replica starts a fixture replica; with --database-url set DATABASE_REPLICA_URLS instead")
+	fixture = None
+	if not args.database_url:
+		if hasattr(os, 'geteuid') and os.geteuid() == 0:
+			raise SystemExit("initdb cannot run as root: run as another user or pass --database-url ... --reset")
+		fixture = LocalPostgres(args.pg_bin)
+	try:
+		url = args.database_url or fixture.start()
+		if args.replica:
+			# The replica copies the empty database, then streams the data and migrations
+			os.environ['DATABASE_REPLICA_URLS'] = fixture.start_replica()
+		started = time.perf_counter()
+		server, student_ids = prepare_database(url, args.students, args.seed)
+		print("%d synthetic alumni ready in %.1fs" % (args.students, time.perf_counter() - started))
+		print("%-22s %6s %8s %9s %9s %9s  %s" % ('route', 'reqs', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'statuses'))
+		results = drive_routes(server, student_ids, args.requests, args.seed)
+		if args.http:
+			results.update(drive_http(url, args.http_requests, args.concurrency, args.workers))
+		with server.engine.connect() as conn:
+			postgres = conn.exec_driver_sql("SHOW server_version").scalar()
+		routing = dict(server.replica_stats) if server.replicas else None
+	finally:
+		if fixture is not None and not args.keep:
+			fixture.stop()
+		elif fixture is not None:
+			print("fixture kept at %s (%s)" % (fixture.dir, fixture.url))
+
+	commit, dirty = git_commit()
+	record = {
+		'commit': commit + ('-dirty' if dirty else ''),
+		'label': args.label,
+		'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'students': args.students,
+		'requests': args.requests,
+		'python': platform.python_version(),
+		'postgres': postgres,
+		'cpus': os.cpu_count(),
+		'routing': routing,
+		'env': {key: os.environ[key] for key in sorted(os.environ)
+		        if key.startswith(('DB_', 'GRADUATES_', 'CACHE_', 'PAGE_CACHE', 'KDF_'))},
+		'results': results,
+	}
+	os.makedirs(RESULTS_DIR, exist_ok=True)
+	path = os.path.join(RESULTS_DIR, '%s-%s.json' % (time.strftime('%Y%m%d-%H%M%S'), record['commit']))
+	with open(path, 'w') as f:
+		json.dump(record, f, indent=1, sort_keys=True)
+	print("results written to %s" % os.path.relpath(path))
+
+
+def find_result(ref):
+	"""A result file path, or the newest result for a commit (any git revision name works)"""
+	if os.path.exists(ref):
+		return ref
+	commit = ref
+	try:
+		commit = subprocess.run(['git', 'rev-parse', '--short', ref], cwd=BENCH_DIR, capture_output=True,
+		                        text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		pass
+	matches = sorted(glob.glob(os.path.join(RESULTS_DIR, '*-%s*.json' % commit)))
+	if not matches:
+		raise SystemExit("no stored results for %s" % ref)
+	return matches[-1]
+
+
+def command_list(args):
+	for path in sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json'))):
+		with open(path) as f:
+			record = json.load(f)
+		print("%-40s %-14s %7d students  %s" % (os.path.basename(path), record['commit'], record['students'],
+		                                        record.get('label') or ''))
+
+
+def command_compare(args):
+	old_path, new_path = find_result(args.old), find_result(args.new)
+	with open(old_path) as f:
+		old = json.load(f)
+	with open(new_path) as f:
+		new = json.load(f)
+	print("%s (%s) -> %s (%s)" % (old['commit'], os.path.basename(old_path), new['commit'], os.path.basename(new_path)))
+	if old['students'] != new['students']:
+		print("warning: runs used different data sizes (%d vs %d students)" % (old['students'], new['students']))
+	print("%-34s %10s %10s %8s %10s %10s %8s" % ('route', 'old p50', 'new p50', 'change', 'old p99', 'new p99', 'change'))
+	regressions = 0
+	for name in sorted(set(old['results']) & set(new['results'])):
+		a, b = old['results'][name], new['results'][name]
+		changes = []
+		for field in ('p50_ms', 'p99_ms'):
+			change = (b[field] - a[field]) / a[field] * 100 if a[field] else 0.0
+			changes.append(change)
+		flag = ''
+		if changes[0] > args.threshold:
+			flag = '  << slower'
+			regressions += 1
+		elif changes[0] < -args.threshold:
+			flag = '  faster'
+		print("%-34s %10.2f %10.2f %+7.1f%% %10.2f %10.2f %+7.1f%%%s" % (
+			name, a['p50_ms'], b['p50_ms'], changes[0], a['p99_ms'], b['p99_ms'], changes[1], flag))
+	if regressions:
+		print("%d route(s) slower than the %.0f%% threshold" % (regressions, args.threshold))
+		sys.exit(1)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	commands = parser.add_subparsers(dest='command', required=True)
+
+	run = commands.add_parser('run', help="build the fixture, run the benchmarks and store the results")
+	run.add_argument('-n', '--students', type=int, default=10000)
+	run.add_argument('-r', '--requests', type=int, default=100, help="timed test-client requests per route")
+	run.add_argument('--seed', type=float, default=0.4111)
+	run.add_argument('--label', help="free text stored with the results")
+	run.add_argument('--pg-bin', help="directory with initdb and pg_ctl (default: PG_BIN or the PATH)")
+	run.add_argument('--keep', action='store_true', help="leave the fixture cluster running")
+	run.add_argument('--database-url', help="use this database instead of a fixture (needs --reset)")
+	run.add_argument('--reset', action='store_true', help="allow dropping jc6292 in --database-url")
+	run.add_argument('--replica', action='store_true', help="add a streaming replica to the fixture for the reads")
+	run.add_argument('--http', action='store_true', help="also load-test the real server over HTTP")
+	run.add_argument('--http-requests', type=int, default=500)
+	run.add_argument('-c', '--concurrency', type=int, default=8)
+	run.add_argument('--workers', type=int, default=0, help="gunicorn workers for --http (0: threaded dev server)")
+	run.set_defaults(handler=command_run)
+
+	listing = commands.add_parser('list', help="list stored results")
+	listing.set_defaults(handler=command_list)
+
+	compare = commands.add_parser('compare', help="compare two stored runs")
+	compare.add_argument('old', help="result file or git revision")
+	compare.add_argument('new', help="result file or git revision")
+	compare.add_argument('--threshold', type=float, default=10.0, help="p50 slowdown (%%) reported as a regression")
+	compare.set_defaults(handler=command_compare)
+
+	args = parser.parse_args()
+	args.handler(args)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,140 @@
+"""
+Synthetic alumni for the benchmarks.
+
+generate_alumni() adds N students to the jc6292 schema with a realistic shape:
+locations, clubs and industries are picked with a skew (a few big cities and
+popular clubs, a long tail of small ones), students belong to 0-4 clubs and
+hold 0-3 current jobs, and some have moved at least once.
+
+Everything is generated in SQL on the server and runs in the caller's
+transaction, so a benchmark can roll it back afterwards.
+"""
+from sqlalchemy import text
+
+LOCATIONS = 60
+CLUBS = 120
+INDUSTRIES = 20
+FIRST_YEAR, LAST_YEAR = 2000, 2025
+
+# pow(random(), SKEW) concentrates picks on the low ids
+SKEW = 2.5
+
+CLUB_WORDS = ['research', 'project', 'journal', 'performance', 'competition', 'publication',
+              'robotics', 'music', 'theatre', 'debate', 'finance', 'startup', 'volunteer',
+              'outdoor', 'film', 'chess', 'coding', 'design', 'language', 'service']
+
+
+def ensure_lookups(conn):
+	"""Top up location, club, industry and year_dim so the pickers have enough to choose from"""
+	conn.execute(text("""
+		INSERT INTO jc6292.location (city, state, country)
+		SELECT 'Bench City ' || i, 'ST', 'USA'
+		FROM generate_series((SELECT COUNT(*) FROM jc6292.location) + 1, :n) i
+	"""), {'n': LOCATIONS})
+	conn.execute(text("""
+		INSERT INTO jc6292.industry (name)
+		SELECT 'Bench Industry ' || i
+		FROM generate_series((SELECT COUNT(*) FROM jc6292.industry) + 1, :n) i
+	"""), {'n': INDUSTRIES})
+	conn.execute(text("""
+		INSERT INTO jc6292.club (name, category, about)
+		SELECT 'Bench Club ' || i,
+		       (ARRAY['Academic', 'Arts', 'Sports', 'Cultural', 'Professional', 'Other'])[1 + mod(i, 6)],
+		       'We meet weekly for ' || (:words)[1 + mod(i, :word_count)] || ' and '
+		           || (:words)[1 + mod(i * 7, :word_count)] || ' activities.'
+		FROM generate_series((SELECT COUNT(*) FROM jc6292.club) + 1, :n) i
+	"""), {'n': CLUBS, 'words': CLUB_WORDS, 'word_count': len(CLUB_WORDS)})
+	conn.execute(text("""
+		INSERT INTO jc6292.year_dim (year)
+		SELECT y FROM generate_series(:first, :last) y
+		ON CONFLICT (year) DO NOTHING
+	"""), {'first': FIRST_YEAR, 'last': LAST_YEAR})
+
+
+def generate_alumni(conn, students, seed=0.4111):
+	"""Insert `students` synthetic alumni with their relationships; returns the new id range"""
+	conn.execute(text("SELECT setseed(:seed)"), {'seed': seed})
+	ensure_lookups(conn)
+	before = conn.execute(text("SELECT COALESCE(MAX(student_id), 0) FROM jc6292.student")).scalar()
+
+	conn.execute(text("""
+		INSERT INTO jc6292.student (first_name, last_name, email, industry_tags)
+		SELECT 'First' || floor(random() * 400)::int,
+		       'Last' || floor(pow(random(), 1.5) * 2000)::int,
+		       'bench' || i || '@example.com',
+		       CASE WHEN random() < 0.6 THEN ARRAY(
+		           SELECT i2.name FROM jc6292.industry i2
+		           WHERE i2.industry_id > i * 0       -- correlated, so it is drawn per student
+		           ORDER BY random() LIMIT 1 + floor(random() * 3)::int)
+		       END
+		FROM generate_series(1, :n) i
+	"""), {'n': students})
+	new_students = "SELECT student_id FROM jc6292.student WHERE student_id > :before"
+	params = {'before': before, 'skew': SKEW}
+
+	# Current home, plus an earlier one for about a third of the students
+	conn.execute(text("""
+		INSERT INTO jc6292.lives_in (student_id, loc_id, since_date, until_date)
+		SELECT s.student_id, loc.loc_id, DATE '2024-01-01' - floor(random() * 1500)::int, NULL
+		FROM (%s) s
+		CROSS JOIN LATERAL (
+			SELECT loc_id FROM jc6292.location
+			ORDER BY loc_id OFFSET floor(pow(random() + s.student_id * 0, :skew) * (SELECT COUNT(*) FROM jc6292.location))
+			LIMIT 1
+		) loc
+	""" % new_students), params)
+	conn.execute(text("""
+		INSERT INTO jc6292.lives_in (student_id, loc_id, since_date, until_date)
+		SELECT s.student_id, loc.loc_id, DATE '2015-01-01', DATE '2019-12-31'
+		FROM (%s) s
+		CROSS JOIN LATERAL (
+			SELECT loc_id FROM jc6292.location
+			ORDER BY loc_id OFFSET floor(pow(random() + s.student_id * 0, :skew) * (SELECT COUNT(*) FROM jc6292.location))
+			LIMIT 1
+		) loc
+		WHERE random() < 0.35
+		ON CONFLICT DO NOTHING
+	""" % new_students), params)
+
+	# 0-3 current jobs and 0-4 club memberships, skewed towards few (the counts reference the
+	# student so that they are drawn per student, not once for the whole statement)
+	conn.execute(text("""
+		INSERT INTO jc6292.works_in (student_id, industry_id, start_year, end_year)
+		SELECT DISTINCT ON (s.student_id, ind.industry_id) s.student_id, ind.industry_id, 2020, NULL
+		FROM (%s) s
+		CROSS JOIN LATERAL generate_series(1, floor(pow(random(), 1.5) * 4)::int + s.student_id * 0) k
+		CROSS JOIN LATERAL (
+			SELECT industry_id FROM jc6292.industry
+			ORDER BY industry_id OFFSET floor(pow(random() + k * 0 + s.student_id * 0, :skew) * (SELECT COUNT(*) FROM jc6292.industry))
+			LIMIT 1
+		) ind
+		ON CONFLICT DO NOTHING
+	""" % new_students), params)
+	conn.execute(text("""
+		INSERT INTO jc6292.member_of (student_id, club_id, join_date, leave_date)
+		SELECT DISTINCT ON (s.student_id, c.club_id) s.student_id, c.club_id, DATE '2018-09-01',
+		       CASE WHEN random() < 0.25 THEN DATE '2020-05-31' END
+		FROM (%s) s
+		CROSS JOIN LATERAL generate_series(1, floor(pow(random(), 1.2) * 5)::int + s.student_id * 0) k
+		CROSS JOIN LATERAL (
+			SELECT club_id FROM jc6292.club
+			ORDER BY club_id OFFSET floor(pow(random() + k * 0 + s.student_id * 0, :skew) * (SELECT COUNT(*) FROM jc6292.club))
+			LIMIT 1
+		) c
+		ON CONFLICT DO NOTHING
+	""" % new_students), params)
+
+	conn.execute(text("""
+		INSERT INTO jc6292.graduated_in (student_id, year, degree)
+		SELECT student_id, :first + floor(random() * (:last - :first + 1))::int,
+		       (ARRAY['BS', 'BA', 'MS', 'PhD'])[1 + floor(pow(random(), 2) * 4)::int]
+		FROM (%s) s
+	""" % new_students), dict(params, first=FIRST_YEAR, last=LAST_YEAR))
+	conn.execute(text("""
+		INSERT INTO jc6292.alumni_profile (student_id, current_location, bio)
+		SELECT li.student_id, l, 'Synthetic alumnus'
+		FROM jc6292.lives_in li
+		JOIN jc6292.location l ON l.loc_id = li.loc_id
+		WHERE li.student_id > :before AND li.until_date IS NULL
+	"""), params)
+	return before + 1, before + students
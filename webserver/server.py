@@ -8,12 +8,32 @@ Go to http://localhost:8111 in your browser.
 A debugger such as "pdb" may be helpful for debugging.
 Read about it online.
 """
+import base64
+import bisect
+import contextvars
+import csv
+import functools
+import hashlib
+import io
+import json
+import logging
+import math
+import multiprocessing
 import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 # accessible as a variable in index.html:
 from sqlalchemy import *
+from sqlalchemy import event, exc
 from sqlalchemy.pool import NullPool
-from flask import Flask, request, render_template, g, redirect, Response, abort, session
+from flask import Flask, request, render_template, g, redirect, Response, abort, session, jsonify, has_request_context
 from werkzeug.security import generate_password_hash, check_password_hash
+from markupsafe import Markup, escape
 
 tmpl_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
 app = Flask(__name__, template_folder=tmpl_dir)
@@ -39,72 +59,2673 @@ DATABASE_PASSWRD = "854037"
 DATABASE_HOST = "34.139.8.30"
 DATABASEURI = f"postgresql://{DATABASE_USERNAME}:{DATABASE_PASSWRD}@{DATABASE_HOST}/proj1part2"
 
+# DATABASE_URL overrides the course URI (e.g. a local Postgres for development)
+DATABASEURI = os.environ.get('DATABASE_URL', DATABASEURI)
+
+
+#
+# Connection pool configuration (all settings are per worker process)
+#
+#   DB_POOL_MODE=null       open a fresh connection for every request (default)
+#   DB_POOL_MODE=queue      keep up to DB_POOL_SIZE warm connections, plus DB_MAX_OVERFLOW
+#                           extra ones under bursts
+#   DB_POOL_MODE=pgbouncer  connect through PGBOUNCER_URL (a local PgBouncer in transaction
+#                           mode) and let the bouncer do the pooling
+#
+# The shared course database limits how many connections our account may hold, so keep
+# (DB_POOL_SIZE + DB_MAX_OVERFLOW) * number of workers below that ceiling, or use pgbouncer.
+#
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'null')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 2))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))     # seconds
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))      # seconds to wait for a checkout
+# By default the bouncer listens locally and takes the same user, password and database
+PGBOUNCER_URL = os.environ.get('PGBOUNCER_URL') or make_url(DATABASEURI).set(host='127.0.0.1', port=6432)
+
+
+def create_db_engine(uri, replica=False):
+	"""Create the engine for the configured DB_POOL_MODE"""
+	options = {}
+	if replica and 'connect_timeout' not in make_url(uri).query:
+		options['connect_args'] = {'connect_timeout': REPLICA_CONNECT_TIMEOUT}
+	if DB_POOL_MODE == 'queue':
+		return create_engine(uri,
+		                     pool_size=DB_POOL_SIZE,
+		                     max_overflow=DB_MAX_OVERFLOW,
+		                     pool_recycle=DB_POOL_RECYCLE,
+		                     pool_pre_ping=DB_POOL_PRE_PING,
+		                     pool_timeout=DB_POOL_TIMEOUT,
+		                     **options)
+	if DB_POOL_MODE == 'pgbouncer':
+		# PgBouncer already keeps the server connections warm; a second pool here would
+		# only pin bouncer slots, so stay on NullPool (replica URLs can point at bouncers too)
+		return create_engine(uri if replica else PGBOUNCER_URL, poolclass=NullPool, **options)
+	if DB_POOL_MODE != 'null':
+		raise ValueError(f"Unknown DB_POOL_MODE: {DB_POOL_MODE}")
+	# Using NullPool to avoid connection pool issues (important for shared databases)
+	return create_engine(uri, poolclass=NullPool, **options)
+
+
+#
+# This line creates a database engine that knows how to connect to the URI above.
+#
+engine = create_db_engine(DATABASEURI)
+
+#
+# Optional streaming replicas of DATABASE_URL for the read-only requests, as a comma
+# separated DATABASE_REPLICA_URLS. Each gets an engine with the same pool settings and,
+# unless its URL sets one, a libpq connect_timeout of REPLICA_CONNECT_TIMEOUT seconds, so an
+# unreachable replica host costs a bounded wait; see "Read/write split" below for how
+# requests are routed.
+#
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 2))     # seconds
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+replica_engines = [create_db_engine(url, replica=True) for url in DATABASE_REPLICA_URLS]
+all_engines = [engine] + replica_engines
+
+
+#
+# Pool metrics: how long each request waited to get a connection, and how old the
+# connection it got was. A fresh connection has an age of ~0, a pooled one is reused.
+#
+pool_stats_lock = threading.Lock()
+pool_stats = {
+	'connections_opened': 0,
+	'checkouts': 0,
+	'checkout_failures': 0,
+	'requests_with_db': 0,
+	'requests_without_db': 0,
+}
+pool_samples = {
+	'checkout_wait_ms': deque(maxlen=1000),
+	'connection_age_s': deque(maxlen=1000),
+}
+
+
+def on_pool_connect(dbapi_connection, connection_record):
+	connection_record.info['created_at'] = time.time()
+	with pool_stats_lock:
+		pool_stats['connections_opened'] += 1
+
+
+def on_pool_checkout(dbapi_connection, connection_record, connection_proxy):
+	created_at = connection_record.info.get('created_at', time.time())
+	pool_samples['connection_age_s'].append(time.time() - created_at)
+
+
+for each_engine in all_engines:
+	event.listen(each_engine, 'connect', on_pool_connect)
+	event.listen(each_engine, 'checkout', on_pool_checkout)
+
+
+def percentile(samples, pct):
+	"""Nearest-rank percentile of a list of numbers (None if empty)"""
+	if not samples:
+		return None
+	ordered = sorted(samples)
+	return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def summarize(samples):
+	samples = list(samples)
+	return {
+		'count': len(samples),
+		'p50': percentile(samples, 50),
+		'p99': percentile(samples, 99),
+		'max': max(samples) if samples else None,
+	}
+
+#
+# Query instrumentation. Engine events time every statement and count its rows; the
+# request hooks below roll them up per route. Statements are grouped by fingerprint
+# (literals replaced by ?). Each request logs a warning when one fingerprint runs
+# QUERY_N_PLUS_ONE or more times (an N+1 loop), and any statement slower than
+# QUERY_SLOW_MS is logged. A QUERY_EXPLAIN_SAMPLE fraction of slow SELECTs is re-run
+# under EXPLAIN (ANALYZE, BUFFERS). Logs are JSON lines on the graduate_map logger
+# (QUERY_LOG=off|slow|all, where 'all' also logs every request), and everything is
+# exported in Prometheus text format at /metrics.
+#
+QUERY_SLOW_MS = float(os.environ.get('QUERY_SLOW_MS', 200))
+QUERY_N_PLUS_ONE = int(os.environ.get('QUERY_N_PLUS_ONE', 10))
+QUERY_EXPLAIN_SAMPLE = float(os.environ.get('QUERY_EXPLAIN_SAMPLE', 0))    # 0..1 of slow SELECTs
+QUERY_LOG = os.environ.get('QUERY_LOG', 'slow')                            # off, slow or all
+QUERY_STATS_MAX = 300           # distinct fingerprints tracked; the rest count as 'other'
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+log = logging.getLogger('graduate_map')
+if not log.handlers:
+	log_handler = logging.StreamHandler()
+	log_handler.setFormatter(logging.Formatter('%(message)s'))
+	log.addHandler(log_handler)
+	log.setLevel(logging.INFO)
+	log.propagate = False
+
+
+def log_event(level, event_name, **fields):
+	if QUERY_LOG == 'off' or (QUERY_LOG == 'slow' and event_name == 'request'):
+		return
+	fields = dict({'ts': round(time.time(), 3), 'event': event_name}, **fields)
+	log.log(level, json.dumps(fields, default=str))
+
+
+query_stats_lock = threading.Lock()
+statement_stats = {}        # fingerprint -> {'calls', 'seconds', 'rows', 'slow'}
+route_stats = {}            # (route, method, status) -> counters and a duration histogram
+explain_samples = deque(maxlen=20)
+
+# Only plain reads are re-run under EXPLAIN ANALYZE, which really executes the statement
+READ_ONLY_STATEMENT = re.compile(r'\s*(SELECT|WITH)\b', re.IGNORECASE)
+WRITE_KEYWORD = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|nextval|setval|pg_advisory)', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=2048)
+def statement_fingerprint(statement):
+	"""Statement with literals replaced by ? and whitespace collapsed"""
+	fingerprint = re.sub(r"'(?:[^']|'')*'", '?', statement)
+	fingerprint = re.sub(r'\b\d+(?:\.\d+)?\b', '?', fingerprint)
+	return ' '.join(fingerprint.split())
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def on_statement_error(exception_context):
+	started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+	if started:
+		started.pop()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+	seconds = time.perf_counter() - conn.info['query_started'].pop()
+	rows = max(cursor.rowcount, 0)
+	fingerprint = statement_fingerprint(statement)
+	slow = seconds * 1000 >= QUERY_SLOW_MS
+	with query_stats_lock:
+		key = fingerprint if fingerprint in statement_stats or len(statement_stats) < QUERY_STATS_MAX else 'other'
+		stats = statement_stats.setdefault(key, {'calls': 0, 'seconds': 0.0, 'rows': 0, 'slow': 0})
+		stats['calls'] += 1
+		stats['seconds'] += seconds
+		stats['rows'] += rows
+		stats['slow'] += slow
+	
+	route = None
+	if has_request_context():
+		route = request.url_rule.rule if request.url_rule else request.path
+		g.setdefault('queries', []).append((fingerprint, seconds, rows))
+	if slow:
+		log_event(logging.WARNING, 'slow_query', route=route, ms=round(seconds * 1000, 2), rows=rows,
+		          statement=fingerprint[:500])
+		if QUERY_EXPLAIN_SAMPLE > 0 and READ_ONLY_STATEMENT.match(fingerprint) \
+				and not WRITE_KEYWORD.search(fingerprint) and random.random() < QUERY_EXPLAIN_SAMPLE:
+			explain_statement(conn, statement, parameters, route)
+
+
+def explain_statement(conn, statement, parameters, route):
+	"""Re-run a slow read under EXPLAIN ANALYZE on a raw cursor (so it is not instrumented itself)"""
+	cursor = conn.connection.cursor()
+	try:
+		cursor.execute("SAVEPOINT explain_sample")
+		try:
+			cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters)
+			plan = cursor.fetchone()[0]
+		finally:
+			cursor.execute("ROLLBACK TO SAVEPOINT explain_sample")
+			cursor.execute("RELEASE SAVEPOINT explain_sample")
+		sample = {'route': route, 'statement': statement_fingerprint(statement)[:500],
+		          'execution_ms': plan[0].get('Execution Time'), 'plan': plan[0]['Plan']}
+		explain_samples.append(sample)
+		log_event(logging.INFO, 'explain', **sample)
+	except Exception as e:
+		log_event(logging.INFO, 'explain_failed', route=route, error=str(e))
+	finally:
+		cursor.close()
+
+
+for each_engine in all_engines:
+	event.listen(each_engine, 'before_cursor_execute', before_cursor_execute)
+	event.listen(each_engine, 'handle_error', on_statement_error)
+	event.listen(each_engine, 'after_cursor_execute', after_cursor_execute)
+
+
+@app.before_request
+def start_request_metrics():
+	g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+	if 'request_started' not in g:
+		return response
+	seconds = time.perf_counter() - g.request_started
+	route = request.url_rule.rule if request.url_rule else 'unmatched'
+	queries = g.get('queries', [])
+	db_seconds = sum(query[1] for query in queries)
+	rows = sum(query[2] for query in queries)
+	
+	repeats = {}
+	for fingerprint, _, _ in queries:
+		repeats[fingerprint] = repeats.get(fingerprint, 0) + 1
+	n_plus_one = [(fingerprint, count) for fingerprint, count in repeats.items() if count >= QUERY_N_PLUS_ONE]
+	slow = sum(1 for query in queries if query[1] * 1000 >= QUERY_SLOW_MS)
+	
+	with query_stats_lock:
+		stats = route_stats.setdefault((route, request.method, response.status_code), {
+			'requests': 0, 'seconds': 0.0, 'db_seconds': 0.0, 'queries': 0, 'rows': 0,
+			'slow_queries': 0, 'n_plus_one': 0, 'buckets': [0] * len(REQUEST_BUCKETS)})
+		stats['requests'] += 1
+		stats['seconds'] += seconds
+		stats['db_seconds'] += db_seconds
+		stats['queries'] += len(queries)
+		stats['rows'] += rows
+		stats['slow_queries'] += slow
+		stats['n_plus_one'] += len(n_plus_one)
+		for i, bound in enumerate(REQUEST_BUCKETS):
+			if seconds <= bound:
+				stats['buckets'][i] += 1
+	
+	for fingerprint, count in n_plus_one:
+		log_event(logging.WARNING, 'n_plus_one', route=route, count=count, statement=fingerprint[:500])
+	log_event(logging.INFO, 'request', route=route, method=request.method, status=response.status_code,
+	          ms=round(seconds * 1000, 2), db_ms=round(db_seconds * 1000, 2), queries=len(queries), rows=rows)
+	return response
+
+
+def prometheus_label(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_metrics():
+	"""Counters and histograms of this process in the Prometheus text format"""
+	lines = []
+
+	def metric(name, kind, help_text, samples):
+		lines.append('# HELP graduate_map_%s %s' % (name, help_text))
+		lines.append('# TYPE graduate_map_%s %s' % (name, kind))
+		for labels, value in samples:
+			label_text = ','.join('%s="%s"' % (key, prometheus_label(val)) for key, val in labels)
+			lines.append('graduate_map_%s%s %s' % (name, '{%s}' % label_text if label_text else '', repr(float(value))))
+
+	with query_stats_lock:
+		routes = {key: dict(stats, buckets=list(stats['buckets'])) for key, stats in route_stats.items()}
+		statements = {key: dict(stats) for key, stats in statement_stats.items()}
+	with pool_stats_lock:
+		pool = dict(pool_stats)
+
+	route_labels = lambda key: [('route', key[0]), ('method', key[1]), ('status', key[2])]
+	histogram = []
+	for key, stats in sorted(routes.items()):
+		for bound, count in zip(REQUEST_BUCKETS, stats['buckets']):
+			histogram.append((route_labels(key) + [('le', repr(float(bound)))], count))
+		histogram.append((route_labels(key) + [('le', '+Inf')], stats['requests']))
+	lines.append('# HELP graduate_map_request_duration_seconds Request latency by route')
+	lines.append('# TYPE graduate_map_request_duration_seconds histogram')
+	for labels, count in histogram:
+		lines.append('graduate_map_request_duration_seconds_bucket{%s} %d' % (
+			','.join('%s="%s"' % (k, prometheus_label(v)) for k, v in labels), count))
+	for key, stats in sorted(routes.items()):
+		labels = ','.join('%s="%s"' % (k, prometheus_label(v)) for k, v in route_labels(key))
+		lines.append('graduate_map_request_duration_seconds_sum{%s} %r' % (labels, stats['seconds']))
+		lines.append('graduate_map_request_duration_seconds_count{%s} %d' % (labels, stats['requests']))
+
+	for name, field, help_text in [
+		('request_db_seconds_total', 'db_seconds', 'Time spent in SQL statements by route'),
+		('request_queries_total', 'queries', 'SQL round-trips by route'),
+		('request_rows_total', 'rows', 'Rows returned or affected by route'),
+		('request_slow_queries_total', 'slow_queries', 'Statements slower than QUERY_SLOW_MS by route'),
+		('request_n_plus_one_total', 'n_plus_one', 'Requests repeating one statement QUERY_N_PLUS_ONE+ times'),
+	]:
+		metric(name, 'counter', help_text, [(route_labels(key), stats[field]) for key, stats in sorted(routes.items())])
+
+	statement_labels = lambda fingerprint: [('statement', fingerprint[:160]),
+	                                        ('id', hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:10])]
+	for name, field, help_text in [
+		('statement_calls_total', 'calls', 'Executions by statement fingerprint'),
+		('statement_seconds_total', 'seconds', 'Execution time by statement fingerprint'),
+		('statement_rows_total', 'rows', 'Rows by statement fingerprint'),
+		('statement_slow_total', 'slow', 'Slow executions by statement fingerprint'),
+	]:
+		metric(name, 'counter', help_text,
+		       [(statement_labels(fingerprint), stats[field]) for fingerprint, stats in sorted(statements.items())])
+
+	metric('pool_events_total', 'counter', 'Connection pool events',
+	       [([('event', name)], value) for name, value in sorted(pool.items())])
+	metric('db_breaker_open', 'gauge', '1 while the database circuit breaker is open',
+	       [([], 1 if db_breaker.status()['state'] == 'open' else 0)])
+	if replicas:
+		with replica_stats_lock:
+			routing = dict(replica_stats)
+		metric('db_routing_total', 'counter', 'Requests by database target (and replica checks)',
+		       [([('target', name)], value) for name, value in sorted(routing.items())])
+		metric('db_replica_lag_seconds', 'gauge', 'Replica lag at the last check (-1 while unusable)',
+		       [([('replica', replica.name)], replica.lag if replica.error is None else -1) for replica in replicas])
+	for cache_name, cache in [('lookup', lookup_cache), ('profile', profile_cache), ('search', search_cache),
+	                          ('auth', auth_cache), ('page', page_cache)]:
+		stats = cache.stats()
+		metric('cache_%s_hits_total' % cache_name, 'counter', '%s cache hits' % cache_name, [([], stats['hits'])])
+		metric('cache_%s_misses_total' % cache_name, 'counter', '%s cache misses' % cache_name, [([], stats['misses'])])
+	return '\n'.join(lines) + '\n'
+
+#
+# Users table in the jc6292 schema for authentication (created by migration 1)
+#
+APP_USER_DDL = """
+	CREATE TABLE IF NOT EXISTS jc6292.app_user (
+		user_id SERIAL PRIMARY KEY,
+		username VARCHAR(50) UNIQUE NOT NULL,
+		email VARCHAR(100),
+		password_hash VARCHAR(255) NOT NULL,
+		created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+	)
+"""
+
+#
+# Per-location map summary: one row per location with the number of current residents and
+# the first few names. Triggers on lives_in refresh just the locations a statement touched,
+# so /add_student and /delete_student (whose cascade deletes the lives_in rows) keep it
+# current without the map ever scanning the student table.
+#
+LOCATION_SUMMARY_NAMES = 10     # names kept per location for the marker popup
+
+LOCATION_SUMMARY_DDL = [
+	"""
+	CREATE TABLE IF NOT EXISTS jc6292.location_summary (
+		loc_id INTEGER PRIMARY KEY REFERENCES jc6292.location(loc_id) ON DELETE CASCADE,
+		graduate_count INTEGER NOT NULL,
+		sample_names TEXT[] NOT NULL
+	)
+	""",
+	"""
+	CREATE OR REPLACE FUNCTION jc6292.refresh_location_summary(loc_ids INTEGER[]) RETURNS void AS $$
+	BEGIN
+		-- Serialize refreshes of a location so concurrent writers see each other's rows
+		PERFORM pg_advisory_xact_lock(4111, id)
+		FROM (SELECT DISTINCT unnest(loc_ids) AS id ORDER BY 1) ids
+		WHERE id IS NOT NULL;
+
+		DELETE FROM jc6292.location_summary WHERE loc_id = ANY(loc_ids);
+		INSERT INTO jc6292.location_summary (loc_id, graduate_count, sample_names)
+		SELECT li.loc_id,
+		       COUNT(DISTINCT s.student_id),
+		       (ARRAY_AGG(s.first_name || ' ' || s.last_name
+		                  ORDER BY s.last_name, s.first_name, s.student_id))[1:%d]
+		FROM jc6292.lives_in li
+		JOIN jc6292.student s ON s.student_id = li.student_id
+		WHERE li.until_date IS NULL AND li.loc_id = ANY(loc_ids)
+		GROUP BY li.loc_id;
+	END
+	$$ LANGUAGE plpgsql
+	""" % LOCATION_SUMMARY_NAMES,
+	"""
+	CREATE OR REPLACE FUNCTION jc6292.lives_in_summary_trigger() RETURNS trigger AS $$
+	BEGIN
+		IF TG_OP = 'INSERT' THEN
+			PERFORM jc6292.refresh_location_summary(ARRAY(SELECT DISTINCT loc_id FROM new_rows));
+		ELSIF TG_OP = 'DELETE' THEN
+			PERFORM jc6292.refresh_location_summary(ARRAY(SELECT DISTINCT loc_id FROM old_rows));
+		ELSE
+			PERFORM jc6292.refresh_location_summary(ARRAY(
+				SELECT loc_id FROM new_rows UNION SELECT loc_id FROM old_rows));
+		END IF;
+		RETURN NULL;
+	END
+	$$ LANGUAGE plpgsql
+	""",
+	"DROP TRIGGER IF EXISTS lives_in_summary_insert ON jc6292.lives_in",
+	"DROP TRIGGER IF EXISTS lives_in_summary_delete ON jc6292.lives_in",
+	"DROP TRIGGER IF EXISTS lives_in_summary_update ON jc6292.lives_in",
+	"""
+	CREATE TRIGGER lives_in_summary_insert AFTER INSERT ON jc6292.lives_in
+	REFERENCING NEW TABLE AS new_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION jc6292.lives_in_summary_trigger()
+	""",
+	"""
+	CREATE TRIGGER lives_in_summary_delete AFTER DELETE ON jc6292.lives_in
+	REFERENCING OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION jc6292.lives_in_summary_trigger()
+	""",
+	"""
+	CREATE TRIGGER lives_in_summary_update AFTER UPDATE ON jc6292.lives_in
+	REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+	FOR EACH STATEMENT EXECUTE FUNCTION jc6292.lives_in_summary_trigger()
+	""",
+]
+
+# Built once, when the summary table is new
+LOCATION_SUMMARY_BUILD = """
+	SELECT jc6292.refresh_location_summary(ARRAY(SELECT loc_id FROM jc6292.location))
+	WHERE NOT EXISTS (SELECT 1 FROM jc6292.location_summary)
+"""
+
+#
+# Location coordinates. latitude/longitude live on jc6292.location; the cities the map used
+# to hard-code are filled in when missing. Bounding-box lookups use a PostGIS GiST index
+# when the extension is installed (and the index exists), and an in-process grid index
+# otherwise.
+#
+KNOWN_CITY_COORDINATES = [
+	('San Francisco', 'CA', 37.7749, -122.4194),
+	('Chicago', 'IL', 41.8781, -87.6298),
+	('Seattle', 'WA', 47.6062, -122.3321),
+	('New York City', 'NY', 40.7128, -74.0060),
+	('New York', 'NY', 40.7128, -74.0060),
+	('Los Angeles', 'CA', 34.0522, -118.2437),
+	('Boston', 'MA', 42.3601, -71.0589),
+	('Austin', 'TX', 30.2672, -97.7431),
+	('Denver', 'CO', 39.7392, -104.9903),
+]
+
+spatial_backend = 'grid'
+
+
+def seed_city_coordinates(conn):
+	"""Fill in the coordinates of the known cities that have none"""
+	for city, state, latitude, longitude in KNOWN_CITY_COORDINATES:
+		conn.execute(text("""
+			UPDATE jc6292.location SET latitude = :latitude, longitude = :longitude
+			WHERE city = :city AND state = :state AND latitude IS NULL
+		"""), {'city': city, 'state': state, 'latitude': latitude, 'longitude': longitude})
+
+
+def create_spatial_index(conn):
+	"""GiST index on the location points, if PostGIS is installed"""
+	if conn.execute(text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'postgis')")).scalar():
+		conn.execute(text("""
+			CREATE INDEX IF NOT EXISTS location_point_gist ON jc6292.location
+			USING gist (ST_SetSRID(ST_MakePoint(longitude, latitude), 4326))
+		"""))
+
+
+class GridIndex(object):
+	"""Points bucketed into cell_size-degree cells, for bounding-box queries"""
+
+	def __init__(self, points, cell_size=1.0):
+		self.cell_size = cell_size
+		self.cells = {}
+		for point_id, latitude, longitude in points:
+			self.cells.setdefault(self.cell(latitude, longitude), []).append((point_id, latitude, longitude))
+
+	def cell(self, latitude, longitude):
+		return (math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size))
+
+	def query(self, west, south, east, north):
+		"""Ids of the points inside the box"""
+		low_row, low_col = self.cell(south, west)
+		high_row, high_col = self.cell(north, east)
+		if (high_row - low_row + 1) * (high_col - low_col + 1) > len(self.cells):
+			# Zoomed far out: scanning the occupied cells is cheaper than the empty ones
+			candidates = [p for points in self.cells.values() for p in points]
+		else:
+			candidates = [p for row in range(low_row, high_row + 1)
+			                for col in range(low_col, high_col + 1)
+			                for p in self.cells.get((row, col), ())]
+		return [point_id for point_id, latitude, longitude in candidates
+		        if south <= latitude <= north and west <= longitude <= east]
+
+
+#
+# Name search for the autocomplete API. With the pg_trgm extension, student and club
+# names get trigram GIN indexes and are matched in Postgres; without it (the extension
+# needs privileges the course account may not have) an in-process PrefixIndex is used.
+# Migration 8 is recorded as applied either way, so the later migrations still run.
+#
+name_search_backend = 'prefix'
+
+
+def create_trigram_indexes(conn):
+	"""Create the trigram indexes if pg_trgm is (or can be) installed by this account"""
+	available = conn.execute(text(
+		"SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')"
+	)).scalar()
+	if not available:
+		return
+	try:
+		with conn.begin_nested():
+			conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+			conn.execute(text("""
+				CREATE INDEX IF NOT EXISTS student_name_trgm ON jc6292.student
+				USING gin ((first_name || ' ' || last_name) gin_trgm_ops)
+			"""))
+			conn.execute(text("CREATE INDEX IF NOT EXISTS club_name_trgm ON jc6292.club USING gin (name gin_trgm_ops)"))
+	except exc.ProgrammingError as e:
+		# e.g. no privilege to create the extension: detect_backends() stays on the prefix index
+		print(f"⚠️  Name search without pg_trgm: {str(e.orig).strip()}")
+
+
+def detect_backends(conn):
+	"""Pick the spatial and name search backends from the indexes the migrations could create"""
+	global spatial_backend, name_search_backend
+	indexes = set(conn.execute(text(
+		"SELECT indexname FROM pg_indexes WHERE schemaname = 'jc6292' AND indexname = ANY(:names)"
+	), {'names': ['location_point_gist', 'student_name_trgm', 'club_name_trgm']}).scalars())
+	spatial_backend = 'postgis' if 'location_point_gist' in indexes else 'grid'
+	name_search_backend = 'trgm' if {'student_name_trgm', 'club_name_trgm'} <= indexes else 'prefix'
+
+
+#
+# Analytics rollups for /analytics. Each table holds one aggregate of the base tables:
+#
+#   analytics_industry_year    alumni per current industry and graduation year
+#   analytics_club_retention   members per club and join year: still active, left within
+#                              their first year, total days of membership of those who left
+#   analytics_migration_flows  moves from one location to the next in each lives_in history
+#   analytics_industry_tags    students per industry_tags value
+#
+# Statement-level triggers turn each write into +/- deltas of just the rows it touched and
+# append them to the rollup's _delta table. Appending takes no locks other writers wait on
+# (updating shared counters in place deadlocked against the location summary's locks, which
+# add_student and a cascading delete take in a different order). Reads add the pending
+# deltas to the rollup, so they are always current, and compact_analytics() folds the deltas
+# in every ANALYTICS_COMPACT_INTERVAL seconds; either way the dashboard reads tables the size
+# of the dimensions, however many alumni there are. Counts that drop to 0 are filtered out
+# on read.
+#
+# industry x year joins two tables that one statement (add_student's CTEs, a cascading
+# delete) can change together, so each student's pairs are kept in
+# analytics_student_industry_year: a write to either table recomputes the pairs of the
+# students it touched and queues the difference, the same whichever trigger runs first.
+#
+# ANALYTICS_ROLLUPS (table: key columns, count columns, aggregate) computes the same rows
+# from scratch: rebuild_analytics() fills the tables with it, and `server.py analytics
+# --check` and bench/analytics.py compare the two.
+#
+ANALYTICS_COMPACT_LOCK = 4113   # pg_try_advisory_xact_lock key: one compaction at a time
+
+ANALYTICS_ROLLUPS = {
+	'analytics_industry_year': ('industry_id, year', 'alumni', """
+		SELECT w.industry_id, g.year, COUNT(DISTINCT w.student_id)
+		FROM jc6292.works_in w
+		JOIN jc6292.graduated_in g ON g.student_id = w.student_id
+		WHERE w.end_year IS NULL
+		GROUP BY w.industry_id, g.year
+	"""),
+	'analytics_club_retention': ('club_id, join_year', 'members, active, left_first_year, tenure_days', """
+		SELECT club_id, EXTRACT(YEAR FROM join_date)::int, COUNT(*),
+		       COUNT(*) FILTER (WHERE leave_date IS NULL),
+		       COUNT(*) FILTER (WHERE leave_date - join_date < 365),
+		       COALESCE(SUM(leave_date - join_date), 0)
+		FROM jc6292.member_of
+		GROUP BY 1, 2
+	"""),
+	'analytics_migration_flows': ('from_loc_id, to_loc_id', 'moves', """
+		SELECT from_loc_id, to_loc_id, COUNT(*)
+		FROM (SELECT loc_id AS from_loc_id,
+		             LEAD(loc_id) OVER (PARTITION BY student_id ORDER BY since_date, loc_id) AS to_loc_id
+		      FROM jc6292.lives_in) moves
+		WHERE to_loc_id <> from_loc_id
+		GROUP BY 1, 2
+	"""),
+	'analytics_industry_tags': ('tag', 'alumni', """
+		SELECT tag, COUNT(DISTINCT s.student_id)
+		FROM jc6292.student s, unnest(s.industry_tags) AS tag
+		WHERE tag <> ''
+		GROUP BY tag
+	"""),
+}
+
+STUDENT_INDUSTRY_YEAR_PAIRS = """
+	SELECT DISTINCT w.student_id, w.industry_id, g.year
+	FROM jc6292.works_in w
+	JOIN jc6292.graduated_in g ON g.student_id = w.student_id
+	WHERE w.end_year IS NULL
+"""
+
+ANALYTICS_DDL = [
+	"""
+	CREATE TABLE jc6292.analytics_industry_year (
+		industry_id INTEGER NOT NULL,
+		year INTEGER NOT NULL,
+		alumni INTEGER NOT NULL,
+		PRIMARY KEY (industry_id, year)
+	)
+	""",
+	"""
+	CREATE TABLE jc6292.analytics_club_retention (
+		club_id INTEGER NOT NULL,
+		join_year INTEGER NOT NULL,
+		members INTEGER NOT NULL,
+		active INTEGER NOT NULL,
+		left_first_year INTEGER NOT NULL,
+		tenure_days BIGINT NOT NULL,
+		PRIMARY KEY (club_id, join_year)
+	)
+	""",
+	"""
+	CREATE TABLE jc6292.analytics_migration_flows (
+		from_loc_id INTEGER NOT NULL,
+		to_loc_id INTEGER NOT NULL,
+		moves INTEGER NOT NULL,
+		PRIMARY KEY (from_loc_id, to_loc_id)
+	)
+	""",
+	"""
+	CREATE TABLE jc6292.analytics_industry_tags (
+		tag TEXT PRIMARY KEY,
+		alumni INTEGER NOT NULL
+	)
+	""",
+] + ["CREATE TABLE jc6292.%s_delta (LIKE jc6292.%s)" % (table, table) for table in ANALYTICS_ROLLUPS] + [
+	"""
+	CREATE TABLE jc6292.analytics_student_industry_year (
+		student_id INTEGER NOT NULL,
+		industry_id INTEGER NOT NULL,
+		year INTEGER NOT NULL,
+		PRIMARY KEY (student_id, industry_id, year)
+	)
+	""",
+	# The rows a statement changed as a query over its transition tables, with sign +1 for
+	# new rows and -1 for old ones (an UPDATE is both)
+	"""
+	CREATE FUNCTION jc6292.analytics_changes(op TEXT, columns TEXT) RETURNS TEXT AS $$
+		SELECT CASE op
+			WHEN 'INSERT' THEN format('SELECT %1$s, 1 AS sign FROM new_rows', columns)
+			WHEN 'DELETE' THEN format('SELECT %1$s, -1 AS sign FROM old_rows', columns)
+			ELSE format('SELECT %1$s, 1 AS sign FROM new_rows UNION ALL SELECT %1$s, -1 FROM old_rows', columns)
+		END
+	$$ LANGUAGE sql IMMUTABLE
+	""",
+	"""
+	CREATE FUNCTION jc6292.refresh_industry_year(student_ids INTEGER[]) RETURNS void AS $$
+		WITH pairs AS (
+			SELECT DISTINCT w.student_id, w.industry_id, g.year
+			FROM jc6292.works_in w
+			JOIN jc6292.graduated_in g ON g.student_id = w.student_id
+			WHERE w.student_id = ANY(student_ids) AND w.end_year IS NULL
+		), removed AS (
+			DELETE FROM jc6292.analytics_student_industry_year p
+			WHERE p.student_id = ANY(student_ids)
+			  AND (p.student_id, p.industry_id, p.year) NOT IN (SELECT * FROM pairs)
+			RETURNING p.industry_id, p.year, -1 AS sign
+		), added AS (
+			INSERT INTO jc6292.analytics_student_industry_year (student_id, industry_id, year)
+			SELECT * FROM pairs
+			ON CONFLICT DO NOTHING
+			RETURNING industry_id, year, 1 AS sign
+		)
+		INSERT INTO jc6292.analytics_industry_year_delta (industry_id, year, alumni)
+		SELECT industry_id, year, SUM(sign)
+		FROM (SELECT * FROM removed UNION ALL SELECT * FROM added) changes
+		GROUP BY 1, 2 HAVING SUM(sign) <> 0
+	$$ LANGUAGE sql
+	""",
+	"""
+	CREATE FUNCTION jc6292.industry_year_analytics_trigger() RETURNS trigger AS $$
+	DECLARE
+		student_ids INTEGER[];
+	BEGIN
+		EXECUTE format('SELECT ARRAY(SELECT DISTINCT student_id FROM (%s) c ORDER BY 1)',
+		               jc6292.analytics_changes(TG_OP, 'student_id')) INTO student_ids;
+		PERFORM jc6292.refresh_industry_year(student_ids);
+		RETURN NULL;
+	END
+	$$ LANGUAGE plpgsql
+	""",
+	"""
+	CREATE FUNCTION jc6292.member_of_analytics_trigger() RETURNS trigger AS $$
+	BEGIN
+		EXECUTE format($sql$
+			INSERT INTO jc6292.analytics_club_retention_delta
+				(club_id, join_year, members, active, left_first_year, tenure_days)
+			SELECT club_id, EXTRACT(YEAR FROM join_date)::int, SUM(sign),
+			       COALESCE(SUM(sign) FILTER (WHERE leave_date IS NULL), 0),
+			       COALESCE(SUM(sign) FILTER (WHERE leave_date - join_date < 365), 0),
+			       COALESCE(SUM(sign * (leave_date - join_date)), 0)
+			FROM (%s) c
+			GROUP BY 1, 2
+		$sql$, jc6292.analytics_changes(TG_OP, 'club_id, join_date, leave_date'));
+		RETURN NULL;
+	END
+	$$ LANGUAGE plpgsql
+	""",
+	# A student's flows depend on their whole history: recompute them before and after the
+	# statement for just the students it touched, and queue the difference
+	"""
+	CREATE FUNCTION jc6292.lives_in_analytics_trigger() RETURNS trigger AS $$
+	BEGIN
+		EXECUTE format($sql$
+			WITH changes AS (%s),
+			after AS (
+				SELECT student_id, loc_id, since_date FROM jc6292.lives_in
+				WHERE student_id IN (SELECT student_id FROM changes)
+			),
+			before AS (
+				(SELECT * FROM after
+				 EXCEPT SELECT student_id, loc_id, since_date FROM changes WHERE sign = 1)
+				UNION ALL SELECT student_id, loc_id, since_date FROM changes WHERE sign = -1
+			),
+			moves AS (
+				SELECT sign, loc_id AS from_loc_id,
+				       LEAD(loc_id) OVER (PARTITION BY sign, student_id ORDER BY since_date, loc_id) AS to_loc_id
+				FROM (SELECT *, 1 AS sign FROM after UNION ALL SELECT *, -1 FROM before) history
+			)
+			INSERT INTO jc6292.analytics_migration_flows_delta (from_loc_id, to_loc_id, moves)
+			SELECT from_loc_id, to_loc_id, SUM(sign)
+			FROM moves
+			WHERE to_loc_id <> from_loc_id
+			GROUP BY 1, 2 HAVING SUM(sign) <> 0
+		$sql$, jc6292.analytics_changes(TG_OP, 'student_id, loc_id, since_date'));
+		RETURN NULL;
+	END
+	$$ LANGUAGE plpgsql
+	""",
+	"""
+	CREATE FUNCTION jc6292.student_analytics_trigger() RETURNS trigger AS $$
+	BEGIN
+		EXECUTE format($sql$
+			INSERT INTO jc6292.analytics_industry_tags_delta (tag, alumni)
+			SELECT tag, SUM(sign)
+			FROM (SELECT DISTINCT c.student_id, c.sign, tag
+			      FROM (%s) c, unnest(c.industry_tags) AS tag
+			      WHERE tag <> '') tags
+			GROUP BY 1 HAVING SUM(sign) <> 0
+		$sql$, jc6292.analytics_changes(TG_OP, 'student_id, industry_tags'));
+		RETURN NULL;
+	END
+	$$ LANGUAGE plpgsql
+	""",
+] + [
+	"""
+	CREATE TRIGGER {table}_analytics_{op} AFTER {event} ON jc6292.{table}
+	REFERENCING {transitions}
+	FOR EACH STATEMENT EXECUTE FUNCTION jc6292.{function}_analytics_trigger()
+	""".format(table=table, op=op, event=op.upper(), transitions=transitions, function=function)
+	for table, function in (('works_in', 'industry_year'), ('graduated_in', 'industry_year'),
+	                        ('member_of', 'member_of'), ('lives_in', 'lives_in'), ('student', 'student'))
+	for op, transitions in (('insert', 'NEW TABLE AS new_rows'), ('delete', 'OLD TABLE AS old_rows'),
+	                        ('update', 'NEW TABLE AS new_rows OLD TABLE AS old_rows'))
+]
+
+
+def rollup_sums(counts):
+	return ', '.join('SUM(%s)::bigint AS %s' % (column, column) for column in counts.split(', '))
+
+
+def rebuild_analytics(conn):
+	"""Recompute every rollup from the base tables, holding off writers meanwhile"""
+	conn.execute(text("LOCK TABLE jc6292.student, jc6292.works_in, jc6292.graduated_in, jc6292.member_of, "
+	                  "jc6292.lives_in IN SHARE MODE"))
+	conn.execute(text("TRUNCATE jc6292.analytics_student_industry_year"))
+	conn.execute(text("INSERT INTO jc6292.analytics_student_industry_year " + STUDENT_INDUSTRY_YEAR_PAIRS))
+	for table, (keys, counts, aggregate) in ANALYTICS_ROLLUPS.items():
+		conn.execute(text("TRUNCATE jc6292.%s, jc6292.%s_delta" % (table, table)))
+		conn.execute(text("INSERT INTO jc6292.%s (%s, %s) %s" % (table, keys, counts, aggregate)))
+
+
+def compact_analytics(conn):
+	"""
+	Fold the queued deltas into the rollups; returns the number of delta rows, or None when
+	another compaction holds the lock. Only the compaction updates rollup rows, so it never
+	waits on a writer.
+	"""
+	if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {'key': ANALYTICS_COMPACT_LOCK}).scalar():
+		return None
+	folded = 0
+	for table, (keys, counts, _) in ANALYTICS_ROLLUPS.items():
+		folded += conn.execute(text("""
+			WITH moved AS (DELETE FROM jc6292.{table}_delta RETURNING *),
+			merged AS (
+				INSERT INTO jc6292.{table} AS a ({keys}, {counts})
+				SELECT {keys}, {sums} FROM moved GROUP BY {keys} ORDER BY {keys}
+				ON CONFLICT ({keys}) DO UPDATE SET {updates}
+			)
+			SELECT COUNT(*) FROM moved
+		""".format(table=table, keys=keys, counts=counts, sums=rollup_sums(counts),
+		           updates=', '.join('%s = a.%s + EXCLUDED.%s' % (column, column, column)
+		                             for column in counts.split(', '))))).scalar()
+	return folded
+
+
+#
+# Versioned schema migrations. Each one runs once, in order, in its own transaction, and
+# is recorded in jc6292.schema_migrations; `python server.py migrate` applies the pending
+# ones (and `run` does too, from its warm-up thread). A transaction-level advisory lock makes
+# concurrent deploys and workers wait for each other, and the version is re-checked under
+# the lock, so a migration never runs twice. Nothing touches the database at import.
+#
+# A migration is a list of SQL statements, or of functions called with the connection for
+# steps that depend on what the server has installed.
+#
+# The indexes match the predicates the route queries join on: "current" rows (until_date,
+# end_year, leave_date IS NULL) are a small part of each history table, so partial indexes
+# on just those rows stay small, and INCLUDE makes them covering for the lateral lookups.
+#
+MIGRATIONS_LOCK = 4112          # pg_advisory_xact_lock key (4111 is the location summary)
+
+SCHEMA_MIGRATIONS_DDL = """
+	CREATE TABLE IF NOT EXISTS jc6292.schema_migrations (
+		version INTEGER PRIMARY KEY,
+		name TEXT NOT NULL,
+		applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+		duration_ms DOUBLE PRECISION
+	)
+"""
+
+MIGRATIONS = [
+	(1, 'app_user', [APP_USER_DDL]),
+	(2, 'current_row_indexes', [
+		"""CREATE INDEX IF NOT EXISTS lives_in_current_by_location ON jc6292.lives_in (loc_id)
+		   INCLUDE (student_id) WHERE until_date IS NULL""",
+		"""CREATE INDEX IF NOT EXISTS lives_in_current_by_student ON jc6292.lives_in (student_id)
+		   INCLUDE (loc_id) WHERE until_date IS NULL""",
+		"""CREATE INDEX IF NOT EXISTS works_in_current_by_student ON jc6292.works_in (student_id)
+		   INCLUDE (industry_id) WHERE end_year IS NULL""",
+		"""CREATE INDEX IF NOT EXISTS member_of_current_by_student ON jc6292.member_of (student_id)
+		   INCLUDE (club_id) WHERE leave_date IS NULL""",
+		"""CREATE INDEX IF NOT EXISTS member_of_current_by_club ON jc6292.member_of (club_id)
+		   INCLUDE (student_id) WHERE leave_date IS NULL""",
+	]),
+	(3, 'graduation_year_index', [
+		"""CREATE INDEX IF NOT EXISTS graduated_in_by_year ON jc6292.graduated_in (year)
+		   INCLUDE (student_id)""",
+	]),
+	(4, 'student_name_order_index', [
+		# ORDER BY last_name, first_name, student_id: /api/graduates keyset pages, /manage_students
+		"""CREATE INDEX IF NOT EXISTS student_name_order ON jc6292.student (last_name, first_name, student_id)""",
+	]),
+	(5, 'app_user_email_index', [
+		# username is already indexed by its UNIQUE constraint; signup also looks up email
+		"""CREATE INDEX IF NOT EXISTS app_user_email ON jc6292.app_user (email)""",
+	]),
+	# 6-8 used to run on every import; on databases that already have them they are no-ops.
+	# Changing LOCATION_SUMMARY_NAMES needs a new migration that re-creates the function.
+	(6, 'location_summary', LOCATION_SUMMARY_DDL + [LOCATION_SUMMARY_BUILD]),
+	(7, 'location_coordinates', [
+		"ALTER TABLE jc6292.location ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION",
+		"ALTER TABLE jc6292.location ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION",
+		seed_city_coordinates,
+		create_spatial_index,
+	]),
+	(8, 'name_search_trigrams', [create_trigram_indexes]),
+	(9, 'analytics_rollups', ANALYTICS_DDL + [rebuild_analytics]),
+]
+
+MIGRATION_INDEX_NAME = re.compile(r'CREATE (?:UNIQUE )?INDEX IF NOT EXISTS (\w+)', re.IGNORECASE)
+
+
+def migration_indexes():
+	"""Names of the indexes the migrations create"""
+	return [name for _, _, statements in MIGRATIONS for statement in statements
+	        if isinstance(statement, str) for name in MIGRATION_INDEX_NAME.findall(statement)]
+
+
+def applied_migrations(conn):
+	"""{version: (name, applied_at)} of the migrations recorded in the database (read-only)"""
+	if conn.execute(text("SELECT to_regclass('jc6292.schema_migrations')")).scalar() is None:
+		return {}
+	rows = conn.execute(text("SELECT version, name, applied_at FROM jc6292.schema_migrations")).fetchall()
+	return {row[0]: (row[1], row[2]) for row in rows}
+
+
+def pending_migrations(conn):
+	"""Versions of the migrations not applied yet"""
+	applied = applied_migrations(conn)
+	return [version for version, _, _ in MIGRATIONS if version not in applied]
+
+
+def migrate(target=None, echo=print):
+	"""Apply the pending migrations up to version `target` (all by default); returns their versions"""
+	with engine.connect() as conn:
+		pending = [version for version in pending_migrations(conn) if target is None or version <= target]
+	applied = []
+	for version, name, statements in MIGRATIONS:
+		if version not in pending:
+			continue
+		with engine.begin() as conn:
+			conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATIONS_LOCK})
+			conn.execute(text(SCHEMA_MIGRATIONS_DDL))
+			if version in applied_migrations(conn):
+				continue            # another process got there first
+			started = time.perf_counter()
+			for statement in statements:
+				if callable(statement):
+					statement(conn)
+				else:
+					conn.execute(text(statement))
+			elapsed = (time.perf_counter() - started) * 1000
+			conn.execute(text(
+				"INSERT INTO jc6292.schema_migrations (version, name, duration_ms) VALUES (:version, :name, :ms)"
+			), {'version': version, 'name': name, 'ms': elapsed})
+		echo("applied %03d %s (%.0f ms)" % (version, name, elapsed))
+		applied.append(version)
+	return applied
+
+
+def route_queries(conn):
+	"""(name, sql, params) for the read queries the routes run, with sample parameters from the data"""
+	club_id, year, student_id, username = conn.execute(text("""
+		SELECT (SELECT club_id FROM jc6292.member_of WHERE leave_date IS NULL
+		        GROUP BY club_id ORDER BY COUNT(*) DESC LIMIT 1),
+		       (SELECT MAX(year) FROM jc6292.graduated_in),
+		       (SELECT MAX(student_id) FROM jc6292.student),
+		       (SELECT MIN(username) FROM jc6292.app_user)
+	""")).fetchone()
+	queries = []
+	for label, club_filter, year_filter in [('', '', ''), ('_club', club_id, ''), ('_year', '', year)]:
+		query, params = graduates_query(club_filter, year_filter)
+		queries.append(('graduates' + label, query + " LIMIT %d" % (GRADUATES_PAGE_SIZE + 1), params))
+		queries.append(('locations' + label,) + locations_query(club_filter, year_filter))
+	tsquery, search_argument = search_tsquery('research')
+	queries += [
+		('alumni_profile', PROFILE_QUERY, {'student_id': student_id or 0}),
+		('search_clubs', SEARCH_QUERY.format(tsquery=tsquery), {
+			'search_query': search_argument, 'headline_options': HEADLINE_OPTIONS,
+			'limit': SEARCH_PAGE_SIZE, 'offset': 0}),
+		('manage_students', MANAGE_STUDENTS_QUERY, {'limit': MANAGE_PAGE_SIZE, 'offset': 0}),
+		('manage_students_count', MANAGE_STUDENTS_COUNT_QUERY, {}),
+		('find_user', "SELECT user_id, username, email, password_hash FROM jc6292.app_user "
+		              "WHERE username = :username", {'username': username or ''}),
+		('signup', SIGNUP_QUERY, {'username': username or '', 'email': 'nobody@example.com',
+		                          'password_hash': 'x'}),
+	]
+	return queries
+
+
+def plan_scans(plan):
+	"""The scan nodes of an EXPLAIN (FORMAT JSON) plan, as short strings"""
+	scans = []
+	if 'Scan' in plan['Node Type']:
+		scans.append(plan['Node Type'] + (' using ' + plan['Index Name'] if 'Index Name' in plan
+		                                  else ' on ' + plan.get('Relation Name', '?')))
+	for child in plan.get('Plans', ()):
+		scans.extend(plan_scans(child))
+	return scans
+
+
+def explain_route_queries(conn, repeat=3):
+	"""{name: {'ms': fastest execution time, 'scans': [...]}} from EXPLAIN ANALYZE of each route query"""
+	report = {}
+	for name, query, params in route_queries(conn):
+		best = None
+		for _ in range(repeat):
+			explained = conn.execute(text("EXPLAIN (ANALYZE, FORMAT JSON) " + query), params).scalar()[0]
+			if best is None or explained['Execution Time'] < best['Execution Time']:
+				best = explained
+		report[name] = {'ms': best['Execution Time'], 'scans': sorted(set(plan_scans(best['Plan'])))}
+	return report
+
+
+def migration_plan_report(echo=print):
+	"""Apply pending migrations and compare the route query plans without and with their indexes"""
+	# The route queries read tables the migrations create (app_user, location_summary, ...),
+	# so both plans are taken on the migrated schema
+	migrate(echo=echo)
+	with engine.connect() as conn:
+		# Plan "before" with the migration indexes dropped inside a transaction that is rolled
+		# back. DROP INDEX locks the tables until then: run this against a local copy.
+		for index in migration_indexes():
+			conn.execute(text("DROP INDEX IF EXISTS jc6292.%s" % index))
+		before = explain_route_queries(conn)
+		conn.rollback()
+	with engine.connect() as conn:
+		after = explain_route_queries(conn)
+		conn.rollback()
+
+	used = set()
+	echo("%-22s %10s %10s %8s  %s" % ('query', 'before ms', 'after ms', 'change', 'plan change'))
+	for name in after:
+		old, new = before[name], after[name]
+		used.update(scan.split(' using ')[-1] for scan in new['scans'] if ' using ' in scan)
+		change = (new['ms'] - old['ms']) / old['ms'] * 100 if old['ms'] else 0.0
+		echo("%-22s %10.2f %10.2f %+7.0f%%  %s" % (name, old['ms'], new['ms'], change,
+		     'unchanged' if old['scans'] == new['scans'] else
+		     '%s -> %s' % (', '.join(sorted(set(old['scans']) - set(new['scans']))),
+		                   ', '.join(sorted(set(new['scans']) - set(old['scans']))))))
+	unused = [index for index in migration_indexes() if index not in used]
+	if unused:
+		echo("not chosen by any plan at this data size: %s" % ', '.join(unused))
+	return before, after
+
+
+#
+# Circuit breaker around engine.connect(). After DB_BREAKER_THRESHOLD failed connects in
+# a row it opens and every checkout fails immediately with DatabaseUnavailable (a 503)
+# instead of waiting out another connect timeout. Once the backoff has passed, one request
+# is let through as a probe (half-open): success closes the breaker, failure reopens it
+# with the backoff doubled, up to DB_BREAKER_MAX_BACKOFF seconds.
+#
+DB_BREAKER_THRESHOLD = int(os.environ.get('DB_BREAKER_THRESHOLD', '3'))
+DB_BREAKER_BACKOFF = float(os.environ.get('DB_BREAKER_BACKOFF', '1'))
+DB_BREAKER_MAX_BACKOFF = float(os.environ.get('DB_BREAKER_MAX_BACKOFF', '60'))
+
+
+class DatabaseUnavailable(Exception):
+	"""The database cannot be reached (or the breaker is open); retry after `retry_after` seconds"""
+
+	def __init__(self, message, retry_after):
+		super().__init__(message)
+		self.retry_after = retry_after
+
+
+class CircuitBreaker(object):
+	"""Closed / open / half-open breaker with exponential backoff, shared by all threads"""
+
+	def __init__(self, threshold=3, backoff=1.0, max_backoff=60.0, name='Database'):
+		self.name = name
+		self.threshold = threshold
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.lock = threading.Lock()
+		self.state = 'closed'
+		self.failures = 0           # consecutive failed connects
+		self.opened = 0             # consecutive times opened, drives the backoff
+		self.retry_at = 0.0
+		self.probing = False
+		self.last_error = None
+		self.rejected = 0
+
+	def before_call(self):
+		"""Raise DatabaseUnavailable unless a connect may be attempted now"""
+		with self.lock:
+			if self.state == 'closed':
+				return
+			now = time.time()
+			if self.state == 'open' and now >= self.retry_at:
+				self.state = 'half_open'
+			if self.state == 'half_open' and not self.probing:
+				self.probing = True
+				return
+			self.rejected += 1
+			raise DatabaseUnavailable("Database is temporarily unavailable", max(1, int(math.ceil(self.retry_at - now))))
+
+	def record_success(self):
+		with self.lock:
+			self.state = 'closed'
+			self.failures = self.opened = 0
+			self.probing = False
+
+	def release(self):
+		"""End a call that says nothing about the database, leaving the state as it was"""
+		with self.lock:
+			self.probing = False
+
+	def record_failure(self, error):
+		with self.lock:
+			self.failures += 1
+			self.last_error = str(error).strip().splitlines()[0] if str(error).strip() else type(error).__name__
+			if self.state == 'half_open' or self.failures >= self.threshold:
+				delay = min(self.max_backoff, self.backoff * 2 ** self.opened)
+				self.opened += 1
+				self.state = 'open'
+				self.retry_at = time.time() + delay
+				self.probing = False
+				print(f"⚠️  {self.name} circuit open for {delay:.1f}s: {self.last_error}")
+			return max(1, int(math.ceil(self.retry_at - time.time())))
+
+	def status(self):
+		with self.lock:
+			return {
+				'state': self.state,
+				'consecutive_failures': self.failures,
+				'retry_in': max(0.0, round(self.retry_at - time.time(), 1)) if self.state != 'closed' else None,
+				'rejected': self.rejected,
+				'last_error': self.last_error,
+			}
+
+
+db_breaker = CircuitBreaker(DB_BREAKER_THRESHOLD, DB_BREAKER_BACKOFF, DB_BREAKER_MAX_BACKOFF)
+
+
+#
+# Lazy per-request connection: g.conn behaves like a Connection, but nothing is checked
+# out of the pool until the first execute(). Requests that never query (redirects to
+# /login, plain form pages, /logout) finish without a database round-trip.
+#
+class LazyConnection(object):
+	"""Stand-in for a Connection that connects on first use"""
+
+	def __init__(self, engine):
+		self.engine = engine
+		self.conn = None
+
+	@property
+	def used(self):
+		return self.conn is not None
+
+	def checkout(self):
+		"""Return the underlying Connection, connecting if this is the first use"""
+		if self.conn is None and self.engine is not engine:
+			# A replica that cannot be reached sends the request to the primary
+			self.conn = connect_replica(self.engine)
+			if self.conn is None:
+				self.engine = engine
+		if self.conn is None:
+			db_breaker.before_call()
+			started = time.perf_counter()
+			try:
+				self.conn = self.engine.connect()
+			except exc.TimeoutError:
+				# Pool exhausted: no connect was attempted, so the breaker neither trips nor closes
+				with pool_stats_lock:
+					pool_stats['checkout_failures'] += 1
+				db_breaker.release()
+				raise
+			except Exception as e:
+				with pool_stats_lock:
+					pool_stats['checkout_failures'] += 1
+				raise DatabaseUnavailable("Database is temporarily unavailable", db_breaker.record_failure(e)) from e
+			db_breaker.record_success()
+			g.db_checkout_ms = (time.perf_counter() - started) * 1000
+			pool_samples['checkout_wait_ms'].append(g.db_checkout_ms)
+			with pool_stats_lock:
+				pool_stats['checkouts'] += 1
+		return self.conn
+
+	def execute(self, *args, **kwargs):
+		return self.checkout().execute(*args, **kwargs)
+
+	def commit(self):
+		if self.conn is not None:
+			self.conn.commit()
+
+	def rollback(self):
+		if self.conn is not None:
+			self.conn.rollback()
+
+	def close(self):
+		if self.conn is not None:
+			self.conn.close()
+			self.conn = None
+
+
+#
+# Read/write split. With DATABASE_REPLICA_URLS set, GET and HEAD requests read from a
+# replica and everything else uses the primary (every write route is a POST). /health
+# always checks the primary.
+#
+# Each process re-checks its replicas every REPLICA_CHECK_INTERVAL seconds from a
+# background thread started during warm-up, never on the request path; until the first
+# check every read goes to the primary. A replica more than REPLICA_MAX_LAG seconds behind,
+# promoted out of recovery, or unreachable gets no reads until a later check finds it
+# healthy. Every replica has its own circuit breaker: after DB_BREAKER_THRESHOLD failed
+# connects (from checks or requests) it is left alone, checks included, for the breaker's
+# backoff instead of being retried every interval.
+#
+# Read-your-writes: invalidate(), which the write routes call after they commit, records
+# the primary's WAL position. It is stored in the writer's session (for up to
+# REPLICA_STICKY_TTL seconds) and as this process's high-water mark. A read only goes to a
+# replica that has replayed past both. Otherwise it goes to the primary, so neither the
+# writer nor this process's caches see data older than their own writes.
+#
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))                # seconds
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 1))  # seconds
+REPLICA_STICKY_TTL = float(os.environ.get('REPLICA_STICKY_TTL', 60))         # seconds
+
+PRIMARY_ENDPOINTS = {'health'}
+
+# replay position in bytes, and seconds behind (0 when everything received has been replayed)
+REPLICA_STATUS_QUERY = """
+	SELECT pg_is_in_recovery(),
+	       pg_last_wal_replay_lsn() - '0/0'::pg_lsn,
+	       CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+	            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+
+class Replica(object):
+	"""A replica engine and what the last check found"""
+
+	def __init__(self, engine):
+		self.engine = engine
+		self.name = engine.url.render_as_string(hide_password=True)
+		self.breaker = CircuitBreaker(DB_BREAKER_THRESHOLD, DB_BREAKER_BACKOFF, DB_BREAKER_MAX_BACKOFF,
+		                              name='Replica %s' % self.name)
+		self.replay_lsn = None
+		self.lag = None
+		self.error = 'not checked yet'
+
+	def connect(self):
+		"""A connection, or None (and the replica marked down) if it cannot be reached or its circuit is open"""
+		try:
+			self.breaker.before_call()
+		except DatabaseUnavailable:
+			return None
+		try:
+			conn = self.engine.connect()
+		except exc.TimeoutError:
+			self.breaker.release()      # pool exhausted, as in LazyConnection.checkout
+			return None
+		except Exception as e:
+			self.breaker.record_failure(e)
+			self.error = str(e).split('\n')[0]
+			return None
+		self.breaker.record_success()
+		return conn
+
+	def usable(self, lsn):
+		return self.error is None and self.lag <= REPLICA_MAX_LAG and self.replay_lsn >= lsn
+
+	def status(self):
+		return {'name': self.name, 'replay_lsn': self.replay_lsn, 'lag_s': self.lag, 'error': self.error,
+		        'circuit': self.breaker.status()['state']}
+
+
+replicas = [Replica(replica_engine) for replica_engine in replica_engines]
+replica_lock = threading.Lock()             # held while checking the replicas
+replica_stats_lock = threading.Lock()
+replica_state = {'checked_at': 0.0, 'written_lsn': 0, 'pid': None}
+replica_stats = {'replica': 0, 'primary': 0, 'primary_catching_up': 0, 'primary_no_replica': 0,
+                 'replica_down': 0, 'checks': 0}
+
+
+def check_replicas():
+	"""Refresh replay position and lag of every replica, unless another thread is already at it"""
+	if not replica_lock.acquire(blocking=False):
+		return
+	try:
+		for replica in replicas:
+			conn = replica.connect()
+			if conn is None:
+				if replica.error is None:
+					replica.error = 'circuit open'
+				continue
+			try:
+				with conn:
+					in_recovery, replay_lsn, lag = conn.execute(text(REPLICA_STATUS_QUERY)).fetchone()
+				replica.replay_lsn, replica.lag = int(replay_lsn or 0), float(lag or 0)
+				replica.error = None if in_recovery else 'not in recovery (promoted?)'
+			except Exception as e:
+				replica.error = str(e).split('\n')[0]
+		replica_state['checked_at'] = time.time()
+		count_route('checks')
+	finally:
+		replica_lock.release()
+
+
+def check_replicas_forever():
+	while True:
+		time.sleep(REPLICA_CHECK_INTERVAL)
+		check_replicas()
+
+
+def start_replica_checks():
+	"""Check the replicas once now, then from this process's background thread"""
+	if not replicas or replica_state['pid'] == os.getpid():
+		return
+	replica_state['pid'] = os.getpid()
+	check_replicas()
+	threading.Thread(target=check_replicas_forever, name='replica-checks', daemon=True).start()
+
+
+def count_route(target):
+	with replica_stats_lock:
+		replica_stats[target] += 1
+
+
+def read_engine():
+	"""The engine for this request: a replica that is caught up enough for it, or the primary"""
+	if not replicas:
+		return engine
+	if request.method not in ('GET', 'HEAD') or request.endpoint in PRIMARY_ENDPOINTS:
+		count_route('primary')
+		return engine
+	needed = replica_state['written_lsn']
+	token = session.get('written_lsn')
+	if token and time.time() - token[1] > REPLICA_STICKY_TTL:
+		session.pop('written_lsn')
+		token = None
+	if token:
+		needed = max(needed, token[0])
+	candidates = [replica for replica in replicas if replica.usable(needed)]
+	if not candidates:
+		healthy = any(replica.usable(0) for replica in replicas)
+		count_route('primary_catching_up' if healthy else 'primary_no_replica')
+		return engine
+	if token and all(replica.usable(token[0]) for replica in replicas if replica.error is None):
+		session.pop('written_lsn')         # every healthy replica has the write now
+	count_route('replica')
+	return random.choice(candidates).engine
+
+
+def connect_replica(replica_engine):
+	"""A connection to the replica, or None if it is down (the request then uses the primary)"""
+	replica = next(replica for replica in replicas if replica.engine is replica_engine)
+	conn = replica.connect()
+	if conn is None:
+		count_route('replica_down')
+	return conn
+
+
+def record_write(conn):
+	"""After a commit on the primary: remember its WAL position for read-your-writes"""
+	lsn = int(conn.execute(text("SELECT pg_current_wal_lsn() - '0/0'::pg_lsn")).scalar())
+	with replica_stats_lock:
+		replica_state['written_lsn'] = max(replica_state['written_lsn'], lsn)
+	session['written_lsn'] = [lsn, time.time()]
+
+
+@app.before_request
+def before_request():
+	"""
+	This function is run at the beginning of every web request 
+	(every time you enter an address in the web browser).
+	We use it to setup a database connection that can be used throughout the request.
+	The connection is lazy: it is only opened once the route actually runs a query.
+	Read-only requests may get a replica (see read_engine).
+
+	The variable g is globally accessible.
+	"""
+	g.conn = LazyConnection(read_engine())
+
+
+@app.after_request
+def add_server_timing(response):
+	"""Report the connection checkout wait of this request to the client (and the load test)"""
+	if 'db_checkout_ms' in g:
+		response.headers['Server-Timing'] = 'db-checkout;dur=%.2f' % g.db_checkout_ms
+	return response
+
+@app.teardown_request
+def teardown_request(exception):
+	"""
+	At the end of the web request, this makes sure to close the database connection.
+	If you don't, the database could run out of memory!
+	"""
+	conn = g.pop('conn', None)
+	if conn is None:
+		return
+	with pool_stats_lock:
+		pool_stats['requests_with_db' if conn.used or g.get('ran_reads') else 'requests_without_db'] += 1
+	try:
+		conn.close()
+	except Exception as e:
+		pass
+
+
+@app.errorhandler(DatabaseUnavailable)
+def database_unavailable(e):
+	"""Answer quickly with a 503 while the database is down instead of tying up the worker"""
+	headers = {'Retry-After': str(e.retry_after)}
+	if request.path.startswith('/api/'):
+		return jsonify(error=str(e)), 503, headers
+	return "Database is temporarily unavailable. Please try again in a moment.", 503, headers
+
+#
+# Response compression, negotiated from Accept-Encoding: brotli when the optional brotli
+# package is installed and the client accepts it, gzip otherwise. Streamed responses are
+# compressed chunk by chunk as they are produced. A compressed body is a different
+# representation, so its ETag is made weak (conditional() compares weakly).
+#
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))     # bytes
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))             # gzip level
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+COMPRESS_MIMETYPES = {'text/html', 'text/plain', 'text/csv', 'text/css', 'application/json',
+                      'application/x-ndjson', 'application/javascript', 'text/javascript'}
+
+try:
+	import brotli   # optional: pip install brotli
+except ImportError:
+	brotli = None
+
+
+def choose_encoding():
+	accepted = request.accept_encodings
+	if brotli is not None and accepted['br'] > 0 and accepted['br'] >= accepted['gzip']:
+		return 'br'
+	if accepted['gzip'] > 0:
+		return 'gzip'
+	return None
+
+
+def compressor(encoding):
+	"""(compress(chunk), flush(), finish()) for one response"""
+	if encoding == 'br':
+		codec = brotli.Compressor(quality=BROTLI_QUALITY)
+		return codec.process, codec.flush, codec.finish
+	codec = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)    # 31: gzip container
+	return codec.compress, lambda: codec.flush(zlib.Z_SYNC_FLUSH), codec.flush
+
+
+def compress_stream(chunks, encoding):
+	compress, flush, finish = compressor(encoding)
+	for chunk in chunks:
+		if isinstance(chunk, str):
+			chunk = chunk.encode('utf-8')
+		data = compress(chunk) + flush()    # flush so the client sees each chunk as it is written
+		if data:
+			yield data
+	yield finish()
+
+
+@app.after_request
+def compress_response(response):
+	if (response.status_code != 200 or response.direct_passthrough
+	        or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+		return response
+	response.vary.add('Accept-Encoding')
+	encoding = choose_encoding()
+	if encoding is None:
+		return response
+	
+	if response.is_streamed:
+		response.response = compress_stream(response.response, encoding)
+		response.headers.pop('Content-Length', None)
+	else:
+		data = response.get_data()
+		if len(data) < COMPRESS_MIN_SIZE:
+			return response
+		compress, flush, finish = compressor(encoding)
+		response.set_data(compress(data) + finish())
+	response.headers['Content-Encoding'] = encoding
+	etag, weak = response.get_etag()
+	if etag and not weak:
+		response.set_etag(etag, weak=True)
+	return response
+
+
+def run_on_own_connection(read, db_engine=None):
+	conn = LazyConnection(db_engine or engine)
+	try:
+		return read(conn)
+	finally:
+		conn.close()
+
+
+read_state = {'pid': None, 'executor': None}
+read_lock = threading.Lock()
+
+def read_executor():
+	"""The run_reads thread pool for this process, created on first use (and again after a fork)"""
+	with read_lock:
+		if read_state['pid'] != os.getpid():
+			# A read holds a pooled connection for its whole run, so more threads than the
+			# pool has connections would only wait on the pool
+			read_state['executor'] = ThreadPoolExecutor(max_workers=DB_POOL_SIZE + DB_MAX_OVERFLOW,
+			                                            thread_name_prefix='reads')
+			read_state['pid'] = os.getpid()
+		return read_state['executor']
+
+
+def run_reads(*reads):
+	"""
+	Run independent reads - functions taking a connection - and return their results in
+	order. With a connection pool each read gets its own pooled connection and they run
+	at the same time on the process's read thread pool, so the page waits for the slowest
+	query instead of the sum of them. With NullPool every extra connection costs a full
+	connect, and a request already holding g.conn should not wait on a second one, so
+	those run one after another on g.conn.
+	"""
+	if len(reads) < 2 or DB_POOL_MODE == 'null' or g.conn.used:
+		return [read(g.conn) for read in reads]
+
+	db_engine = g.conn.engine      # the same primary or replica as the rest of the request
+	g.ran_reads = True
+	# Each read sees a copy of the request's context, as it would on the request thread
+	futures = [read_executor().submit(contextvars.copy_context().run, run_on_own_connection, read, db_engine)
+	           for read in reads]
+	return [future.result() for future in futures]
+
+
+#
+# Data versions: one counter per entity family ('clubs', 'students', 'lookups'), bumped
+# by the write routes. Cached data is keyed by the version it was read at, so bumping a
+# version invalidates every copy of it. With CACHE_REDIS_URL set (a local Redis, or
+# anything that speaks its protocol) the counters are shared by all worker processes.
+#
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+LOOKUP_CACHE_TTL = float(os.environ.get('LOOKUP_CACHE_TTL', 300))    # seconds
+LOOKUP_CACHE_SIZE = int(os.environ.get('LOOKUP_CACHE_SIZE', 64))     # entries
+
+
+class DataVersions(object):
+	"""Per-family version counters, kept in process or in Redis"""
+
+	def __init__(self, redis_url=None):
+		self.lock = threading.Lock()
+		self.local = {}
+		self.redis = None
+		if redis_url:
+			import redis  # optional dependency, only needed for a shared cache
+			self.redis = redis.Redis.from_url(redis_url)
+
+	def key(self, family):
+		return 'graduate-map:version:' + family
+
+	def get(self, family):
+		if self.redis is not None:
+			return int(self.redis.get(self.key(family)) or 0)
+		with self.lock:
+			return self.local.get(family, 0)
+
+	def bump(self, family):
+		if self.redis is not None:
+			return self.redis.incr(self.key(family))
+		with self.lock:
+			self.local[family] = self.local.get(family, 0) + 1
+			return self.local[family]
+
+	def backend(self):
+		return 'redis' if self.redis is not None else 'local'
+
+
+class TTLCache(object):
+	"""Thread-safe LRU cache whose entries also expire after ttl seconds"""
+
+	def __init__(self, maxsize=128, ttl=300):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.data = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = self.misses = self.evictions = 0
+
+	def get(self, key):
+		"""Return the cached value, or None on a miss"""
+		with self.lock:
+			entry = self.data.get(key)
+			if entry is not None and entry[0] < time.monotonic():
+				del self.data[key]
+				self.evictions += 1
+				entry = None
+			if entry is None:
+				self.misses += 1
+				return None
+			self.data.move_to_end(key)
+			self.hits += 1
+			return entry[1]
+
+	def set(self, key, value):
+		with self.lock:
+			self.data[key] = (time.monotonic() + self.ttl, value)
+			self.data.move_to_end(key)
+			while len(self.data) > self.maxsize:
+				self.data.popitem(last=False)
+				self.evictions += 1
+
+	def discard(self, predicate):
+		"""Drop every entry whose key matches predicate"""
+		with self.lock:
+			for key in [k for k in self.data if predicate(k)]:
+				del self.data[key]
+				self.evictions += 1
+
+	def stats(self):
+		with self.lock:
+			lookups = self.hits + self.misses
+			return {
+				'size': len(self.data),
+				'maxsize': self.maxsize,
+				'ttl': self.ttl,
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+				'hit_rate': self.hits / lookups if lookups else None,
+			}
+
+
+data_versions = DataVersions(CACHE_REDIS_URL)
+lookup_cache = TTLCache(maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL)
+
+#
+# Dropdown datasets: name -> (family, query, row -> dict)
+#
+LOOKUP_QUERIES = {
+	'clubs': ('clubs',
+	          "SELECT club_id, name, category, about FROM jc6292.club WHERE club_id IS NOT NULL ORDER BY name",
+	          lambda r: {'id': r[0], 'name': r[1], 'category': r[2], 'about': r[3]}),
+	'locations': ('lookups',
+	              "SELECT loc_id, city, state, latitude, longitude FROM jc6292.location WHERE loc_id IS NOT NULL ORDER BY city",
+	              lambda r: {'id': r[0], 'city': r[1], 'state': r[2], 'latitude': r[3], 'longitude': r[4]}),
+	'industries': ('lookups',
+	               "SELECT industry_id, name FROM jc6292.industry WHERE industry_id IS NOT NULL ORDER BY name",
+	               lambda r: {'id': r[0], 'name': r[1]}),
+	'years': ('students',
+	          "SELECT DISTINCT year FROM jc6292.graduated_in ORDER BY year DESC",
+	          lambda r: r[0]),
+}
+
+
+def load_lookup(conn, name):
+	family, query, to_item = LOOKUP_QUERIES[name]
+	cursor = conn.execute(text(query))
+	items = [to_item(result) for result in cursor if result[0] is not None]
+	cursor.close()
+	return items
+
+
+def get_lookups(*names):
+	"""Read-through cache for the dropdown datasets in LOOKUP_QUERIES; misses are loaded concurrently"""
+	keys = [(name, data_versions.get(LOOKUP_QUERIES[name][0])) for name in names]
+	items = [lookup_cache.get(key) for key in keys]
+	missing = [i for i, found in enumerate(items) if found is None]
+	loaded = run_reads(*[lambda conn, name=names[i]: load_lookup(conn, name) for i in missing])
+	for i, found in zip(missing, loaded):
+		lookup_cache.set(keys[i], found)
+		items[i] = found
+	return items
+
+
+def get_lookup(name):
+	return get_lookups(name)[0]
+
+
+def invalidate(*families):
+	"""
+	Called by the write routes after commit: bump the versions of the changed families
+	(and, with replicas, record the write position for read-your-writes).
+	Returns the new versions.
+	"""
+	if replicas and has_request_context():
+		record_write(g.conn)
+	versions = {family: data_versions.bump(family) for family in families}
+	names = [name for name, spec in LOOKUP_QUERIES.items() if spec[0] in families]
+	lookup_cache.discard(lambda key: key[0] in names)
+	return versions
+
+
+#
+# Conditional GET. A page's ETag is a hash of the URL, the user and the versions of the
+# data families it shows, so If-None-Match is answered with a 304 from the version
+# counters alone, before the route runs or a connection is checked out. In-process
+# counters (no CACHE_REDIS_URL) cannot see another worker's writes, so with several worker
+# processes (wsgi.multiprocess, as under `run --workers N`) no ETags are sent and every
+# request runs the route. A single process still misses writes from the command line and
+# restarts its counters at 0, so its ETags also carry a per-process token and roll over
+# every HTTP_CACHE_TTL seconds. PAGE_CACHE_SIZE > 0 additionally keeps rendered pages
+# keyed by their ETag.
+#
+HTTP_CACHE_TTL = float(os.environ.get('HTTP_CACHE_TTL', 300))     # seconds, local counters only
+PAGE_CACHE_TTL = float(os.environ.get('PAGE_CACHE_TTL', 300))     # seconds
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 0))       # rendered pages, 0 = off
+
+# Changes whenever the code or templates do, so a deploy never answers 304 with an old page
+ETAG_BUILD = '%d' % max(os.path.getmtime(path) for path in
+                        [os.path.abspath(__file__)] + [os.path.join(tmpl_dir, name) for name in os.listdir(tmpl_dir)])
+ETAG_PROCESS = os.urandom(4).hex()
+
+page_cache = TTLCache(maxsize=max(PAGE_CACHE_SIZE, 1), ttl=PAGE_CACHE_TTL)
+http_cache_stats_lock = threading.Lock()
+http_cache_stats = {'conditional_requests': 0, 'not_modified': 0, 'page_cache_hits': 0}
+
+
+def page_etag(families):
+	parts = [ETAG_BUILD, request.full_path, session.get('username', '')]
+	parts += ['%s=%d' % (family, data_versions.get(family)) for family in families]
+	if data_versions.backend() == 'local':
+		parts += [ETAG_PROCESS, str(int(time.time() // HTTP_CACHE_TTL))]
+	return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()[:24]
+
+
+def validators_shared():
+	"""Whether every process serving the app sees the version bumps of every write"""
+	return data_versions.backend() != 'local' or not request.environ.get('wsgi.multiprocess', False)
+
+
+def conditional(*families):
+	"""
+	Decorator for GET routes that only depend on the given data families. Family names are
+	formatted with the view arguments, e.g. 'student:{student_id}'.
+	"""
+	def decorator(view):
+		@functools.wraps(view)
+		def wrapper(*args, **kwargs):
+			if 'username' not in session or not validators_shared():
+				return view(*args, **kwargs)
+			etag = page_etag([family.format(**kwargs) for family in families])
+			headers = {'Cache-Control': 'private, no-cache'}
+			with http_cache_stats_lock:
+				http_cache_stats['conditional_requests'] += 1
+			if request.if_none_match.contains_weak(etag):
+				with http_cache_stats_lock:
+					http_cache_stats['not_modified'] += 1
+				response = Response(status=304, headers=headers)
+				response.set_etag(etag)
+				return response
+			
+			cached = page_cache.get(etag) if PAGE_CACHE_SIZE > 0 else None
+			if cached is not None:
+				with http_cache_stats_lock:
+					http_cache_stats['page_cache_hits'] += 1
+				response = Response(cached[0], mimetype=cached[1], headers=headers)
+			else:
+				response = app.make_response(view(*args, **kwargs))
+				if response.status_code != 200:
+					return response
+				response.headers.update(headers)
+				if PAGE_CACHE_SIZE > 0 and not response.is_streamed:
+					page_cache.set(etag, (response.get_data(), response.mimetype))
+			response.set_etag(etag)
+			return response
+		return wrapper
+	return decorator
+
+
+#
+# Graduates on the map (including industry_tags array). The result is ordered by
+# (last_name, first_name, student_id) so it can be paged with a keyset cursor.
+#
+# GRADUATES_QUERY_MODE=aggregated (default) returns each student once, with current clubs
+# and industries collected into arrays. GRADUATES_QUERY_MODE=joined is the original flat
+# join, which repeats a student once per club x industry combination.
+#
+GRADUATES_QUERY_MODE = os.environ.get('GRADUATES_QUERY_MODE', 'aggregated')
+GRADUATES_PAGE_SIZE = 200
+GRADUATES_MAX_PAGE_SIZE = 1000
+GRADUATES_FETCH_SIZE = 500      # rows per round-trip from the server-side cursor
+
+GRADUATES_AGGREGATED_QUERY = """
+	SELECT 
+		s.student_id,
+		s.first_name,
+		s.last_name,
+		s.email,
+		l.city,
+		l.state,
+		g.year as graduation_year,
+		g.degree,
+		g.honors,
+		jobs.industries,
+		memberships.clubs,
+		memberships.club_categories,
+		s.industry_tags
+	FROM jc6292.student s
+	JOIN jc6292.lives_in li ON s.student_id = li.student_id AND li.until_date IS NULL
+	JOIN jc6292.location l ON li.loc_id = l.loc_id
+	LEFT JOIN LATERAL (
+		SELECT gi.year, gi.degree, gi.honors
+		FROM jc6292.graduated_in gi
+		WHERE gi.student_id = s.student_id {graduation_filter}
+		ORDER BY gi.year DESC
+		LIMIT 1
+	) g ON TRUE
+	LEFT JOIN LATERAL (
+		SELECT ARRAY_AGG(i.name ORDER BY i.name) AS industries
+		FROM jc6292.works_in w
+		JOIN jc6292.industry i ON w.industry_id = i.industry_id
+		WHERE w.student_id = s.student_id AND w.end_year IS NULL
+	) jobs ON TRUE
+	LEFT JOIN LATERAL (
+		SELECT ARRAY_AGG(c.name ORDER BY c.name) AS clubs,
+		       ARRAY_AGG(c.category ORDER BY c.name) AS club_categories
+		FROM jc6292.member_of m
+		JOIN jc6292.club c ON m.club_id = c.club_id
+		WHERE m.student_id = s.student_id AND m.leave_date IS NULL
+	) memberships ON TRUE
+	WHERE TRUE
+"""
+
+GRADUATES_QUERY = """
+	SELECT 
+		s.student_id,
+		s.first_name,
+		s.last_name,
+		s.email,
+		l.city,
+		l.state,
+		g.year as graduation_year,
+		g.degree,
+		g.honors,
+		i.name as industry_name,
+		c.name as club_name,
+		c.category as club_category,
+		s.industry_tags
+	FROM jc6292.student s
+	LEFT JOIN jc6292.graduated_in g ON s.student_id = g.student_id
+	LEFT JOIN jc6292.lives_in li ON s.student_id = li.student_id AND li.until_date IS NULL
+	LEFT JOIN jc6292.location l ON li.loc_id = l.loc_id
+	LEFT JOIN jc6292.works_in w ON s.student_id = w.student_id AND w.end_year IS NULL
+	LEFT JOIN jc6292.industry i ON w.industry_id = i.industry_id
+	LEFT JOIN jc6292.member_of m ON s.student_id = m.student_id AND m.leave_date IS NULL
+	LEFT JOIN jc6292.club c ON m.club_id = c.club_id
+	WHERE l.loc_id IS NOT NULL
+"""
+
+
+def graduates_query(club_filter, year_filter, after=None, loc_filter=None, mode=None):
+	"""Build the graduates query and its parameters for the map filters"""
+	mode = mode or GRADUATES_QUERY_MODE
+	params = {}
+	if mode == 'aggregated':
+		# With a year filter, show the graduation from that year rather than the latest one
+		query = GRADUATES_AGGREGATED_QUERY.format(
+			graduation_filter="AND gi.year = :year" if year_filter else "")
+		if club_filter:
+			query += """ AND EXISTS (SELECT 1 FROM jc6292.member_of fm
+			                        WHERE fm.student_id = s.student_id AND fm.club_id = :club_id
+			                          AND fm.leave_date IS NULL)"""
+			params['club_id'] = club_filter
+		if year_filter:
+			query += " AND g.year IS NOT NULL"
+			params['year'] = year_filter
+	elif mode == 'joined':
+		query = GRADUATES_QUERY
+		if club_filter:
+			# Filter for specific club, ensuring we only get students with that club
+			query += " AND c.club_id = :club_id AND c.club_id IS NOT NULL"
+			params['club_id'] = club_filter
+		if year_filter:
+			query += " AND g.year = :year"
+			params['year'] = year_filter
+	else:
+		raise ValueError(f"Unknown graduates query mode: {mode}")
+	if loc_filter:
+		query += " AND l.loc_id = :loc_id"
+		params['loc_id'] = loc_filter
+	if after:
+		# Keyset pagination: continue strictly after the last student of the previous page
+		query += " AND (s.last_name, s.first_name, s.student_id) > (:after_last, :after_first, :after_id)"
+		params['after_last'], params['after_first'], params['after_id'] = after
+	query += " ORDER BY s.last_name, s.first_name, s.student_id"
+	return query, params
+
+
+def graduate_from_row(result):
+	"""Row of either query mode -> dict; clubs and industries are always lists"""
+	industries, clubs, club_categories = result[9], result[10], result[11]
+	if not isinstance(clubs, list) and not isinstance(industries, list):
+		# joined mode: at most one club and one industry per row (aggregated mode gives
+		# lists, or NULL for both when a student has no clubs and no current job)
+		industries = [industries] if industries else []
+		clubs, club_categories = ([clubs], [club_categories]) if clubs else ([], [])
+	return {
+		'student_id': result[0],
+		'first_name': result[1],
+		'last_name': result[2],
+		'email': result[3],
+		'city': result[4],
+		'state': result[5],
+		'graduation_year': result[6],
+		'degree': result[7],
+		'honors': result[8],
+		'industries': industries or [],
+		'clubs': clubs or [],
+		'club_categories': club_categories or [],
+		'industry_tags': result[12] if result[12] else []
+	}
+
+
+def encode_cursor(graduate):
+	key = [graduate['last_name'], graduate['first_name'], graduate['student_id']]
+	return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(token):
+	"""Inverse of encode_cursor; raises ValueError on a malformed token"""
+	try:
+		last_name, first_name, student_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+	except Exception:
+		raise ValueError("invalid cursor")
+	return str(last_name), str(first_name), int(student_id)
+
+
+def int_arg(name):
+	"""Query parameter `name` as an int, None when missing or empty; raises ValueError naming it"""
+	value = request.args.get(name, '').strip()
+	if not value:
+		return None
+	try:
+		return int(value)
+	except ValueError:
+		raise ValueError("%s must be an integer" % name)
+
+
+# Larger ?page= numbers are cut down to this, which keeps (page - 1) * page size well
+# inside a bigint OFFSET; the routes then clamp to their actual last page.
+MAX_PAGE = 10 ** 6
+
+def page_arg():
+	"""?page= as an int in [1, MAX_PAGE], 1 when missing or malformed"""
+	try:
+		page = int(request.args.get('page', 1))
+	except ValueError:
+		return 1
+	return min(max(page, 1), MAX_PAGE)
 
 #
-# This line creates a database engine that knows how to connect to the URI above.
-# Using NullPool to avoid connection pool issues (important for shared databases)
+# Columnar JSON for the map APIs (?format=columnar): each key is sent once, with a list
+# of values per column, and the repetitive string columns (city, club, industry, ...) are
+# dictionary-encoded as indexes into a shared list of distinct values. Lists of strings
+# (a graduate's clubs) become lists of indexes. static/columnar.js turns it back into rows.
 #
-engine = create_engine(DATABASEURI, poolclass=NullPool)
+GRADUATE_DICTIONARIES = {
+	'city': 'cities', 'state': 'states', 'degree': 'degrees', 'honors': 'honors',
+	'industries': 'industries', 'industry_tags': 'industries',
+	'clubs': 'clubs', 'club_categories': 'club_categories',
+}
+LOCATION_DICTIONARIES = {'state': 'states', 'color': 'colors'}
+
+
+def encode_columnar(rows, dictionaries):
+	"""List of same-keyed dicts -> {'count', 'columns', 'encodings' (column -> dictionary), 'dictionaries'}"""
+	codes = {name: {} for name in set(dictionaries.values())}
+
+	def code(name, value):
+		if value is None:
+			return None
+		table = codes[name]
+		if value not in table:
+			table[value] = len(table)
+		return table[value]
+
+	columns = {}
+	for key in (rows[0].keys() if rows else []):
+		values = [row[key] for row in rows]
+		name = dictionaries.get(key)
+		if name is not None:
+			values = [[code(name, item) for item in value] if isinstance(value, list) else code(name, value)
+			          for value in values]
+		columns[key] = values
+	return {
+		'count': len(rows),
+		'columns': columns,
+		'encodings': {key: name for key, name in dictionaries.items() if key in columns},
+		'dictionaries': {name: list(table) for name, table in codes.items()},
+	}
+
 
 #
-# Initialize user table if it doesn't exist
-# This creates a users table in the jc6292 schema for authentication
+# Map markers: one row per location. Unfiltered, this is read straight from
+# location_summary; with a club or year filter it is aggregated on the fly.
 #
-def init_user_table():
-	"""Create user table if it doesn't exist"""
+LOCATIONS_SUMMARY_QUERY = """
+	SELECT ls.loc_id, l.city, l.state, ls.graduate_count, ls.sample_names, l.latitude, l.longitude
+	FROM jc6292.location_summary ls
+	JOIN jc6292.location l ON l.loc_id = ls.loc_id
+	WHERE TRUE
+"""
+
+LOCATIONS_FILTERED_QUERY = """
+	SELECT l.loc_id, l.city, l.state,
+	       COUNT(DISTINCT s.student_id),
+	       (ARRAY_AGG(s.first_name || ' ' || s.last_name
+	                  ORDER BY s.last_name, s.first_name, s.student_id))[1:%d],
+	       l.latitude, l.longitude
+	FROM jc6292.student s
+	JOIN jc6292.lives_in li ON s.student_id = li.student_id AND li.until_date IS NULL
+	JOIN jc6292.location l ON li.loc_id = l.loc_id
+	WHERE TRUE
+""" % LOCATION_SUMMARY_NAMES
+
+location_grid = {'locations': None, 'index': None}
+
+
+def locations_in_box(bbox):
+	"""Location ids inside bbox from the grid index, rebuilt whenever the lookup cache reloads"""
+	locations = get_lookup('locations')
+	if location_grid['locations'] is not locations:
+		points = [(loc['id'], loc['latitude'], loc['longitude']) for loc in locations
+		          if loc['latitude'] is not None and loc['longitude'] is not None]
+		location_grid['index'] = GridIndex(points)
+		location_grid['locations'] = locations
+	return location_grid['index'].query(*bbox)
+
+
+def parse_bbox(value):
+	"""Parse 'west,south,east,north' into finite floats; raises ValueError"""
 	try:
-		with engine.connect() as conn:
-			create_user_table = """
-			CREATE TABLE IF NOT EXISTS jc6292.app_user (
-				user_id SERIAL PRIMARY KEY,
-				username VARCHAR(50) UNIQUE NOT NULL,
-				email VARCHAR(100),
-				password_hash VARCHAR(255) NOT NULL,
-				created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-			)
-			"""
-			conn.execute(text(create_user_table))
-			conn.commit()
-			print("✅ User table initialized")
-	except Exception as e:
-		print(f"⚠️  User table initialization: {e}")
+		parts = [float(part) for part in value.split(',')]
+	except ValueError:
+		parts = []
+	if len(parts) != 4 or not all(math.isfinite(part) for part in parts) \
+			or parts[0] > parts[2] or parts[1] > parts[3]:
+		raise ValueError("bbox must be west,south,east,north")
+	return parts
 
-# Initialize user table on startup
-init_user_table()
 
+def locations_query(club_filter, year_filter, bbox=None):
+	"""Build the per-location aggregate query for the map filters and viewport"""
+	filtered = club_filter or year_filter
+	query = LOCATIONS_FILTERED_QUERY if filtered else LOCATIONS_SUMMARY_QUERY
+	params = {}
+	if club_filter:
+		query += """ AND EXISTS (SELECT 1 FROM jc6292.member_of m
+		                        WHERE m.student_id = s.student_id AND m.club_id = :club_id
+		                          AND m.leave_date IS NULL)"""
+		params['club_id'] = club_filter
+	if year_filter:
+		query += """ AND EXISTS (SELECT 1 FROM jc6292.graduated_in g
+		                        WHERE g.student_id = s.student_id AND g.year = :year)"""
+		params['year'] = year_filter
+	if bbox and spatial_backend == 'postgis':
+		query += """ AND ST_SetSRID(ST_MakePoint(l.longitude, l.latitude), 4326)
+		             && ST_MakeEnvelope(:west, :south, :east, :north, 4326)"""
+		params['west'], params['south'], params['east'], params['north'] = bbox
+	elif bbox:
+		query += " AND l.loc_id = ANY(:loc_ids)"
+		params['loc_ids'] = locations_in_box(bbox)
+	if filtered:
+		query += " GROUP BY l.loc_id, l.city, l.state, l.latitude, l.longitude"
+	query += " ORDER BY l.city, l.state"
+	return query, params
 
-@app.before_request
-def before_request():
-	"""
-	This function is run at the beginning of every web request 
-	(every time you enter an address in the web browser).
-	We use it to setup a database connection that can be used throughout the request.
 
-	The variable g is globally accessible.
+def count_unplaced_locations():
+	"""Number of locations that cannot be drawn because they have no coordinates yet"""
+	return sum(1 for loc in get_lookup('locations') if loc['latitude'] is None or loc['longitude'] is None)
+
+
+def marker_color(count):
+	"""Color bucket of a map marker by number of graduates"""
+	if count >= 5:
+		return '#e53e3e'
+	if count >= 3:
+		return '#dd6b20'
+	if count >= 2:
+		return '#d69e2e'
+	return '#38a169'
+
+
+#
+# Named server-side prepared statements. A statement is prepared once per pooled
+# connection (the set of names lives in the connection's info dict, which SQLAlchemy
+# clears when the connection is replaced) and then executed with EXECUTE, skipping
+# parse/plan on every later call. Connections that do not outlive the request (NullPool,
+# or PgBouncer in transaction mode) run the statement directly instead.
+#
+def execute_prepared(conn, name, query, params):
+	"""Execute query (written with :name binds) as prepared statement `name`"""
+	if DB_POOL_MODE != 'queue':
+		return conn.execute(text(query), params)
+	if isinstance(conn, LazyConnection):
+		conn = conn.checkout()
+	bind_names = list(dict.fromkeys(re.findall(r'(?<![:\w]):(\w+)', query)))
+	prepared = conn.info.setdefault('prepared_statements', set())
+	if name not in prepared:
+		positional = re.sub(r'(?<![:\w]):(\w+)', lambda m: '$%d' % (bind_names.index(m.group(1)) + 1), query)
+		conn.execute(text("PREPARE %s AS %s" % (name, positional)))
+		prepared.add(name)
+	execute = "EXECUTE %s(%s)" % (name, ', '.join(':' + bind for bind in bind_names))
+	return conn.execute(text(execute), params)
+
+
+#
+# Alumni profile: student, latest graduation, composite-type location and current clubs
+# in a single round-trip, cached per student. The cache key includes a per-student data
+# version, which /delete_student bumps.
+#
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', 60))       # seconds
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 1000))     # profiles
+
+profile_cache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+
+PROFILE_QUERY = """
+	SELECT s.student_id, s.first_name, s.last_name, s.email, s.industry_tags,
+	       g.year, g.degree, g.honors,
+	       (ap.current_location).city, (ap.current_location).state, (ap.current_location).country,
+	       ap.bio, ap.linkedin_url,
+	       memberships.clubs
+	FROM jc6292.student s
+	LEFT JOIN LATERAL (
+		SELECT gi.year, gi.degree, gi.honors
+		FROM jc6292.graduated_in gi
+		WHERE gi.student_id = s.student_id
+		ORDER BY gi.year DESC
+		LIMIT 1
+	) g ON TRUE
+	LEFT JOIN jc6292.alumni_profile ap ON ap.student_id = s.student_id
+	LEFT JOIN LATERAL (
+		SELECT json_agg(json_build_object('name', c.name, 'category', c.category, 'about', c.about)
+		                ORDER BY c.name) AS clubs
+		FROM jc6292.member_of m
+		JOIN jc6292.club c ON m.club_id = c.club_id
+		WHERE m.student_id = s.student_id AND m.leave_date IS NULL
+	) memberships ON TRUE
+	WHERE s.student_id = :student_id
+"""
+
+
+def load_profile(student_id):
+	"""Return (student, clubs) for the profile page, or None if there is no such student"""
+	key = (student_id, data_versions.get('student:%d' % student_id))
+	profile = profile_cache.get(key)
+	if profile is not None:
+		return profile
+	
+	cursor = execute_prepared(g.conn, 'alumni_profile_q', PROFILE_QUERY, {'student_id': student_id})
+	result = cursor.fetchone()
+	cursor.close()
+	if not result:
+		return None
+	
+	student = {
+		'id': result[0],
+		'first_name': result[1],
+		'last_name': result[2],
+		'email': result[3],
+		'industry_tags': result[4] if result[4] else [],
+		'graduation_year': result[5],
+		'degree': result[6],
+		'honors': result[7],
+		'city': result[8],
+		'state': result[9],
+		'country': result[10],
+		'bio': result[11],
+		'linkedin_url': result[12]
+	}
+	profile = (student, result[13] or [])
+	profile_cache.set(key, profile)
+	return profile
+
+
+#
+# Club search. Plain words are matched as prefixes ('robot comp' finds "robotics
+# competitions"); queries written with web-search syntax ("quoted phrase", or, -word) go
+# through websearch_to_tsquery. Results are ranked, paged, and carry a ts_headline
+# snippet. Recent pages are cached under the clubs data version.
+#
+SEARCH_PAGE_SIZE = 20
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', 120))     # seconds
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 256))     # pages
+
+search_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+# ts_headline marks matches with these; they are swapped for <mark> after HTML escaping
+HEADLINE_START, HEADLINE_STOP = '\x02', '\x03'
+HEADLINE_OPTIONS = 'StartSel="%s", StopSel="%s", MaxWords=35, MinWords=15, MaxFragments=2' % (
+	HEADLINE_START, HEADLINE_STOP)
+
+SEARCH_QUERY = """
+	SELECT club_id, name, category, about, rank, total,
+	       ts_headline('english', COALESCE(about, ''), query, :headline_options) AS headline
+	FROM (
+		SELECT club_id, name, category, about, query,
+		       ts_rank(about_tsv, query) AS rank,
+		       COUNT(*) OVER () AS total
+		FROM jc6292.club, {tsquery} AS query
+		WHERE about_tsv @@ query
+		ORDER BY rank DESC, name, club_id
+		LIMIT :limit OFFSET :offset
+	) page
+	ORDER BY rank DESC, name, club_id
+"""
+
+BROWSE_QUERY = """
+	SELECT club_id, name, category, about, 0 AS rank, COUNT(*) OVER () AS total, NULL AS headline
+	FROM jc6292.club
+	ORDER BY name, club_id
+	LIMIT :limit OFFSET :offset
+"""
+
+WEBSEARCH_SYNTAX = re.compile(r'"|\bor\b|(^|\s)-\w', re.IGNORECASE)
+
+
+def search_tsquery(search_query):
+	"""Return (tsquery SQL, its argument) for a search box string"""
+	if WEBSEARCH_SYNTAX.search(search_query):
+		return "websearch_to_tsquery('english', :search_query)", search_query
+	# Only word characters survive, so punctuation can never break to_tsquery
+	words = re.findall(r'\w+', search_query)
+	return "to_tsquery('english', :search_query)", ' & '.join(word + ':*' for word in words)
+
+
+def highlight(headline):
+	"""HTML-escape a ts_headline snippet and turn its match markers into <mark> tags"""
+	if not headline:
+		return None
+	escaped = str(escape(headline))
+	return Markup(escaped.replace(HEADLINE_START, '<mark>').replace(HEADLINE_STOP, '</mark>'))
+
+
+def search_club_page(search_query, page):
+	"""Return (clubs, total matches) for one page of a search, or of all clubs if empty"""
+	key = (search_query, page, data_versions.get('clubs'))
+	cached = search_cache.get(key)
+	if cached is not None:
+		return cached
+	
+	params = {'limit': SEARCH_PAGE_SIZE, 'offset': (page - 1) * SEARCH_PAGE_SIZE}
+	if search_query:
+		tsquery, params['search_query'] = search_tsquery(search_query)
+		params['headline_options'] = HEADLINE_OPTIONS
+		cursor = g.conn.execute(text(SEARCH_QUERY.format(tsquery=tsquery)), params)
+	else:
+		# Show all clubs
+		cursor = g.conn.execute(text(BROWSE_QUERY), params)
+	
+	clubs = []
+	total = 0
+	for result in cursor:
+		clubs.append({
+			'id': result[0],
+			'name': result[1],
+			'category': result[2],
+			'about': result[3],
+			'rank': result[4],
+			'headline': result[6]
+		})
+		total = result[5]
+	cursor.close()
+	
+	if not clubs and page > 1:
+		# Past the last page: OFFSET returned nothing, so the window count is unknown
+		total = search_club_page(search_query, 1)[1]
+	for club in clubs:
+		club['headline'] = highlight(club['headline'])
+	search_cache.set(key, (clubs, total))
+	return clubs, total
+
+
+#
+# Autocomplete. In 'prefix' mode each kind has a PrefixIndex, built from the database the
+# first time it is needed and again whenever its data version moves on. The write routes
+# apply their own change to it directly, so it stays warm in the worker that made it.
+#
+AUTOCOMPLETE_LIMIT = 10
+
+AUTOCOMPLETE_TRGM_QUERIES = {
+	'students': """
+		SELECT student_id, first_name || ' ' || last_name AS label
+		FROM jc6292.student
+		WHERE (first_name || ' ' || last_name) ILIKE :pattern
+		ORDER BY similarity(first_name || ' ' || last_name, :q) DESC, label
+		LIMIT :limit
+	""",
+	'clubs': """
+		SELECT club_id, name AS label
+		FROM jc6292.club
+		WHERE name ILIKE :pattern
+		ORDER BY similarity(name, :q) DESC, label
+		LIMIT :limit
+	""",
+}
+
+# kind -> (family, query returning id, label)
+NAME_INDEX_QUERIES = {
+	'students': ('students', "SELECT student_id, first_name || ' ' || last_name FROM jc6292.student"),
+	'clubs': ('clubs', "SELECT club_id, name FROM jc6292.club"),
+}
+
+
+class PrefixIndex(object):
 	"""
-	# Don't connect to database for static files or login GET requests
-	if request.endpoint in ['static'] or (request.endpoint == 'login' and request.method == 'GET'):
-		g.conn = None
-		return
+	Names kept as sorted (key, id) pairs and searched with bisect. A name is indexed under
+	every word it contains onwards ('ann lee' and 'lee'), so a query can start at any word.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.keys = []
+		self.labels = {}
+		self.version = None
+
+	@staticmethod
+	def entries(item_id, label):
+		words = label.lower().split()
+		return [(' '.join(words[i:]), item_id) for i in range(len(words))]
+
+	def load(self, rows, version):
+		keys = []
+		labels = {}
+		for item_id, label in rows:
+			labels[item_id] = label
+			keys.extend(self.entries(item_id, label))
+		keys.sort()
+		with self.lock:
+			self.keys, self.labels, self.version = keys, labels, version
+
+	def add(self, item_id, label, version):
+		"""Apply a local insert; skipped (forcing a reload) unless it is the only change"""
+		with self.lock:
+			if self.version is None or self.version != version - 1:
+				return
+			for entry in self.entries(item_id, label):
+				bisect.insort(self.keys, entry)
+			self.labels[item_id] = label
+			self.version = version
+
+	def remove(self, item_id, version):
+		with self.lock:
+			if self.version is None or self.version != version - 1:
+				return
+			label = self.labels.pop(item_id, None)
+			if label is not None:
+				for entry in self.entries(item_id, label):
+					position = bisect.bisect_left(self.keys, entry)
+					if position < len(self.keys) and self.keys[position] == entry:
+						del self.keys[position]
+			self.version = version
+
+	def search(self, prefix, limit):
+		prefix = ' '.join(prefix.lower().split())
+		results = []
+		seen = set()
+		with self.lock:
+			position = bisect.bisect_left(self.keys, (prefix,))
+			while position < len(self.keys) and len(results) < limit:
+				key, item_id = self.keys[position]
+				if not key.startswith(prefix):
+					break
+				if item_id not in seen:
+					seen.add(item_id)
+					results.append({'id': item_id, 'label': self.labels[item_id]})
+				position += 1
+		return results
+
+
+name_indexes = {kind: PrefixIndex() for kind in NAME_INDEX_QUERIES}
+
+
+def autocomplete(kind, q, limit):
+	"""Top `limit` names of `kind` matching q"""
+	if name_search_backend == 'trgm':
+		pattern = '%' + re.sub(r'([\\%_])', r'\\\1', q) + '%'
+		cursor = g.conn.execute(text(AUTOCOMPLETE_TRGM_QUERIES[kind]), {'pattern': pattern, 'q': q, 'limit': limit})
+		results = [{'id': result[0], 'label': result[1]} for result in cursor]
+		cursor.close()
+		return results
 	
-	try:
-		g.conn = engine.connect()
-	except:
-		print("uh oh, problem connecting to database")
-		import traceback; traceback.print_exc()
-		g.conn = None
+	family, query = NAME_INDEX_QUERIES[kind]
+	index = name_indexes[kind]
+	version = data_versions.get(family)
+	if index.version != version:
+		cursor = g.conn.execute(text(query))
+		index.load([(result[0], result[1]) for result in cursor], version)
+		cursor.close()
+	return index.search(q, limit)
 
-@app.teardown_request
-def teardown_request(exception):
+
+#
+# Bulk import: validate rows in Python, COPY them into a temp staging table,
+# then fan out to student and the relationship tables with one set-based
+# statement per table, all in the caller's transaction
+#
+IMPORT_FIELDS = ('first_name', 'last_name', 'email', 'location_id', 'industry_id',
+                 'club_id', 'graduation_year', 'degree')
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', '100'))
+
+IMPORT_STAGING_DDL = """
+	CREATE TEMP TABLE student_import (
+		line_no INTEGER PRIMARY KEY,
+		first_name VARCHAR(50) NOT NULL,
+		last_name VARCHAR(50) NOT NULL,
+		email VARCHAR(100),
+		location_id INTEGER NOT NULL,
+		industry_id INTEGER,
+		club_id INTEGER,
+		graduation_year INTEGER,
+		degree VARCHAR(20),
+		student_id INTEGER
+	) ON COMMIT DROP
+"""
+
+# Rows pointing at a location, industry or club that does not exist are
+# removed from staging and reported instead of failing the whole import
+IMPORT_REJECT_QUERY = """
+	DELETE FROM student_import s
+	WHERE NOT EXISTS (SELECT 1 FROM jc6292.location l WHERE l.loc_id = s.location_id)
+	   OR (s.industry_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM jc6292.industry i WHERE i.industry_id = s.industry_id))
+	   OR (s.club_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM jc6292.club c WHERE c.club_id = s.club_id))
+	RETURNING s.line_no,
+	          CASE WHEN NOT EXISTS (SELECT 1 FROM jc6292.location l WHERE l.loc_id = s.location_id)
+	                   THEN 'unknown location_id ' || s.location_id
+	               WHEN s.industry_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM jc6292.industry i WHERE i.industry_id = s.industry_id)
+	                   THEN 'unknown industry_id ' || s.industry_id
+	               ELSE 'unknown club_id ' || s.club_id
+	          END
+"""
+
+IMPORT_FANOUT_QUERIES = [
+	# Pre-assign ids from the student sequence so the relationship inserts can
+	# read them from staging instead of joining back on RETURNING
+	"""UPDATE student_import
+	   SET student_id = nextval(pg_get_serial_sequence('jc6292.student', 'student_id'))""",
+	"""INSERT INTO jc6292.student (student_id, first_name, last_name, email)
+	   SELECT student_id, first_name, last_name, email FROM student_import""",
+	"""INSERT INTO jc6292.lives_in (student_id, loc_id, since_date)
+	   SELECT student_id, location_id, CURRENT_DATE FROM student_import""",
+	"""INSERT INTO jc6292.works_in (student_id, industry_id, start_year)
+	   SELECT student_id, industry_id, EXTRACT(YEAR FROM CURRENT_DATE)::int
+	   FROM student_import WHERE industry_id IS NOT NULL""",
+	"""INSERT INTO jc6292.member_of (student_id, club_id, join_date)
+	   SELECT student_id, club_id, CURRENT_DATE FROM student_import WHERE club_id IS NOT NULL""",
+	"""INSERT INTO jc6292.year_dim (year)
+	   SELECT DISTINCT graduation_year FROM student_import WHERE graduation_year IS NOT NULL
+	   ON CONFLICT (year) DO NOTHING""",
+	"""INSERT INTO jc6292.graduated_in (student_id, year, degree)
+	   SELECT student_id, graduation_year, degree FROM student_import WHERE graduation_year IS NOT NULL""",
+]
+
+
+def import_format(filename, content_type=None):
+	"""Guess 'csv' or 'jsonl' from a file name or content type"""
+	name = (filename or '').lower()
+	if name.endswith(('.jsonl', '.ndjson', '.json')) or 'json' in (content_type or ''):
+		return 'jsonl'
+	return 'csv'
+
+
+def read_import_records(stream, fmt):
+	"""Yield (line_no, record dict) from a text stream of CSV (with a header row) or JSON lines"""
+	if fmt == 'csv':
+		reader = csv.DictReader(stream)
+		for record in reader:
+			yield reader.line_num, record
+		return
+	for line_no, line in enumerate(stream, 1):
+		if not line.strip():
+			continue
+		try:
+			record = json.loads(line)
+		except ValueError as e:
+			yield line_no, "invalid JSON: %s" % e
+			continue
+		yield line_no, record if isinstance(record, dict) else "expected a JSON object"
+
+
+def validate_import_record(record):
+	"""Return the staging row for one record, or raise ValueError naming the bad field"""
+	if not isinstance(record, dict):
+		raise ValueError(record)
+
+	def field(name, required=False, max_length=None, integer=False):
+		value = record.get(name)
+		value = value.strip() if isinstance(value, str) else value
+		if value is None or value == '':
+			if required:
+				raise ValueError("%s is required" % name)
+			return None
+		if integer:
+			try:
+				return int(value)
+			except (TypeError, ValueError):
+				raise ValueError("%s must be an integer" % name)
+		value = str(value)
+		if max_length and len(value) > max_length:
+			raise ValueError("%s is longer than %d characters" % (name, max_length))
+		return value
+
+	graduation_year = field('graduation_year', integer=True)
+	if graduation_year is not None and not 1900 <= graduation_year <= 2100:
+		raise ValueError("graduation_year out of range")
+	return (
+		field('first_name', required=True, max_length=50),
+		field('last_name', required=True, max_length=50),
+		field('email', max_length=100),
+		field('location_id', required=True, integer=True),
+		field('industry_id', integer=True),
+		field('club_id', integer=True),
+		graduation_year,
+		(field('degree', max_length=20) or 'BS') if graduation_year is not None else None,
+	)
+
+
+def copy_value(value):
+	"""One column in COPY text format"""
+	if value is None:
+		return '\\N'
+	return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class CopyReader(object):
+	"""File-like object over an iterator of COPY lines, so copy_expert streams instead of buffering the upload"""
+
+	def __init__(self, lines):
+		self.lines = iter(lines)
+		self.pending = ''
+
+	def read(self, size=-1):
+		chunks, length = [self.pending], len(self.pending)
+		while size < 0 or length < size:
+			line = next(self.lines, None)
+			if line is None:
+				break
+			chunks.append(line)
+			length += len(line)
+		data = ''.join(chunks)
+		if size < 0:
+			size = len(data)
+		self.pending = data[size:]
+		return data[:size]
+
+	readline = read
+
+
+def import_students(conn, records):
 	"""
-	At the end of the web request, this makes sure to close the database connection.
-	If you don't, the database could run out of memory!
+	Import (line_no, record) pairs in the current transaction of conn.
+	Invalid rows are skipped and reported; the caller commits (or rolls back
+	for a dry run) and invalidates the students family.
 	"""
+	errors = []
+	counts = {'rows': 0, 'rejected': 0}
+
+	def reject(line_no, message):
+		counts['rejected'] += 1
+		if len(errors) < IMPORT_MAX_ERRORS:
+			errors.append({'line': line_no, 'error': message})
+
+	def staged_lines():
+		for line_no, record in records:
+			counts['rows'] += 1
+			try:
+				row = validate_import_record(record)
+			except ValueError as e:
+				reject(line_no, str(e))
+				continue
+			yield '\t'.join(copy_value(value) for value in (line_no,) + row) + '\n'
+
+	conn.execute(text(IMPORT_STAGING_DDL))
+	cursor = conn.connection.cursor()
 	try:
-		g.conn.close()
-	except Exception as e:
+		cursor.copy_expert("COPY student_import (line_no, %s) FROM STDIN" % ', '.join(IMPORT_FIELDS),
+		                   CopyReader(staged_lines()))
+	finally:
+		cursor.close()
+
+	for line_no, message in conn.execute(text(IMPORT_REJECT_QUERY)).fetchall():
+		reject(line_no, message)
+	for query in IMPORT_FANOUT_QUERIES:
+		conn.execute(text(query))
+	errors.sort(key=lambda error: error['line'])
+	return {'rows': counts['rows'], 'imported': counts['rows'] - counts['rejected'],
+	        'rejected': counts['rejected'], 'errors': errors}
+
+
+#
+# Export of the map's graduates (same club_id and year filters) as CSV, JSON lines or,
+# with the optional pyarrow package, Parquet. Rows are read from a server-side cursor
+# EXPORT_CHUNK_ROWS at a time and each batch is written out (as one Parquet row group)
+# before the next is fetched, so memory stays flat however many graduates match. Exports
+# always use the aggregated query: one row per student, clubs and industries as lists.
+#
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 2000))
+EXPORT_COLUMNS = ['student_id', 'first_name', 'last_name', 'email', 'city', 'state', 'graduation_year',
+                  'degree', 'honors', 'industries', 'clubs', 'club_categories', 'industry_tags']
+EXPORT_LIST_COLUMNS = {'industries', 'clubs', 'club_categories', 'industry_tags'}
+EXPORT_LIST_SEPARATOR = '; '    # between the items of a list in one CSV cell
+
+try:
+	import pyarrow          # optional: pip install pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+
+def export_graduates(conn, club_filter, year_filter):
+	"""
+	Start the export query and return an iterator over lists of up to EXPORT_CHUNK_ROWS
+	graduate dicts. The query runs before this returns, so a failure to start it can
+	still be reported with a proper status; the rows are fetched as the iterator is read.
+	"""
+	query, params = graduates_query(club_filter, year_filter, mode='aggregated')
+	result = conn.execute(text(query), params, execution_options={'yield_per': EXPORT_CHUNK_ROWS})
+
+	def chunks():
+		try:
+			for rows in result.partitions(EXPORT_CHUNK_ROWS):
+				yield [graduate_from_row(row) for row in rows]
+		finally:
+			result.close()
+	return chunks()
+
+
+def write_csv(chunks):
+	out = io.StringIO()
+	writer = csv.writer(out)
+	writer.writerow(EXPORT_COLUMNS)
+	for chunk in chunks:
+		for graduate in chunk:
+			writer.writerow([EXPORT_LIST_SEPARATOR.join(graduate[column]) if column in EXPORT_LIST_COLUMNS
+			                 else graduate[column] for column in EXPORT_COLUMNS])
+		yield out.getvalue()
+		out.seek(0)
+		out.truncate()
+	if out.tell():
+		yield out.getvalue()        # no rows: just the header
+
+
+def write_jsonl(chunks):
+	for chunk in chunks:
+		yield ''.join(json.dumps(graduate) + '\n' for graduate in chunk)
+
+
+class ChunkSink(object):
+	"""Write-only file that hands back whatever was written since the last take()"""
+
+	def __init__(self):
+		self.chunks = []
+		self.closed = False
+
+	def write(self, data):
+		self.chunks.append(bytes(data))
+		return len(data)
+
+	def flush(self):
 		pass
 
+	def close(self):
+		self.closed = True
+
+	def take(self):
+		data = b''.join(self.chunks)
+		self.chunks = []
+		return data
+
+
+def write_parquet(chunks):
+	strings = pyarrow.list_(pyarrow.string())
+	schema = pyarrow.schema([
+		('student_id', pyarrow.int32()), ('first_name', pyarrow.string()), ('last_name', pyarrow.string()),
+		('email', pyarrow.string()), ('city', pyarrow.string()), ('state', pyarrow.string()),
+		('graduation_year', pyarrow.int32()), ('degree', pyarrow.string()), ('honors', pyarrow.string()),
+		('industries', strings), ('clubs', strings), ('club_categories', strings), ('industry_tags', strings),
+	])
+	sink = ChunkSink()
+	writer = pyarrow.parquet.ParquetWriter(sink, schema)
+	try:
+		for chunk in chunks:
+			writer.write_table(pyarrow.Table.from_pylist(chunk, schema=schema))
+			yield sink.take()
+	finally:
+		writer.close()          # writes the footer
+	yield sink.take()
+
+
+# format -> (mimetype, writer of text or bytes chunks)
+EXPORT_FORMATS = {
+	'csv': ('text/csv', write_csv),
+	'jsonl': ('application/x-ndjson', write_jsonl),
+	'parquet': ('application/vnd.apache.parquet', write_parquet),
+}
+
+
+def export_format(filename):
+	"""Guess the export format from a file name; csv unless it says jsonl or parquet"""
+	name = (filename or '').lower()
+	if name.endswith(('.parquet', '.pq')):
+		return 'parquet'
+	return import_format(filename)
+
 
 #
 # @app.route is a decorator around index() that means:
@@ -120,6 +2741,7 @@ def teardown_request(exception):
 # see for decorators: http://simeonfranklin.com/blog/2012/jul/1/python-decorators-in-12-steps/
 #
 @app.route('/')
+@conditional('clubs', 'students')
 def index():
 	"""
 	Main page - Graduate Location Map
@@ -133,165 +2755,164 @@ def index():
 	club_filter = request.args.get('club_id', '')
 	year_filter = request.args.get('year', '')
 	
-	# Get all clubs for dropdown (including about text)
-	clubs_query = "SELECT club_id, name, category, about FROM jc6292.club WHERE club_id IS NOT NULL ORDER BY name"
-	cursor = g.conn.execute(text(clubs_query))
-	clubs = []
-	for result in cursor:
-		if result[0] is not None:  # Extra safety check
-			clubs.append({'id': result[0], 'name': result[1], 'category': result[2], 'about': result[3]})
-	cursor.close()
-	
-	# Get all graduation years for dropdown
-	years_query = "SELECT DISTINCT year FROM jc6292.graduated_in ORDER BY year DESC"
-	cursor = g.conn.execute(text(years_query))
-	years = []
-	for result in cursor:
-		years.append(result[0])
-	cursor.close()
+	# Get all clubs (including about text) and graduation years for the dropdowns
+	clubs, years = get_lookups('clubs', 'years')
 	
-	# Build graduate query with filters (including industry_tags array)
-	graduates_query = """
-		SELECT 
-			s.student_id,
-			s.first_name,
-			s.last_name,
-			s.email,
-			l.city,
-			l.state,
-			g.year as graduation_year,
-			g.degree,
-			g.honors,
-			i.name as industry_name,
-			c.name as club_name,
-			c.category as club_category,
-			s.industry_tags
-		FROM jc6292.student s
-		LEFT JOIN jc6292.graduated_in g ON s.student_id = g.student_id
-		LEFT JOIN jc6292.lives_in li ON s.student_id = li.student_id AND li.until_date IS NULL
-		LEFT JOIN jc6292.location l ON li.loc_id = l.loc_id
-		LEFT JOIN jc6292.works_in w ON s.student_id = w.student_id AND w.end_year IS NULL
-		LEFT JOIN jc6292.industry i ON w.industry_id = i.industry_id
-		LEFT JOIN jc6292.member_of m ON s.student_id = m.student_id AND m.leave_date IS NULL
-		LEFT JOIN jc6292.club c ON m.club_id = c.club_id
-		WHERE l.loc_id IS NOT NULL
-	"""
-	
-	# Add filters if provided
-	params = {}
-	if club_filter:
-		# Filter for specific club, ensuring we only get students with that club
-		graduates_query += " AND c.club_id = :club_id AND c.club_id IS NOT NULL"
-		params['club_id'] = club_filter
-	if year_filter:
-		graduates_query += " AND g.year = :year"
-		params['year'] = year_filter
+	# The graduates themselves are loaded page by page from /api/graduates
+	context = dict(clubs=clubs, years=years,
+	               club_filter=club_filter, year_filter=year_filter,
+	               username=session.get('username'))
+	return render_template("index.html", **context)
+
+# Graduates API - one keyset page of the map data
+@app.route('/api/graduates')
+@conditional('students', 'clubs')
+def api_graduates():
+	"""
+	Return up to `limit` graduate rows after the `after` cursor, plus the cursor of the
+	next page (null on the last page). Rows are read from a server-side cursor, so
+	Postgres only produces as much of the result as the page needs. With format=columnar
+	the graduates are sent column by column (see encode_columnar).
+	"""
+	if 'username' not in session:
+		return jsonify(error="login required"), 401
 	
-	graduates_query += " ORDER BY s.last_name, s.first_name"
+	try:
+		club_filter, year_filter, loc_filter = int_arg('club_id'), int_arg('year'), int_arg('loc_id')
+		limit = min(max(int(request.args.get('limit', GRADUATES_PAGE_SIZE)), 1), GRADUATES_MAX_PAGE_SIZE)
+		after = decode_cursor(request.args['after']) if request.args.get('after') else None
+	except ValueError as e:
+		return jsonify(error=str(e)), 400
 	
-	cursor = g.conn.execute(text(graduates_query), params)
+	query, params = graduates_query(club_filter, year_filter, after, loc_filter)
+	cursor = g.conn.execute(text(query), params, execution_options={'yield_per': GRADUATES_FETCH_SIZE})
 	graduates = []
+	more = False
 	for result in cursor:
-		graduates.append({
-			'student_id': result[0],
-			'first_name': result[1],
-			'last_name': result[2],
-			'email': result[3],
-			'city': result[4],
-			'state': result[5],
-			'graduation_year': result[6],
-			'degree': result[7],
-			'honors': result[8],
-			'industry': result[9],
-			'club': result[10],
-			'club_category': result[11],
-			'industry_tags': result[12] if result[12] else []
-		})
+		graduate = graduate_from_row(result)
+		# In joined mode a student spans several rows (one per club/industry); only stop between students
+		if len(graduates) >= limit and graduate['student_id'] != graduates[-1]['student_id']:
+			more = True
+			break
+		graduates.append(graduate)
 	cursor.close()
 	
-	context = dict(clubs=clubs, years=years, graduates=graduates, 
-	               club_filter=club_filter, year_filter=year_filter,
-	               username=session.get('username'))
-	return render_template("index.html", **context)
+	next_cursor = encode_cursor(graduates[-1]) if more else None
+	if request.args.get('format') == 'columnar':
+		graduates = encode_columnar(graduates, GRADUATE_DICTIONARIES)
+	return jsonify(graduates=graduates, next=next_cursor)
+
+
+# Map API - one aggregated marker per location
+@app.route('/api/map/locations')
+@conditional('students', 'clubs', 'lookups')
+def api_map_locations():
+	"""
+	Return one entry per location with its graduate count, marker color, coordinates and
+	the first few names. With bbox=west,south,east,north only the locations inside that
+	viewport are returned. Popup details are fetched per location from
+	/api/graduates?loc_id=...
+	"""
+	if 'username' not in session:
+		return jsonify(error="login required"), 401
+	
+	try:
+		bbox = parse_bbox(request.args['bbox']) if request.args.get('bbox') else None
+		club_filter, year_filter = int_arg('club_id'), int_arg('year')
+	except ValueError as e:
+		return jsonify(error=str(e)), 400
+	
+	query, params = locations_query(club_filter, year_filter, bbox)
+	locations = []
+	if params.get('loc_ids') != []:
+		cursor = g.conn.execute(text(query), params)
+		for result in cursor:
+			locations.append({
+				'loc_id': result[0],
+				'city': result[1],
+				'state': result[2],
+				'count': result[3],
+				'color': marker_color(result[3]),
+				'names': result[4] or [],
+				'latitude': result[5],
+				'longitude': result[6]
+			})
+		cursor.close()
+	
+	if request.args.get('format') == 'columnar':
+		locations = encode_columnar(locations, LOCATION_DICTIONARIES)
+	return jsonify(locations=locations, unplaced=count_unplaced_locations())
+
 
 # Add student page - shows form
 @app.route('/add_student')
 def add_student_page():
 	"""Display form to add a new student"""
-	# Get clubs for dropdown
-	clubs_query = "SELECT club_id, name FROM jc6292.club WHERE club_id IS NOT NULL ORDER BY name"
-	cursor = g.conn.execute(text(clubs_query))
-	clubs = [{'id': result[0], 'name': result[1]} for result in cursor if result[0] is not None]
-	cursor.close()
-	
-	# Get locations for dropdown
-	locations_query = "SELECT loc_id, city, state FROM jc6292.location WHERE loc_id IS NOT NULL ORDER BY city"
-	cursor = g.conn.execute(text(locations_query))
-	locations = [{'id': result[0], 'city': result[1], 'state': result[2]} for result in cursor if result[0] is not None]
-	cursor.close()
-	
-	# Get industries for dropdown
-	industries_query = "SELECT industry_id, name FROM jc6292.industry WHERE industry_id IS NOT NULL ORDER BY name"
-	cursor = g.conn.execute(text(industries_query))
-	industries = [{'id': result[0], 'name': result[1]} for result in cursor if result[0] is not None]
-	cursor.close()
+	# Get clubs, locations and industries for the dropdowns
+	clubs, locations, industries = get_lookups('clubs', 'locations', 'industries')
 	
 	context = dict(clubs=clubs, locations=locations, industries=industries)
 	return render_template("add_student.html", **context)
 
 
-# Add student - handle form submission
+# Add student - the student and every optional relationship are inserted by
+# one statement, so a submission is a single round-trip however many fields
+# are filled. Optional values arrive as NULL and their CTE inserts nothing.
+# The graduated_in foreign key is checked at the end of the statement, after
+# the year_dim insert has run.
+ADD_STUDENT_QUERY = """
+	WITH new_student AS (
+		INSERT INTO jc6292.student (first_name, last_name, email)
+		VALUES (:first_name, :last_name, :email)
+		RETURNING student_id
+	), home AS (
+		INSERT INTO jc6292.lives_in (student_id, loc_id, since_date)
+		SELECT student_id, CAST(:location_id AS INTEGER), CURRENT_DATE FROM new_student
+	), job AS (
+		INSERT INTO jc6292.works_in (student_id, industry_id, start_year)
+		SELECT student_id, CAST(:industry_id AS INTEGER), CAST(EXTRACT(YEAR FROM CURRENT_DATE) AS INTEGER)
+		FROM new_student WHERE CAST(:industry_id AS INTEGER) IS NOT NULL
+	), membership AS (
+		INSERT INTO jc6292.member_of (student_id, club_id, join_date)
+		SELECT student_id, CAST(:club_id AS INTEGER), CURRENT_DATE
+		FROM new_student WHERE CAST(:club_id AS INTEGER) IS NOT NULL
+	), graduation_year AS (
+		INSERT INTO jc6292.year_dim (year)
+		SELECT CAST(:graduation_year AS INTEGER) WHERE CAST(:graduation_year AS INTEGER) IS NOT NULL
+		ON CONFLICT (year) DO NOTHING
+	), graduation AS (
+		INSERT INTO jc6292.graduated_in (student_id, year, degree)
+		SELECT student_id, CAST(:graduation_year AS INTEGER), CAST(:degree AS VARCHAR)
+		FROM new_student WHERE CAST(:graduation_year AS INTEGER) IS NOT NULL AND CAST(:degree AS VARCHAR) IS NOT NULL
+	)
+	SELECT student_id FROM new_student
+"""
+
 @app.route('/add_student', methods=['POST'])
 def add_student():
 	"""Add a new student to the database"""
 	try:
 		# Get form data
-		first_name = request.form['first_name']
-		last_name = request.form['last_name']
-		email = request.form.get('email') or None
-		club_id = request.form.get('club_id') or None
-		location_id = request.form['location_id']
-		industry_id = request.form.get('industry_id') or None
-		graduation_year = request.form.get('graduation_year') or None
-		degree = request.form.get('degree', 'BS')
-		
-		# Insert student
-		params = {'first_name': first_name, 'last_name': last_name, 'email': email}
-		result = g.conn.execute(text(
-			'INSERT INTO jc6292.student (first_name, last_name, email) VALUES (:first_name, :last_name, :email) RETURNING student_id'
-		), params)
-		student_id = result.fetchone()[0]
-		
-		# Add location (required)
-		g.conn.execute(text(
-			'INSERT INTO jc6292.lives_in (student_id, loc_id, since_date) VALUES (:student_id, :loc_id, CURRENT_DATE)'
-		), {'student_id': student_id, 'loc_id': location_id})
-		
-		# Add industry if provided
-		if industry_id:
-			import datetime
-			current_year = datetime.datetime.now().year
-			g.conn.execute(text(
-				'INSERT INTO jc6292.works_in (student_id, industry_id, start_year) VALUES (:student_id, :industry_id, :start_year)'
-			), {'student_id': student_id, 'industry_id': industry_id, 'start_year': current_year})
-		
-		# Add club membership if provided
-		if club_id:
-			g.conn.execute(text(
-				'INSERT INTO jc6292.member_of (student_id, club_id, join_date) VALUES (:student_id, :club_id, CURRENT_DATE)'
-			), {'student_id': student_id, 'club_id': club_id})
-		
-		# Add graduation record if provided
-		if graduation_year and degree:
-			g.conn.execute(text(
-				'INSERT INTO jc6292.year_dim (year) VALUES (:year) ON CONFLICT (year) DO NOTHING'
-			), {'year': graduation_year})
-			g.conn.execute(text(
-				'INSERT INTO jc6292.graduated_in (student_id, year, degree) VALUES (:student_id, :year, :degree)'
-			), {'student_id': student_id, 'year': graduation_year, 'degree': degree})
+		first_name = request.form['first_name']
+		last_name = request.form['last_name']
+		params = {
+			'first_name': first_name,
+			'last_name': last_name,
+			'email': request.form.get('email') or None,
+			'location_id': request.form['location_id'],
+			'industry_id': request.form.get('industry_id') or None,
+			'club_id': request.form.get('club_id') or None,
+			'graduation_year': request.form.get('graduation_year') or None,
+			'degree': request.form.get('degree', 'BS') or None,
+		}
 		
+		student_id = g.conn.execute(text(ADD_STUDENT_QUERY), params).scalar()
 		g.conn.commit()
+		versions = invalidate('students')
+		name_indexes['students'].add(student_id, first_name + ' ' + last_name, versions['students'])
 		return redirect('/')
+	except DatabaseUnavailable:
+		raise
 	except Exception as e:
 		print(f"Error adding student: {e}")
 		import traceback
@@ -307,105 +2928,38 @@ def add_club_page():
 
 # Search clubs by text (full-text search)
 @app.route('/search_clubs')
+@conditional('clubs')
 def search_clubs():
-	"""Search clubs using full-text search on about field"""
+	"""Search clubs using full-text search on about field, one page at a time"""
 	if 'username' not in session:
 		return redirect('/login')
 	
-	search_query = request.args.get('q', '')
-	
-	if search_query:
-		# Full-text search
-		search_sql = """
-			SELECT club_id, name, category, about, 
-			       ts_rank(about_tsv, query) AS rank
-			FROM jc6292.club, 
-			     to_tsquery('english', :search_query) query
-			WHERE about_tsv @@ query
-			ORDER BY rank DESC
-		"""
-		params = {'search_query': ' | '.join(search_query.split())}
-		cursor = g.conn.execute(text(search_sql), params)
-	else:
-		# Show all clubs
-		cursor = g.conn.execute(text("SELECT club_id, name, category, about, 0 as rank FROM jc6292.club ORDER BY name"))
+	search_query = request.args.get('q', '').strip()
+	page = page_arg()
 	
-	clubs = []
-	for result in cursor:
-		clubs.append({
-			'id': result[0],
-			'name': result[1],
-			'category': result[2],
-			'about': result[3],
-			'rank': result[4] if len(result) > 4 else 0
-		})
-	cursor.close()
+	clubs, total = search_club_page(search_query, page)
+	pages = max((total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE, 1)
+	if page > pages:
+		page = pages
+		clubs, total = search_club_page(search_query, page)
 	
-	context = dict(clubs=clubs, search_query=search_query, username=session.get('username'))
+	context = dict(clubs=clubs, search_query=search_query, total=total, page=page, pages=pages,
+	               username=session.get('username'))
 	return render_template("search_clubs.html", **context)
 
 
 # View alumni profile (using composite type)
 @app.route('/alumni/<int:student_id>')
+@conditional('student:{student_id}', 'clubs')
 def view_alumni_profile(student_id):
 	"""View detailed alumni profile with composite location type"""
 	if 'username' not in session:
 		return redirect('/login')
 	
-	# Get student info with industry_tags array
-	student_query = """
-		SELECT s.student_id, s.first_name, s.last_name, s.email, s.industry_tags,
-		       g.year, g.degree, g.honors
-		FROM jc6292.student s
-		LEFT JOIN jc6292.graduated_in g ON s.student_id = g.student_id
-		WHERE s.student_id = :student_id
-	"""
-	cursor = g.conn.execute(text(student_query), {'student_id': student_id})
-	result = cursor.fetchone()
-	cursor.close()
-	
-	if not result:
+	profile = load_profile(student_id)
+	if profile is None:
 		abort(404)
-	
-	student = {
-		'id': result[0],
-		'first_name': result[1],
-		'last_name': result[2],
-		'email': result[3],
-		'industry_tags': result[4] if result[4] else [],
-		'graduation_year': result[5],
-		'degree': result[6],
-		'honors': result[7]
-	}
-	
-	# Get location using composite type from alumni_profile
-	location_query = """
-		SELECT (current_location).city, (current_location).state, (current_location).country,
-		       bio, linkedin_url
-		FROM jc6292.alumni_profile
-		WHERE student_id = :student_id
-	"""
-	cursor = g.conn.execute(text(location_query), {'student_id': student_id})
-	loc_result = cursor.fetchone()
-	cursor.close()
-	
-	if loc_result:
-		student['city'] = loc_result[0]
-		student['state'] = loc_result[1]
-		student['country'] = loc_result[2]
-		student['bio'] = loc_result[3]
-		student['linkedin_url'] = loc_result[4]
-	
-	# Get clubs
-	clubs_query = """
-		SELECT c.name, c.category, c.about
-		FROM jc6292.member_of m
-		JOIN jc6292.club c ON m.club_id = c.club_id
-		WHERE m.student_id = :student_id AND m.leave_date IS NULL
-	"""
-	cursor = g.conn.execute(text(clubs_query), {'student_id': student_id})
-	clubs = [{'name': r[0], 'category': r[1], 'about': r[2]} for r in cursor]
-	cursor.close()
+	student, clubs = profile
 	
 	context = dict(student=student, clubs=clubs, username=session.get('username'))
 	return render_template("alumni_profile.html", **context)
@@ -425,16 +2979,103 @@ def add_club():
 		about = request.form.get('about', '')
 		
 		params = {'name': name, 'category': category, 'about': about if about else None}
-		g.conn.execute(text(
-			'INSERT INTO jc6292.club (name, category, about) VALUES (:name, :category, :about)'
+		result = g.conn.execute(text(
+			'INSERT INTO jc6292.club (name, category, about) VALUES (:name, :category, :about) RETURNING club_id'
 		), params)
+		club_id = result.fetchone()[0]
 		g.conn.commit()
+		versions = invalidate('clubs')
+		name_indexes['clubs'].add(club_id, name, versions['clubs'])
 		return redirect('/')
+	except DatabaseUnavailable:
+		raise
 	except Exception as e:
 		print(f"Error adding club: {e}")
 		return f"Error: {str(e)}", 500
 
 
+# Bulk import - CSV or JSON lines, as a multipart "file" field or the raw request body
+@app.route('/import_students', methods=['POST'])
+def import_students_upload():
+	"""Import many students at once and report rows that were skipped"""
+	if 'username' not in session:
+		return jsonify(error="login required"), 401
+	
+	upload = request.files.get('file')
+	if upload is not None:
+		stream = upload.stream
+		fmt = request.form.get('format') or import_format(upload.filename, upload.content_type)
+	else:
+		stream = io.BufferedReader(request.stream)
+		fmt = request.args.get('format') or import_format(None, request.content_type)
+	if fmt not in ('csv', 'jsonl'):
+		return jsonify(error="format must be csv or jsonl"), 400
+	dry_run = (request.values.get('dry_run') or '').lower() in ('1', 'true', 'on')
+	
+	try:
+		conn = g.conn.checkout()
+		started = time.perf_counter()
+		records = read_import_records(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''), fmt)
+		report = import_students(conn, records)
+		if dry_run:
+			conn.rollback()
+		else:
+			conn.commit()
+			if report['imported']:
+				invalidate('students')
+		report.update(dry_run=dry_run, seconds=round(time.perf_counter() - started, 3))
+		return jsonify(report)
+	except DatabaseUnavailable:
+		raise
+	except Exception as e:
+		g.conn.rollback()
+		print(f"Error importing students: {e}")
+		return jsonify(error=str(e)), 500
+
+
+@app.route('/api/graduates/export')
+@conditional('students', 'clubs')
+def export_graduates_download():
+	"""
+	Download every graduate matching the map filters (club_id, year) as format=csv
+	(default), jsonl or parquet. The body is streamed while the rows are read, which
+	goes on after the request is torn down, so the stream takes over g.conn and closes it
+	when the download ends (or the client goes away).
+	"""
+	if 'username' not in session:
+		return jsonify(error="login required"), 401
+	
+	fmt = request.args.get('format', 'csv')
+	if fmt not in EXPORT_FORMATS:
+		return jsonify(error="format must be one of %s" % ', '.join(EXPORT_FORMATS)), 400
+	if fmt == 'parquet' and pyarrow is None:
+		return jsonify(error="parquet export needs pyarrow: pip install pyarrow"), 400
+	
+	try:
+		club_filter, year_filter = int_arg('club_id'), int_arg('year')
+	except ValueError as e:
+		return jsonify(error=str(e)), 400
+	
+	mimetype, write = EXPORT_FORMATS[fmt]
+	conn = g.pop('conn')
+	try:
+		chunks = export_graduates(conn, club_filter, year_filter)
+	except Exception:
+		conn.close()
+		raise
+	
+	def body():
+		try:
+			yield from write(chunks)
+		finally:
+			chunks.close()      # the cursor before its connection
+			conn.close()
+			with pool_stats_lock:
+				pool_stats['requests_with_db'] += 1
+	headers = {'Content-Disposition': 'attachment; filename="graduates.%s"' % fmt}
+	return Response(body(), mimetype=mimetype, headers=headers)
+
+
 #
 # Original example routes (kept for reference)
 #
@@ -443,6 +3084,123 @@ def another():
 	return render_template("another.html")
 
 
+#
+# Password hashing runs in a small process pool so a burst of logins cannot
+# tie up the request threads (or the GIL) for the length of a KDF each.
+# PASSWORD_HASH_METHOD is any werkzeug method string, e.g. scrypt:32768:8:1
+# or pbkdf2:sha256:600000; existing hashes keep the cost they were made with.
+# At most KDF_MAX_PENDING hashes wait or run at once; beyond that logins are
+# turned away rather than queued without bound.
+#
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+KDF_WORKERS = int(os.environ.get('KDF_WORKERS', str(min(4, os.cpu_count() or 1))))
+KDF_MAX_PENDING = int(os.environ.get('KDF_MAX_PENDING', str(KDF_WORKERS * 8)))
+KDF_TIMEOUT = float(os.environ.get('KDF_TIMEOUT', '10'))
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', '60'))
+AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', '1024'))
+
+kdf_lock = threading.Lock()
+kdf_state = {'executor': None, 'pid': None}
+kdf_stats = {'pending': 0, 'max_pending_seen': 0, 'hashes': 0, 'verifies': 0, 'rejected': 0}
+kdf_samples = {'kdf_ms': deque(maxlen=1000)}
+
+# Users found by username; only existing users are cached, and there is no
+# password change path, so entries never go stale before their TTL
+auth_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
+class KdfBusy(Exception):
+	"""Raised when KDF_MAX_PENDING password hashes are already queued"""
+
+
+def configure_kdf_pool(workers):
+	"""Replace the KDF pool with one of `workers` processes (0 hashes inline)"""
+	global KDF_WORKERS
+	with kdf_lock:
+		executor = kdf_state['executor']
+		kdf_state['executor'] = kdf_state['pid'] = None
+		KDF_WORKERS = workers
+	if executor is not None:
+		executor.shutdown(wait=True)
+
+
+def kdf_executor():
+	"""The process pool for this process, created on first use (and again after a fork)"""
+	with kdf_lock:
+		if kdf_state['pid'] != os.getpid():
+			from concurrent.futures import ProcessPoolExecutor
+			# Not plain fork: forking a threaded server copies locks other threads may hold
+			# (logging, the SQLAlchemy pool, Redis) into the children, which can deadlock them
+			context = multiprocessing.get_context('forkserver')
+			kdf_state['executor'] = ProcessPoolExecutor(max_workers=KDF_WORKERS, mp_context=context) if KDF_WORKERS > 0 else None
+			kdf_state['pid'] = os.getpid()
+		return kdf_state['executor']
+
+
+def run_kdf(kind, function, *args):
+	with kdf_lock:
+		if kdf_stats['pending'] >= KDF_MAX_PENDING:
+			kdf_stats['rejected'] += 1
+			raise KdfBusy()
+		kdf_stats['pending'] += 1
+		kdf_stats['max_pending_seen'] = max(kdf_stats['max_pending_seen'], kdf_stats['pending'])
+	started = time.perf_counter()
+	try:
+		executor = kdf_executor()
+		if executor is None:
+			return function(*args)
+		return executor.submit(function, *args).result(timeout=KDF_TIMEOUT)
+	finally:
+		kdf_samples['kdf_ms'].append((time.perf_counter() - started) * 1000)
+		with kdf_lock:
+			kdf_stats['pending'] -= 1
+			kdf_stats[kind] += 1
+
+
+def hash_password(password):
+	return run_kdf('hashes', generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+	return run_kdf('verifies', check_password_hash, password_hash, password)
+
+
+def find_user(conn, username):
+	"""(user_id, username, email, password_hash) for username, or None"""
+	user = auth_cache.get(username)
+	if user is None:
+		cursor = conn.execute(text(
+			"SELECT user_id, username, email, password_hash FROM jc6292.app_user WHERE username = :username"
+		), {'username': username})
+		user = cursor.fetchone()
+		cursor.close()
+		if user is not None:
+			user = tuple(user)
+			auth_cache.set(username, user)
+	return user
+
+
+# Signup in one statement: insert unless the username or email is taken, and
+# report which one was. The ON CONFLICT covers a concurrent signup for the
+# same username that the NOT EXISTS check cannot see yet.
+SIGNUP_QUERY = """
+	WITH existing AS (
+		SELECT bool_or(username = :username) AS username_taken,
+		       bool_or(email = :email) AS email_taken
+		FROM jc6292.app_user
+		WHERE username = :username OR email = :email
+	), inserted AS (
+		INSERT INTO jc6292.app_user (username, email, password_hash)
+		SELECT :username, :email, :password_hash
+		FROM existing WHERE existing.username_taken IS NULL
+		ON CONFLICT (username) DO NOTHING
+		RETURNING user_id
+	)
+	SELECT (SELECT user_id FROM inserted), existing.username_taken, existing.email_taken
+	FROM existing
+"""
+
+
 # Login page - show login form
 @app.route('/login', methods=['GET'])
 def login():
@@ -462,72 +3220,31 @@ def login_post():
 	if not username or not password:
 		return render_template("login.html", error="Please enter username and password")
 	
-	# Try to get or create a database connection with retry
-	conn = g.conn
-	should_close = False
+	# Registration: Validate inputs before touching the database
+	if action == 'signup' and not email:
+		return render_template("login.html", error="Email is required for registration.")
 	
-	if conn is None:
-		# Try to connect up to 3 times with delay
-		import time
-		for attempt in range(3):
-			try:
-				conn = engine.connect()
-				should_close = True
-				break
-			except Exception as e:
-				if attempt < 2:  # Not the last attempt
-					print(f"Connection attempt {attempt + 1} failed, retrying...")
-					time.sleep(1)  # Wait 1 second before retry
-				else:
-					print(f"Failed to create connection after 3 attempts: {e}")
-					return render_template("login.html", error="Database is temporarily unavailable. Please try again in a moment.")
+	# Fails fast with DatabaseUnavailable while the database circuit is open
+	# (teardown_request closes the connection again)
+	conn = g.conn
 	
 	try:
 		if action == 'signup':
-			# Registration: Validate inputs
-			if not email:
-				if should_close:
-					conn.close()
-				return render_template("login.html", error="Email is required for registration.")
-			
-			# Check if username already exists
-			check_user_query = "SELECT user_id FROM jc6292.app_user WHERE username = :username"
-			cursor = conn.execute(text(check_user_query), {'username': username})
-			existing_user = cursor.fetchone()
-			cursor.close()
-			
-			if existing_user:
-				if should_close:
-					conn.close()
-				return render_template("login.html", error="Username already exists. Please choose another one.")
-			
-			# Check if email already exists
-			check_email_query = "SELECT user_id FROM jc6292.app_user WHERE email = :email"
-			cursor = conn.execute(text(check_email_query), {'email': email})
-			existing_email = cursor.fetchone()
-			cursor.close()
-			
-			if existing_email:
-				if should_close:
-					conn.close()
-				return render_template("login.html", error="Email already registered. Please use a different email.")
-			
-			# Hash password and insert new user
-			password_hash = generate_password_hash(password)
-			insert_user_query = """
-				INSERT INTO jc6292.app_user (username, email, password_hash)
-				VALUES (:username, :email, :password_hash)
-			"""
-			conn.execute(text(insert_user_query), {
+			# Hash the password, then insert unless the username or email is taken
+			cursor = conn.execute(text(SIGNUP_QUERY), {
 				'username': username,
 				'email': email,
-				'password_hash': password_hash
+				'password_hash': hash_password(password)
 			})
-			conn.commit()
+			user_id, username_taken, email_taken = cursor.fetchone()
+			cursor.close()
 			
-			# Close connection if we created it
-			if should_close:
-				conn.close()
+			if user_id is None:
+				conn.rollback()
+				if email_taken and not username_taken:
+					return render_template("login.html", error="Email already registered. Please use a different email.")
+				return render_template("login.html", error="Username already exists. Please choose another one.")
+			conn.commit()
 			
 			# Auto-login after registration
 			session['username'] = username
@@ -537,39 +3254,29 @@ def login_post():
 		
 		else:  # signin
 			# Login: Verify username and password
-			user_query = "SELECT user_id, username, email, password_hash FROM jc6292.app_user WHERE username = :username"
-			cursor = conn.execute(text(user_query), {'username': username})
-			user = cursor.fetchone()
-			cursor.close()
+			user = find_user(conn, username)
 			
 			if not user:
-				if should_close:
-					conn.close()
 				return render_template("login.html", error="Invalid username or password.")
 			
 			# Verify password
-			if check_password_hash(user[3], password):  # user[3] is password_hash
-				if should_close:
-					conn.close()
-				
+			if verify_password(user[3], password):  # user[3] is password_hash
 				session['username'] = user[1]  # user[1] is username
 				if user[2]:  # user[2] is email
 					session['email'] = user[2]
 				return redirect('/')
 			else:
-				if should_close:
-					conn.close()
 				return render_template("login.html", error="Invalid username or password.")
 	
+	except KdfBusy:
+		return render_template("login.html", error="Too many logins at once. Please try again in a moment."), 503
+	except DatabaseUnavailable as e:
+		return render_template("login.html", error="Database is temporarily unavailable. Please try again in a moment."), \
+			503, {'Retry-After': str(e.retry_after)}
 	except Exception as e:
 		print(f"Error in login/register: {e}")
 		import traceback
 		traceback.print_exc()
-		if should_close and conn:
-			try:
-				conn.close()
-			except:
-				pass
 		return render_template("login.html", error="An error occurred. Please try again.")
 
 
@@ -586,53 +3293,100 @@ def delete_student(student_id):
 			'DELETE FROM jc6292.student WHERE student_id = :student_id'
 		), {'student_id': student_id})
 		g.conn.commit()
+		versions = invalidate('students', 'student:%d' % student_id)
+		name_indexes['students'].remove(student_id, versions['students'])
 		return redirect('/')
+	except DatabaseUnavailable:
+		raise
 	except Exception as e:
 		print(f"Error deleting student: {e}")
 		return f"Error: {str(e)}", 500
 
 
 # Manage students page
+MANAGE_PAGE_SIZE = 50
+
+MANAGE_STUDENTS_QUERY = """
+	SELECT 
+		s.student_id,
+		s.first_name,
+		s.last_name,
+		s.email,
+		g.year as graduation_year,
+		g.degree,
+		(ap.current_location).city as city,
+		(ap.current_location).state as state
+	FROM jc6292.student s
+	LEFT JOIN jc6292.graduated_in g ON s.student_id = g.student_id
+	LEFT JOIN jc6292.alumni_profile ap ON s.student_id = ap.student_id
+	ORDER BY s.last_name, s.first_name, s.student_id
+	LIMIT :limit OFFSET :offset
+"""
+
+MANAGE_STUDENTS_COUNT_QUERY = """
+	SELECT COUNT(*)
+	FROM jc6292.student s
+	LEFT JOIN jc6292.graduated_in g ON s.student_id = g.student_id
+"""
+
 @app.route('/manage_students')
 def manage_students():
-	"""Display all students for management"""
+	"""Display one page of students for management; the search box uses /api/autocomplete"""
 	if 'username' not in session:
 		return redirect('/login')
 	
-	students_query = """
-		SELECT 
-			s.student_id,
-			s.first_name,
-			s.last_name,
-			s.email,
-			g.year as graduation_year,
-			g.degree,
-			(ap.current_location).city as city,
-			(ap.current_location).state as state
-		FROM jc6292.student s
-		LEFT JOIN jc6292.graduated_in g ON s.student_id = g.student_id
-		LEFT JOIN jc6292.alumni_profile ap ON s.student_id = ap.student_id
-		ORDER BY s.last_name, s.first_name
-	"""
-	cursor = g.conn.execute(text(students_query))
-	students = []
-	for result in cursor:
-		students.append({
-			'student_id': result[0],
-			'first_name': result[1],
-			'last_name': result[2],
-			'email': result[3],
-			'graduation_year': result[4],
-			'degree': result[5],
-			'city': result[6],
-			'state': result[7]
-		})
-	cursor.close()
+	page = page_arg()
+	
+	def load_page(conn):
+		cursor = conn.execute(text(MANAGE_STUDENTS_QUERY), {'limit': MANAGE_PAGE_SIZE,
+		                                                    'offset': (page - 1) * MANAGE_PAGE_SIZE})
+		students = []
+		for result in cursor:
+			students.append({
+				'student_id': result[0],
+				'first_name': result[1],
+				'last_name': result[2],
+				'email': result[3],
+				'graduation_year': result[4],
+				'degree': result[5],
+				'city': result[6],
+				'state': result[7]
+			})
+		cursor.close()
+		return students
 	
-	context = dict(students=students, username=session.get('username'))
+	# The page and the total are independent, so they run side by side
+	students, total = run_reads(load_page, lambda conn: conn.execute(text(MANAGE_STUDENTS_COUNT_QUERY)).scalar())
+	
+	pages = max((total + MANAGE_PAGE_SIZE - 1) // MANAGE_PAGE_SIZE, 1)
+	if page > pages:
+		page = pages
+		students = load_page(g.conn)
+	context = dict(students=students, total=total, page=page, pages=pages, username=session.get('username'))
 	return render_template("manage_students.html", **context)
 
 
+# Autocomplete API for student and club names
+@app.route('/api/autocomplete')
+def api_autocomplete():
+	"""Return the top matches for ?q= among ?kind=students (default) or clubs"""
+	if 'username' not in session:
+		return jsonify(error="login required"), 401
+	
+	kind = request.args.get('kind', 'students')
+	q = request.args.get('q', '').strip()
+	if kind not in NAME_INDEX_QUERIES:
+		return jsonify(error="kind must be students or clubs"), 400
+	try:
+		limit = min(max(int(request.args.get('limit', AUTOCOMPLETE_LIMIT)), 1), 50)
+	except ValueError:
+		return jsonify(error="invalid limit"), 400
+	if not q:
+		return jsonify(results=[])
+	
+	return jsonify(results=autocomplete(kind, q, limit))
+
+
 # Delete club
 @app.route('/delete_club/<int:club_id>', methods=['POST'])
 def delete_club(club_id):
@@ -658,12 +3412,370 @@ def delete_club(club_id):
 			'DELETE FROM jc6292.club WHERE club_id = :club_id'
 		), {'club_id': club_id})
 		g.conn.commit()
+		versions = invalidate('clubs')
+		name_indexes['clubs'].remove(club_id, versions['clubs'])
 		return redirect('/search_clubs')
+	except DatabaseUnavailable:
+		raise
 	except Exception as e:
 		print(f"Error deleting club: {e}")
 		return f"Error: {str(e)}", 500
 
 
+#
+# Analytics dashboard, read from the rollup tables plus their pending deltas (see
+# ANALYTICS_ROLLUPS). With live=True the same queries run over the aggregates computed from
+# the base tables instead, which is what the page would cost without the rollups.
+#
+ANALYTICS_TOP = int(os.environ.get('ANALYTICS_TOP', 20))       # migration flows and tags listed
+ANALYTICS_MAX_TOP = 1000
+ANALYTICS_COMPACT_INTERVAL = float(os.environ.get('ANALYTICS_COMPACT_INTERVAL', 10))  # seconds, 0 = off
+
+analytics_state = {'pid': None, 'compactions': 0, 'folded_rows': 0, 'error': None}
+
+ANALYTICS_QUERIES = {
+	'industries': ('analytics_industry_year', """
+		SELECT r.industry_id, i.name, r.year, r.alumni
+		FROM {source}
+		JOIN jc6292.industry i ON i.industry_id = r.industry_id
+		WHERE r.alumni > 0
+		ORDER BY i.name, r.industry_id, r.year
+	"""),
+	'clubs': ('analytics_club_retention', """
+		SELECT r.club_id, c.name, r.join_year, r.members, r.active, r.left_first_year, r.tenure_days
+		FROM {source}
+		JOIN jc6292.club c ON c.club_id = r.club_id
+		WHERE r.members > 0
+		ORDER BY c.name, r.club_id, r.join_year
+	"""),
+	'migration': ('analytics_migration_flows', """
+		SELECT r.from_loc_id, f.city, f.state, r.to_loc_id, t.city, t.state, r.moves
+		FROM (SELECT r.* FROM {source} WHERE r.moves > 0
+		      ORDER BY r.moves DESC, r.from_loc_id, r.to_loc_id LIMIT :limit) r
+		JOIN jc6292.location f ON f.loc_id = r.from_loc_id
+		JOIN jc6292.location t ON t.loc_id = r.to_loc_id
+		ORDER BY r.moves DESC, r.from_loc_id, r.to_loc_id
+	"""),
+	'tags': ('analytics_industry_tags', """
+		SELECT r.tag, r.alumni
+		FROM {source}
+		WHERE r.alumni > 0
+		ORDER BY r.alumni DESC, r.tag
+		LIMIT :limit
+	"""),
+}
+
+
+def analytics_query(section, live=False):
+	table, query = ANALYTICS_QUERIES[section]
+	keys, counts, aggregate = ANALYTICS_ROLLUPS[table]
+	if live:
+		source = '(%s) r (%s, %s)' % (aggregate, keys, counts)
+	else:
+		source = """(SELECT {keys}, {sums}
+		             FROM (SELECT {keys}, {counts} FROM jc6292.{table}
+		                   UNION ALL SELECT {keys}, {counts} FROM jc6292.{table}_delta) rows
+		             GROUP BY {keys}) r""".format(keys=keys, counts=counts, table=table, sums=rollup_sums(counts))
+	return query.format(source=source)
+
+
+def shape_industries(rows):
+	"""Alumni per industry as rows of counts aligned with the graduation years"""
+	years = sorted({row[2] for row in rows})
+	column = {year: i for i, year in enumerate(years)}
+	industries = {}
+	for industry_id, name, year, alumni in rows:
+		industry = industries.setdefault(industry_id, {
+			'industry_id': industry_id, 'industry': name, 'counts': [0] * len(years), 'total': 0})
+		industry['counts'][column[year]] = alumni
+		industry['total'] += alumni
+	return {'years': years, 'rows': list(industries.values())}
+
+
+def shape_clubs(rows):
+	"""Retention per club, largest first, with its join-year cohorts"""
+	clubs = {}
+	for club_id, name, join_year, members, active, left_first_year, tenure_days in rows:
+		club = clubs.setdefault(club_id, {'club_id': club_id, 'club': name, 'members': 0, 'active': 0,
+		                                  'left_first_year': 0, 'tenure_days': 0, 'cohorts': []})
+		club['members'] += members
+		club['active'] += active
+		club['left_first_year'] += left_first_year
+		club['tenure_days'] += tenure_days
+		club['cohorts'].append({'join_year': join_year, 'members': members, 'active': active})
+	for club in clubs.values():
+		left = club['members'] - club['active']
+		club['retention'] = round(club['active'] / club['members'], 3)
+		club['first_year_retention'] = round(1 - club.pop('left_first_year') / club['members'], 3)
+		club['avg_tenure_days'] = round(club.pop('tenure_days') / left, 1) if left else None
+	return sorted(clubs.values(), key=lambda club: (-club['members'], club['club']))
+
+
+ANALYTICS_SHAPES = {
+	'industries': shape_industries,
+	'clubs': shape_clubs,
+	'migration': lambda rows: [{'from': {'loc_id': row[0], 'city': row[1], 'state': row[2]},
+	                            'to': {'loc_id': row[3], 'city': row[4], 'state': row[5]},
+	                            'moves': row[6]} for row in rows],
+	'tags': lambda rows: [{'tag': row[0], 'alumni': row[1]} for row in rows],
+}
+
+
+def analytics_section(conn, section, limit=ANALYTICS_TOP, live=False):
+	rows = conn.execute(text(analytics_query(section, live)), {'limit': limit}).fetchall()
+	return ANALYTICS_SHAPES[section](rows)
+
+
+def load_analytics(conn, limit=ANALYTICS_TOP, sections=None, live=False):
+	"""{section: data} for the dashboard sections (all of them by default), one after another on conn"""
+	return {section: analytics_section(conn, section, limit, live) for section in sections or ANALYTICS_QUERIES}
+
+
+def read_analytics(limit=ANALYTICS_TOP, sections=None):
+	"""load_analytics for a request: with a pool the sections are queried at the same time"""
+	sections = sections or list(ANALYTICS_QUERIES)
+	return dict(zip(sections, run_reads(*[lambda conn, section=section: analytics_section(conn, section, limit)
+	                                      for section in sections])))
+
+
+def check_analytics(conn):
+	"""Sections whose rollup rows differ from the same query over the base tables"""
+	drifted = []
+	for section in ANALYTICS_QUERIES:
+		rollup, live = [conn.execute(text(analytics_query(section, live)), {'limit': None}).fetchall()
+		                for live in (False, True)]
+		if rollup != live:
+			drifted.append(section)
+	return drifted
+
+
+def compact_analytics_forever():
+	while True:
+		time.sleep(ANALYTICS_COMPACT_INTERVAL)
+		if startup['pending_migrations']:
+			continue                # the rollup tables may not exist yet
+		try:
+			with engine.begin() as conn:
+				folded = compact_analytics(conn)
+		except Exception as e:
+			if analytics_state['error'] != str(e):
+				log_event(logging.WARNING, 'analytics_compaction_failed', error=str(e))
+			analytics_state['error'] = str(e)
+			continue
+		analytics_state['error'] = None
+		if folded is not None:
+			analytics_state['compactions'] += 1
+			analytics_state['folded_rows'] += folded
+
+
+def start_analytics_compaction():
+	"""Start this process's compaction thread (processes take turns on the compaction lock)"""
+	if ANALYTICS_COMPACT_INTERVAL <= 0 or analytics_state['pid'] == os.getpid():
+		return
+	analytics_state['pid'] = os.getpid()
+	threading.Thread(target=compact_analytics_forever, name='analytics-compaction', daemon=True).start()
+
+
+@app.route('/analytics')
+@conditional('students', 'clubs', 'lookups')
+def analytics():
+	"""Dashboard of alumni per industry and year, club retention, migration flows and tags"""
+	if 'username' not in session:
+		return redirect('/login')
+	return render_template("analytics.html", username=session.get('username'), top=ANALYTICS_TOP,
+	                       **read_analytics())
+
+
+@app.route('/api/analytics')
+@conditional('students', 'clubs', 'lookups')
+def api_analytics():
+	"""
+	The dashboard data as JSON. sections=industries,clubs,migration,tags picks some of them;
+	limit caps the migration flows and tags (ANALYTICS_TOP by default).
+	"""
+	if 'username' not in session:
+		return jsonify(error="login required"), 401
+	
+	sections = [section for section in request.args.get('sections', '').split(',') if section]
+	unknown = [section for section in sections if section not in ANALYTICS_QUERIES]
+	if unknown:
+		return jsonify(error="unknown section: %s" % ', '.join(unknown)), 400
+	try:
+		limit = min(max(int(request.args.get('limit', ANALYTICS_TOP)), 1), ANALYTICS_MAX_TOP)
+	except ValueError as e:
+		return jsonify(error=str(e)), 400
+	return jsonify(read_analytics(limit, sections))
+
+
+#
+# Startup. Importing this module does no database I/O; each process warms up in a
+# background thread instead. The thread applies pending migrations (only under `run`, whose
+# processes take turns on the migration lock), picks the spatial and name search backends,
+# compiles the templates, loads the dropdown lookups and checks the replicas. With a
+# connection pool it also opens the pooled connections and prepares the profile statement
+# on each. Last it starts the analytics compaction thread. /ready answers 503 until all of
+# that is done, so a load balancer only routes to warm processes. Requests that arrive
+# earlier are still served, using the grid and prefix search fallbacks.
+#
+WARM_UP_RETRY = float(os.environ.get('WARM_UP_RETRY', 5))     # seconds before /ready retries a failed warm-up
+
+startup = {'state': 'cold', 'pid': None, 'migrate': False, 'started_at': None, 'stage': None,
+           'ready_ms': None, 'steps': {}, 'pending_migrations': None, 'error': None}
+startup_lock = threading.Lock()
+
+
+def check_schema():
+	if startup['migrate']:
+		migrate(echo=lambda line: log_event(logging.INFO, 'migration', detail=line))
+	with engine.connect() as conn:
+		startup['pending_migrations'] = pending_migrations(conn)
+		detect_backends(conn)
+	if startup['pending_migrations']:
+		raise RuntimeError("pending migrations %s: run `python server.py migrate`" % startup['pending_migrations'])
+
+
+def compile_templates():
+	for name in app.jinja_env.list_templates():
+		app.jinja_env.get_template(name)
+
+
+def prime_lookups():
+	with engine.connect() as conn:
+		for name, (family, _, _) in LOOKUP_QUERIES.items():
+			lookup_cache.set((name, data_versions.get(family)), load_lookup(conn, name))
+
+
+def prime_connections():
+	"""Open the pooled connections at once and prepare the profile statement on each"""
+	if DB_POOL_MODE != 'queue':
+		return
+	connections = [engine.connect() for _ in range(DB_POOL_SIZE)]
+	for replica in replicas:
+		# a replica that is down must not keep the process from being ready
+		connections += filter(None, [connect_replica(replica.engine) for _ in range(DB_POOL_SIZE)])
+	try:
+		for conn in connections:
+			execute_prepared(conn, 'alumni_profile_q', PROFILE_QUERY, {'student_id': 0}).close()
+	finally:
+		for conn in connections:
+			conn.close()
+
+
+WARM_UP_STEPS = [('schema', check_schema), ('templates', compile_templates), ('lookups', prime_lookups),
+                 ('replicas', start_replica_checks), ('connections', prime_connections),
+                 ('analytics', start_analytics_compaction)]
+
+
+def warm_up():
+	started = time.perf_counter()
+	for name, step in WARM_UP_STEPS:
+		step_started = time.perf_counter()
+		startup['stage'] = name
+		try:
+			step()
+		except Exception as e:
+			with startup_lock:
+				startup.update(state='failed', error='%s: %s' % (name, e))
+			log_event(logging.WARNING, 'warm_up_failed', step=name, error=str(e))
+			return
+		startup['steps'][name] = round((time.perf_counter() - step_started) * 1000, 1)
+	with startup_lock:
+		startup.update(state='ready', stage=None, ready_ms=round((time.perf_counter() - started) * 1000, 1))
+	log_event(logging.INFO, 'ready', ms=startup['ready_ms'], steps=startup['steps'])
+
+
+def start_warm_up(migrate_schema=None):
+	"""Start this process's warm-up unless it is already running or done"""
+	with startup_lock:
+		if startup['pid'] == os.getpid() and startup['state'] in ('warming', 'ready'):
+			return
+		if migrate_schema is not None:
+			startup['migrate'] = migrate_schema
+		startup.update(state='warming', pid=os.getpid(), started_at=time.time(), steps={}, error=None)
+	threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
+def startup_status():
+	with startup_lock:
+		status = {key: startup[key] for key in ('state', 'stage', 'ready_ms', 'steps', 'pending_migrations', 'error')}
+	status['ready'] = status['state'] == 'ready'
+	status['spatial_backend'], status['name_search_backend'] = spatial_backend, name_search_backend
+	return status
+
+
+@app.before_request
+def ensure_warm_up():
+	# Processes that did not come through `run` (a WSGI server importing the app, tests)
+	# start warming up on their first request
+	if startup['state'] == 'cold' or startup['pid'] != os.getpid():
+		start_warm_up()
+
+
+@app.route('/ready')
+def ready():
+	"""200 once this process has warmed up, 503 with the current stage (or error) until then"""
+	if startup['state'] == 'failed' and time.time() - startup['started_at'] >= WARM_UP_RETRY:
+		start_warm_up()
+	status = startup_status()
+	return jsonify(status), 200 if status['ready'] else 503
+
+
+# Connection pool and cache statistics
+@app.route('/stats')
+def stats():
+	"""Report pool and cache metrics as JSON"""
+	pool = {'mode': DB_POOL_MODE, 'status': engine.pool.status()}
+	with pool_stats_lock:
+		pool.update(pool_stats)
+	for name, samples in pool_samples.items():
+		pool[name] = summarize(samples)
+	lookups = lookup_cache.stats()
+	lookups['backend'] = data_versions.backend()
+	with kdf_lock:
+		kdf = dict(kdf_stats, workers=KDF_WORKERS, max_pending=KDF_MAX_PENDING, method=PASSWORD_HASH_METHOD)
+	for name, samples in kdf_samples.items():
+		kdf[name] = summarize(samples)
+	pool['breaker'] = db_breaker.status()
+	with replica_stats_lock:
+		pool['routing'] = dict(replica_stats)
+	pool['replicas'] = [replica.status() for replica in replicas]
+	with http_cache_stats_lock:
+		http = dict(http_cache_stats)
+	http['page_cache'] = page_cache.stats() if PAGE_CACHE_SIZE > 0 else None
+	with query_stats_lock:
+		statements = sorted(statement_stats.items(), key=lambda item: -item[1]['seconds'])[:10]
+	queries = {
+		'slowest_total': [dict(stats, statement=fingerprint[:300]) for fingerprint, stats in statements],
+		'explain_samples': list(explain_samples),
+	}
+	return jsonify(pool=pool, lookup_cache=lookups, profile_cache=profile_cache.stats(),
+	               search_cache=search_cache.stats(), auth_cache=auth_cache.stats(), kdf=kdf,
+	               http_cache=http, queries=queries, startup=startup_status(),
+	               analytics=dict(analytics_state, compact_interval=ANALYTICS_COMPACT_INTERVAL))
+
+
+@app.route('/health')
+def health():
+	"""503 unless the database answered just now; the circuit state is reported alongside"""
+	error = None
+	try:
+		# Fails fast while the circuit is open; once the backoff is up this is the probe
+		g.conn.execute(text("SELECT 1"))
+	except Exception as e:
+		error = str(e).split('\n')[0]
+	healthy = error is None
+	database = dict(db_breaker.status(), error=error)
+	# Replicas only lose their reads when they are down, so they do not fail the check
+	return jsonify(status='ok' if healthy else 'unavailable', database=database,
+	               replicas=[replica.status() for replica in replicas]), 200 if healthy else 503
+
+
+@app.route('/metrics')
+def metrics():
+	"""Prometheus scrape endpoint (per process)"""
+	return Response(prometheus_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # Logout
 @app.route('/logout')
 def logout():
@@ -672,29 +3784,229 @@ def logout():
 	return redirect('/login')
 
 
+#
+# Production serving: a pre-fork gunicorn server (pip install gunicorn) instead of the
+# single-process development server. The master never loads the app: each worker imports
+# this module afresh, so `kill -HUP <master pid>` replaces the workers gracefully with ones
+# running the code now on disk. Each worker also drops the pools it inherited.
+#
+def post_fork(server, worker):
+	"""Drop the primary and replica pools inherited from the master instead of sharing their sockets"""
+	for inherited in all_engines:
+		inherited.dispose(close=False)
+
+
+def serve_production(host, port, workers, threads=1, worker_class='sync', keep_alive=2):
+	"""Serve the app with `workers` gunicorn processes of `threads` threads each"""
+	try:
+		from gunicorn.app.base import BaseApplication
+	except ImportError:
+		raise RuntimeError("--workers needs gunicorn: pip install gunicorn")
+
+	if worker_class == 'sync' and threads > 1:
+		worker_class = 'gthread'
+	options = {
+		'bind': '%s:%d' % (host, port),
+		'workers': workers,
+		'threads': threads,
+		'worker_class': worker_class,
+		'keepalive': keep_alive,
+		'post_fork': post_fork,
+		'when_ready': lambda arbiter: print("gunicorn master %d ready (HUP to reload)" % arbiter.pid),
+	}
+
+	class Application(BaseApplication):
+		def load_config(self):
+			for key, value in options.items():
+				self.cfg.set(key, value)
+
+		def load(self):
+			# Runs in the worker; the master runs this file as __main__, so it is imported anew
+			import server as worker_module
+			worker_module.start_warm_up(migrate_schema=startup['migrate'])
+			return worker_module.app
+
+	Application().run()
+
+
 if __name__ == "__main__":
 	import click
 
-	@click.command()
+	class RunByDefault(click.Group):
+		"""Arguments that do not start with a command go to `run`, as in the original single-command CLI"""
+
+		def parse_args(self, ctx, args):
+			if not args or (args[0] not in self.commands and args[0] not in self.get_help_option_names(ctx)):
+				args = ['run'] + args
+			return super().parse_args(ctx, args)
+
+	@click.group(cls=RunByDefault)
+	def cli():
+		"""
+		Command line entry point. Without a command the web server starts, taking the
+		options of `run`:
+
+			python server.py
+
+			python server.py --threaded 0.0.0.0 8111
+
+		Show the help text using:
+
+			python server.py --help
+
+		"""
+
+	@cli.command()
 	@click.option('--debug', is_flag=True)
 	@click.option('--threaded', is_flag=True)
+	@click.option('--workers', type=int, default=0, help="Pre-fork gunicorn worker processes (0 = development server)")
+	@click.option('--threads', type=int, default=1, help="Threads per worker")
+	@click.option('--worker-class', default='sync', help="gunicorn worker class (sync, gthread, gevent, ...)")
+	@click.option('--keep-alive', type=int, default=2, help="Seconds to hold idle keep-alive connections")
+	@click.option('--no-migrate', is_flag=True, help="Do not apply pending migrations while warming up")
 	@click.argument('HOST', default='0.0.0.0')
 	@click.argument('PORT', default=8111, type=int)
-	def run(debug, threaded, host, port):
+	def run(debug, threaded, workers, threads, worker_class, keep_alive, no_migrate, host, port):
 		"""
-		This function handles command line parameters.
-		Run the server using:
+		Run the web server:
 
-			python server.py
+			python server.py run --threaded 0.0.0.0 8111
 
-		Show the help text using:
+		or, for production, with gunicorn worker processes:
 
-			python server.py --help
+			python server.py run --workers 4 --threads 4 0.0.0.0 8111
 
 		"""
 
 		HOST, PORT = host, port
+		# Workers inherit this and pass it to their own warm-up when they load the app
+		startup['migrate'] = not no_migrate
+		if workers > 0:
+			try:
+				serve_production(HOST, PORT, workers, threads, worker_class, keep_alive)
+			except RuntimeError as e:
+				raise click.ClickException(str(e))
+			return
 		print("running on %s:%d" % (HOST, PORT))
+		if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+			start_warm_up()         # in the serving process, not the reloader's parent
 		app.run(host=HOST, port=PORT, debug=debug, threaded=threaded)
 
-run()
+	@cli.command('migrate')
+	@click.option('--target', type=int, help="Stop after this migration version")
+	@click.option('--status', is_flag=True, help="List the migrations and whether they are applied")
+	@click.option('--explain', is_flag=True,
+	              help="Compare EXPLAIN ANALYZE of the route queries without and with the migration indexes")
+	def migrate_command(target, status, explain):
+		"""
+		Apply the pending schema migrations:
+
+			python server.py migrate
+			python server.py migrate --status
+
+		--explain also plans and times every route query before and after, with the
+		indexes briefly dropped inside a rolled-back transaction (use a local copy).
+
+		"""
+		if status:
+			with engine.begin() as conn:
+				applied = applied_migrations(conn)
+			for version, name, _ in MIGRATIONS:
+				click.echo("%03d %-28s %s" % (version, name, applied[version][1] if version in applied else 'pending'))
+			return
+		if explain:
+			migration_plan_report(echo=click.echo)
+		elif not migrate(target, echo=click.echo):
+			click.echo("schema is up to date")
+
+	@cli.command('analytics')
+	@click.option('--check', is_flag=True, help="Compare the rollups with the base tables (exit 1 if they differ)")
+	@click.option('--rebuild', is_flag=True, help="Recompute the rollups from the base tables")
+	@click.option('--compact', is_flag=True, help="Fold the queued deltas into the rollups now")
+	def analytics_command(check, rebuild, compact):
+		"""
+		Check, compact or rebuild the analytics rollup tables:
+
+			python server.py analytics --check
+			python server.py analytics --rebuild
+
+		"""
+		if rebuild:
+			with engine.begin() as conn:
+				rebuild_analytics(conn)
+			click.echo("rebuilt %s" % ', '.join(ANALYTICS_ROLLUPS))
+		if compact:
+			with engine.begin() as conn:
+				folded = compact_analytics(conn)
+			click.echo("another compaction is running" if folded is None else "folded %d delta rows" % folded)
+		if check or not (rebuild or compact):
+			with engine.connect() as conn:
+				drifted = check_analytics(conn)
+			if drifted:
+				raise click.ClickException("rollups differ from the base tables: %s" % ', '.join(drifted))
+			click.echo("rollups match the base tables")
+
+	@cli.command('export-graduates')
+	@click.argument('path', default='-', type=click.Path(allow_dash=True, dir_okay=False))
+	@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), help="Defaults to the file extension")
+	@click.option('--club-id', type=int, help="Only members of this club")
+	@click.option('--year', type=int, help="Only graduates of this year")
+	def export_graduates_command(path, fmt, club_id, year):
+		"""
+		Export the map's graduates (optionally filtered) to a file or stdout:
+
+			python server.py export-graduates alumni.csv
+			python server.py export-graduates --year 2020 --format jsonl - | head
+
+		"""
+		fmt = fmt or export_format(path)
+		if fmt == 'parquet' and pyarrow is None:
+			raise click.ClickException("parquet export needs pyarrow: pip install pyarrow")
+		counts = {'rows': 0, 'bytes': 0}
+
+		def counted(chunks):
+			for chunk in chunks:
+				counts['rows'] += len(chunk)
+				yield chunk
+
+		started = time.perf_counter()
+		with engine.connect() as conn, click.open_file(path, 'wb') as out:
+			for data in EXPORT_FORMATS[fmt][1](counted(export_graduates(conn, club_id, year))):
+				data = data.encode('utf-8') if isinstance(data, str) else data
+				counts['bytes'] += len(data)
+				out.write(data)
+		click.echo("exported %d rows (%d bytes) in %.2fs" % (counts['rows'], counts['bytes'],
+		                                                    time.perf_counter() - started), err=True)
+
+	@cli.command('import-students')
+	@click.argument('path', type=click.Path(allow_dash=True, dir_okay=False))
+	@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help="Defaults to the file extension")
+	@click.option('--dry-run', is_flag=True, help="Validate and stage everything, then roll back")
+	def import_students_command(path, fmt, dry_run):
+		"""
+		Bulk import students from a CSV file (with a header row) or JSON lines:
+
+			python server.py import-students alumni.csv
+			cat alumni.jsonl | python server.py import-students --format jsonl -
+
+		"""
+		fmt = fmt or import_format(path)
+		started = time.perf_counter()
+		with click.open_file(path, encoding='utf-8-sig') as stream, engine.connect() as conn:
+			report = import_students(conn, read_import_records(stream, fmt))
+			if dry_run:
+				conn.rollback()
+			else:
+				conn.commit()
+				if report['imported']:
+					invalidate('students')
+		elapsed = time.perf_counter() - started
+		for error in report['errors']:
+			click.echo("line %d: %s" % (error['line'], error['error']), err=True)
+		if report['rejected'] > len(report['errors']):
+			click.echo("... %d more rejected rows" % (report['rejected'] - len(report['errors'])), err=True)
+		click.echo("%s %d of %d rows in %.2fs (%.0f rows/s), %d rejected" % (
+			'validated' if dry_run else 'imported', report['imported'], report['rows'], elapsed,
+			report['rows'] / elapsed if elapsed else 0, report['rejected']))
+
+	cli()
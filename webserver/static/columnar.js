@@ -0,0 +1,33 @@
+// Decoder for the columnar JSON that /api/graduates and /api/map/locations send with
+// format=columnar (encode_columnar in server.py): returns the rows as plain objects.
+// It fills one column at a time so every row gets its keys in the same order.
+function decodeColumnar(table) {
+    const rows = new Array(table.count);
+    for (let i = 0; i < table.count; i++) rows[i] = {};
+    for (const key of Object.keys(table.columns)) {
+        const values = table.columns[key];
+        const name = table.encodings[key];
+        if (name === undefined) {
+            for (let i = 0; i < table.count; i++) rows[i][key] = values[i];
+            continue;
+        }
+        const dictionary = table.dictionaries[name];
+        for (let i = 0; i < table.count; i++) {
+            const value = values[i];
+            if (value === null) {
+                rows[i][key] = null;
+            } else if (Array.isArray(value)) {
+                const items = new Array(value.length);
+                for (let j = 0; j < value.length; j++) items[j] = dictionary[value[j]];
+                rows[i][key] = items;
+            } else {
+                rows[i][key] = dictionary[value];
+            }
+        }
+    }
+    return rows;
+}
+
+if (typeof module !== 'undefined') {
+    module.exports = {decodeColumnar};
+}